@@ -1,6 +1,8 @@
 ''' Define elastic aggregation(s) to be used in a search. '''
 from elastic.query import Query
 from elastic.exceptions import AggregationError
+from elastic.frozen import freeze
+import copy
 
 
 class Aggs:
@@ -16,6 +18,12 @@ class Aggs:
                     raise AggregationError('not an aggregation')
                 self.aggs["aggregations"].update(agg.agg)
 
+    def freeze(self):
+        ''' Return an immutable copy of the aggregations (see L{elastic.frozen}). '''
+        frozen = copy.copy(self)
+        frozen.aggs = freeze(self.aggs)
+        return frozen
+
 
 class Agg:
     ''' Aggregation Builder '''
@@ -88,12 +96,8 @@ class Agg:
                 self.agg[agg_name]['aggs'].update(sub.agg)
 
     def _update_dict(self, qdict):
-        for k, v in qdict.items():
-            if isinstance(v, dict):
-                qdict[k] = self._update_dict(v)
-            else:
-                qdict[k] = self._get_query(v)
-        return qdict
+        return {k: self._update_dict(v) if isinstance(v, dict) else self._get_query(v)
+                for k, v in qdict.items()}
 
     @classmethod
     def _get_query(cls, q):
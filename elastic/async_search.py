@@ -0,0 +1,268 @@
+''' Asyncio versions of L{Search}, L{Suggest}, L{Bulk} and L{ScanAndScroll}
+for use under ASGI. They take the same arguments (L{ElasticQuery}, L{Aggs},
+L{Sort} I{etc}) and return the same L{Result} and L{Document} objects but
+the requests are made with an asyncio HTTP client (aiohttp) so an in-flight
+Elastic request does not tie up a worker thread::
+
+    result = await AsyncSearch(query, idx=idx).search()
+
+    async for resp_json in AsyncScanAndScroll(idx, query=query):
+        ...
+
+Each event loop has its own client session and connection pool, the size of
+which is set by C{ASYNC_POOL_SIZE} in the C{ELASTIC} settings (default: 20).
+'''
+import asyncio
+import logging
+import time
+
+from elastic import codec
+from elastic.elastic_settings import ElasticSettings, ElasticUrl
+from elastic.result import Columns
+from elastic.search import Search, Suggest, Bulk, ScanAndScroll
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is only required for the asyncio API
+    aiohttp = None
+
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+class AsyncResponse(object):
+    ''' Elastic response with the attributes used from a requests response. '''
+
+    def __init__(self, status_code, content, wire_bytes=None):
+        self.status_code = status_code
+        self.content = content
+        self.wire_bytes = wire_bytes if wire_bytes is not None else len(content)
+
+    def json(self):
+        return codec.response_json(self)
+
+
+class AsyncSession(object):
+    ''' Manage the aiohttp client session (connection pool) of each event loop. '''
+    SESSIONS = {}
+
+    @classmethod
+    def get_session(cls, loop=None):
+        ''' Return the client session for the event loop, creating it if needed. '''
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for the asyncio search API")
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        session = AsyncSession.SESSIONS.get(loop)
+        if session is None or session.closed:
+            limit = ElasticSettings.getattr('ASYNC_POOL_SIZE', default=20)
+            session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit))
+            AsyncSession.SESSIONS[loop] = session
+        return session
+
+    @classmethod
+    async def close(cls, loop=None):
+        ''' Close the client session of the event loop. '''
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        session = AsyncSession.SESSIONS.pop(loop, None)
+        if session is not None:
+            await session.close()
+
+    @classmethod
+    async def elastic_request(cls, elastic_url, url, data=None, is_post=True, method=None, cluster='default',
+                              call_type='search', timeout=None):
+        ''' Make GET/POST (or the given method) request and return the
+        response (L{AsyncResponse}) from elastic server. Failed requests are
+        retried on other nodes and timeouts set as for L{Search.elastic_request}. '''
+        if method is None:
+            method = 'POST' if is_post else 'GET'
+        if timeout is None:
+            timeout = ElasticSettings.timeout(call_type, cluster=cluster)
+        pool = ElasticUrl.get_pool(cluster)
+        idempotent = Search.is_idempotent(url, method)
+        max_retries = ElasticSettings.getattr('MAX_RETRIES', cluster=cluster, default=3)
+        (body, headers, body_size) = Search.encode_body(data, cluster=cluster)
+        node = pool.get(elastic_url)
+        if pool.sniffer is not None and pool.sniffer.is_due():
+            # the first sniff is made by the request so is run in an executor thread
+            await asyncio.get_event_loop().run_in_executor(None, pool.sniffer.maybe_sniff)
+            if node is not None and pool.get(elastic_url) is None:
+                # the node has been replaced by the nodes sniffed
+                elastic_url = pool.get_node().url
+                node = pool.get(elastic_url)
+        if node is not None and not pool.claim(node):
+            node = pool.get_node(exclude=[node], claim=True)
+            elastic_url = node.url
+        tried = []
+        while True:
+            start = time.perf_counter()
+            response = None
+            try:
+                response = await AsyncSession._request(method, elastic_url + '/' + url, body, headers, timeout)
+                if response.status_code not in Search.RETRY_STATUS:
+                    if node is not None:
+                        pool.mark_live(node, time.perf_counter() - start)
+                    Search.record_wire_bytes(pool, url, body, body_size, len(response.content),
+                                             response.wire_bytes)
+                    return response
+                error = None
+                retry = idempotent
+            except aiohttp.ClientConnectionError as e:
+                error = e
+                # a connector error is raised before the request is sent
+                retry = idempotent or isinstance(e, aiohttp.ClientConnectorError)
+            except asyncio.TimeoutError as e:
+                error = e
+                retry = idempotent
+            except Exception:
+                if node is not None:
+                    pool.release_probe(node)
+                raise
+
+            logger.error('Request failed ' + elastic_url + ' (' +
+                         (str(error) if error is not None else str(response.status_code)) + ')')
+            if node is None:
+                retry = False   # not a node of the cluster pool
+            else:
+                pool.mark_dead(node)
+                tried.append(node)
+            if pool.sniffer is not None:
+                await asyncio.get_event_loop().run_in_executor(None, pool.sniffer.node_failed)
+            if not retry or len(tried) > max_retries or len(tried) >= len(pool.nodes):
+                if error is not None:
+                    raise error
+                return response
+            node = pool.get_node(exclude=tried, claim=True)
+            elastic_url = node.url
+
+    @classmethod
+    async def _request(cls, method, url, data, headers, timeout):
+        session = AsyncSession.get_session()
+        client_timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        async with session.request(method, url, data=data, headers=headers, timeout=client_timeout) as response:
+            content = await response.read()
+            wire_bytes = response.content_length if response.content_length is not None else len(content)
+            return AsyncResponse(response.status, content, wire_bytes=wire_bytes)
+
+
+class AsyncSearch(Search):
+    ''' Asyncio L{Search}. Constructed in the same way as L{Search}. '''
+
+    async def get_json_response(self, query=None):
+        ''' Return the elastic json response '''
+        if query is None:
+            query = self.query
+        response = await AsyncSession.elastic_request(self.elastic_url, self.url, data=codec.dumps(query),
+                                                      timeout=self.request_timeout())
+        return self._json_response(response)
+
+    async def search(self, obj_document=ElasticSettings.get_document_factory(), stream=False):
+        ''' Run the search and return a L{Result} that stores the
+        L{Document} and L{Aggregation} objects. Streaming is not supported. '''
+        if stream:
+            raise NotImplementedError("AsyncSearch does not stream the search response")
+        return self._result(await self.get_json_response(), obj_document)
+
+    def stream_hits(self, query=None):
+        ''' Not supported, the async responses are read in full. '''
+        raise NotImplementedError("AsyncSearch does not stream the search response")
+
+    @classmethod
+    def hit_stream(cls, response):
+        ''' Not supported, the async responses are read in full. '''
+        raise NotImplementedError("AsyncSearch does not stream the search response")
+
+    async def search_columns(self, fields, scroll=False, time_to_keep_scoll=1):
+        ''' Run the search returning the hits as L{Columns} (see L{Search.search_columns}). '''
+        query = self._columns_query(fields)
+        if scroll:
+            columns = Columns(fields, idx=self.idx, query=query)
+            async for resp_json in AsyncScanAndScroll(self.idx, self.idx_type, url=self.elastic_url,
+                                                      time_to_keep_scoll=time_to_keep_scoll,
+                                                      query=self._columns_scroll_query(query, fields)):
+                columns.add_response(resp_json)
+            columns.hits_total = len(columns)
+            return columns
+        return self._columns_result(fields, query, await self.get_json_response(query=query))
+
+    async def get_count(self, filter_path=None):
+        ''' Return the elastic count for a query result '''
+        url = self.idx + '/' + self.idx_type + '/_count?'
+        if filter_path is not None:
+            url += Search.filter_path_param(filter_path)
+        data = {}
+        if hasattr(self, 'query'):
+            data = codec.dumps({k: v for k, v in self.query.items() if k != 'timeout'})
+        response = await AsyncSession.elastic_request(self.elastic_url, url, data=data)
+        return codec.response_json(response)
+
+    async def exists(self):
+        ''' Return True if any document matches the search query. '''
+        (url, data) = self._exists_request()
+        return self._exists_response(url, await AsyncSession.elastic_request(self.elastic_url, url, data=data))
+
+
+class AsyncSuggest(object):
+    ''' Asyncio L{Suggest}. '''
+
+    @classmethod
+    async def suggest(cls, term, idx, elastic_url=None,
+                      name='data', field='suggest', context=None, size=5):
+        ''' Auto completion suggestions for a given term. '''
+        if elastic_url is None:
+            elastic_url = ElasticSettings.url()
+        (url, suggest) = Suggest._suggest_request(term, idx, name, field, context, size)
+        response = await AsyncSession.elastic_request(elastic_url, url, data=codec.dumps(suggest))
+        return Suggest._suggest_response(url, response)
+
+
+class AsyncBulk(object):
+    ''' Asyncio L{Bulk}. '''
+
+    @classmethod
+    async def load(cls, idx, idx_type, json_data, elastic_url=None):
+        ''' Bulk load documents. '''
+        if elastic_url is None:
+            elastic_url = ElasticSettings.url()
+        resp = await AsyncSession.elastic_request(elastic_url, idx + '/' + idx_type + '/_bulk',
+                                                  data=json_data, method='PUT', call_type='bulk')
+        Bulk._report_errors(idx, resp)
+        return resp
+
+
+class AsyncScanAndScroll(object):
+    ''' Asyncio iterator over the pages of a scan and scroll, each page is
+    the JSON response as passed to the L{ScanAndScroll} I{call_fun}. '''
+
+    def __init__(self, idx, idx_type='', url=None, time_to_keep_scoll=1, query=None):
+        if url is None:
+            url = ElasticSettings.url()
+        self.idx = idx
+        self.idx_type = idx_type
+        self.elastic_url = url
+        (self.url_search_scan, self.url_scan_scroll, self.query) = \
+            ScanAndScroll._scan_request(idx, idx_type, time_to_keep_scoll, query)
+        self._scroll_id = None
+        self.count = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._scroll_id is None:
+            response = await AsyncSession.elastic_request(self.elastic_url, self.url_search_scan,
+                                                          data=codec.dumps(self.query))
+            self._scroll_id = codec.response_json(response)['_scroll_id']
+
+        response = await AsyncSession.elastic_request(self.elastic_url, self.url_scan_scroll,
+                                                      data=self._scroll_id)
+        resp_json = codec.response_json(response)
+        self._scroll_id = resp_json['_scroll_id']
+        nhits = len(resp_json['hits']['hits'])
+        if nhits == 0:
+            logger.debug("Scanned No. Docs ( "+self.idx+"/"+self.idx_type+" ) = "+str(self.count))
+            raise StopAsyncIteration
+        self.count += nhits
+        return resp_json
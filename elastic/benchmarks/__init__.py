@@ -0,0 +1,12 @@
+''' Benchmarks for the hot paths of the package, run as modules, I{e.g.}::
+
+    python -m elastic.benchmarks.codec
+
+Apart from L{elastic.benchmarks.binning} these do not need a running Elastic server.
+'''
+import timeit
+
+
+def best_time(fun, number=1, repeat=5):
+    ''' Return the best time (seconds) for a single call of a function. '''
+    return min(timeit.repeat(fun, number=number, repeat=repeat)) / number
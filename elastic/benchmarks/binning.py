@@ -0,0 +1,113 @@
+''' Benchmark range overlap queries with and without genomic bins (L{Binning})
+on a synthetic index of GFF like features. This needs an Elastic server; the
+index is created and loaded (unless it exists) and is kept for later runs::
+
+    python -m elastic.benchmarks.binning --url http://localhost:9200 [--docs 10000000]
+'''
+import argparse
+import random
+import statistics
+import time
+
+from elastic import codec
+from elastic.binning import Binning
+
+
+# GRCh38 lengths of chromosomes 1-22
+CHROM_LENGTHS = (248956422, 242193529, 198295559, 190214555, 181538259, 170805979, 159345973,
+                 145138636, 138394717, 133797422, 135086622, 133275309, 114364328, 107043718,
+                 101991189, 90338345, 83257441, 80373285, 58617616, 64444167, 46709983, 50818468)
+
+
+def features(ndocs, seed=1):
+    ''' Yield features with lengths from 50bp to 2Mb (mostly short). '''
+    rand = random.Random(seed)
+    for i in range(ndocs):
+        chrom = rand.randrange(len(CHROM_LENGTHS))
+        length = int(10 ** rand.uniform(1.7, 6.3))
+        start = rand.randint(1, CHROM_LENGTHS[chrom])
+        end = start + length
+        yield {"seqid": str(chrom + 1), "type": "exon", "start": start, "end": end,
+               "bin": Binning.bin_from_range(start, end), "name": "F%d" % i}
+
+
+def regions(nregions, size, seed=2):
+    ''' Return random regions (seqid, start, end) of the given size. '''
+    rand = random.Random(seed)
+    regs = []
+    for _ in range(nregions):
+        chrom = rand.randrange(len(CHROM_LENGTHS))
+        start = rand.randint(1, CHROM_LENGTHS[chrom] - size)
+        regs.append((str(chrom + 1), start, start + size))
+    return regs
+
+
+def create_index(idx, ndocs, chunk=20000):
+    ''' Create and load the benchmark index. '''
+    from elastic.search import Bulk, Search
+    from elastic.elastic_settings import ElasticSettings
+    mapping = {"settings": {"number_of_shards": 5, "refresh_interval": "-1"},
+               "mappings": {"feature": {"properties": {
+                   "seqid": {"type": "string", "index": "not_analyzed"},
+                   "type": {"type": "string", "index": "not_analyzed"},
+                   "start": {"type": "integer"}, "end": {"type": "integer"}, "bin": {"type": "integer"},
+                   "name": {"type": "string", "index": "not_analyzed"}}}}}
+    Search.elastic_request(ElasticSettings.url(), idx, data=codec.dumps(mapping), method='PUT', call_type='admin')
+    json_data = bytearray()
+    for (i, doc) in enumerate(features(ndocs)):
+        json_data += b'{"index":{"_id":"%d"}}\n' % i
+        json_data += codec.dumps(doc) + b'\n'
+        if (i + 1) % chunk == 0:
+            Bulk.load(idx, 'feature', json_data)
+            json_data = bytearray()
+            print('.', end="", flush=True)
+    if len(json_data) > 0:
+        Bulk.load(idx, 'feature', json_data)
+    Search.elastic_request(ElasticSettings.url(), idx + '/_settings', method='PUT', call_type='admin',
+                           data=codec.dumps({"index": {"refresh_interval": "1s"}}))
+    Search.elastic_request(ElasticSettings.url(), idx + '/_refresh', call_type='admin')
+    print()
+
+
+def run(idx, nregions=200, size=1000000, hits=100):
+    ''' Return the latencies (client seconds and Elastic took milliseconds) of
+    overlap queries for random regions, with (binned) and without (range) the bins. '''
+    from elastic.search import Search
+    results = {'range': {'latency': [], 'took': []}, 'binned': {'latency': [], 'took': []}}
+    for (seqid, start, end) in regions(nregions, size):
+        totals = []
+        for (name, bin_param) in (('range', False), ('binned', 'bin')):
+            search = Search.range_overlap_query(seqid, start, end, idx=idx, size=hits, bin_param=bin_param)
+            t0 = time.perf_counter()
+            json_response = search.get_json_response()
+            results[name]['latency'].append(time.perf_counter() - t0)
+            results[name]['took'].append(json_response['took'])
+            totals.append(json_response['hits']['total'])
+        if totals[0] != totals[1]:
+            raise AssertionError('Different hits for ' + str((seqid, start, end)) + ': ' + str(totals))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark binned range overlap queries.')
+    parser.add_argument('--url', default='http://localhost:9200', help='Elastic URL')
+    parser.add_argument('--idx', default='bench_binning', help='Index name')
+    parser.add_argument('--docs', type=int, default=10000000, help='Number of features to load')
+    parser.add_argument('--regions', type=int, default=200, help='Number of regions queried')
+    parser.add_argument('--size', type=int, default=1000000, help='Region size (bp)')
+    args = parser.parse_args()
+
+    from django.conf import settings
+    settings.configure(ELASTIC={'default': {'ELASTIC_URL': args.url, 'IDX': {'DEFAULT': args.idx}}})
+    from elastic.search import Search
+    from elastic.elastic_settings import ElasticSettings
+    if Search.elastic_request(ElasticSettings.url(), args.idx, is_post=False, call_type='admin').status_code != 200:
+        create_index(args.idx, args.docs)
+
+    Search.range_overlap_query('1', 1, 1000, idx=args.idx).get_json_response()    # warm up
+    print('%-8s %12s %12s %12s %12s' % ('query', 'mean ms', 'median ms', 'p95 ms', 'took ms'))
+    for (name, times) in run(args.idx, args.regions, args.size).items():
+        latency = sorted(t * 1000 for t in times['latency'])
+        print('%-8s %12.2f %12.2f %12.2f %12.1f' % (name, statistics.mean(latency), statistics.median(latency),
+                                                  latency[int(len(latency) * 0.95) - 1],
+                                                  statistics.mean(times['took'])))
@@ -0,0 +1,79 @@
+''' Benchmark the JSON codecs (L{elastic.codec}) encoding bulk load lines,
+as the loaders do, and decoding search responses::
+
+    python -m elastic.benchmarks.codec [--docs 10000] [--repeat 5]
+'''
+import argparse
+import random
+
+from elastic import codec
+from elastic.benchmarks import best_time
+
+
+def gff_docs(ndocs, seed=1):
+    ''' Return GFF like documents as indexed by the GFF loader. '''
+    rand = random.Random(seed)
+    docs = []
+    for i in range(ndocs):
+        start = rand.randint(1, 248956422)
+        docs.append({"seqid": str(rand.randint(1, 22)), "source": "ensembl_havana", "type": "exon",
+                     "start": start, "end": start + rand.randint(50, 5000), "score": ".",
+                     "strand": rand.choice("+-"), "phase": ".",
+                     "attr": {"gene_id": "ENSG%011d" % i, "transcript_id": "ENST%011d" % i,
+                              "gene_name": "GENE%d" % i, "gene_biotype": "protein_coding"}})
+    return docs
+
+
+def search_response(docs):
+    ''' Return the encoded search response for the documents as hits. '''
+    hits = [{"_index": "bench_idx", "_type": "gff", "_id": str(i), "_score": 1.0, "_source": doc}
+            for i, doc in enumerate(docs)]
+    resp = {"took": 12, "timed_out": False, "_shards": {"total": 5, "successful": 5, "failed": 0},
+            "hits": {"total": len(hits), "max_score": 1.0, "hits": hits}}
+    return codec.get_codec('json').dumps(resp)
+
+
+def bulk_encode(json_codec, docs):
+    ''' Encode the documents as bulk load lines. '''
+    json_data = bytearray()
+    for i, doc in enumerate(docs):
+        json_data += b'{"index":{"_id":"%d"}}\n' % i
+        json_data += json_codec.dumps(doc) + b'\n'
+    return json_data
+
+
+def available_codecs():
+    ''' Return the names of the codecs that can be imported. '''
+    names = []
+    for name in codec.CODECS:
+        try:
+            codec.get_codec(name)
+            names.append(name)
+        except ImportError:
+            pass
+    return names
+
+
+def run(ndocs=10000, repeat=5, codecs=None):
+    ''' Return the loader encode and search decode throughput (documents per
+    second) for each codec. '''
+    docs = gff_docs(ndocs)
+    content = search_response(docs)
+    results = {}
+    for name in (codecs if codecs is not None else available_codecs()):
+        json_codec = codec.get_codec(name)
+        encode = best_time(lambda: bulk_encode(json_codec, docs), repeat=repeat)
+        decode = best_time(lambda: json_codec.loads(content), repeat=repeat)
+        results[name] = {'encode': ndocs / encode, 'decode': ndocs / decode}
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the JSON codecs.')
+    parser.add_argument('--docs', type=int, default=10000, help='Number of documents')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of repeats (best is reported)')
+    args = parser.parse_args()
+
+    print('%-8s %18s %18s' % ('codec', 'loader encode/s', 'search decode/s'))
+    for (name, rates) in run(args.docs, args.repeat).items():
+        print('%-8s %18d %18d' % (name, rates['encode'], rates['decode']))
@@ -0,0 +1,88 @@
+''' Benchmark parsing and encoding gene target (promoter capture) rows, as
+the gene target loader does, with the generic column parsing and with the
+planned converters (with and without dropping zero scores)::
+
+    python -m elastic.benchmarks.gene_target [--rows 50000] [--tissues 17] [--codec json]
+'''
+import argparse
+import random
+
+from elastic import codec
+from elastic.benchmarks import best_time
+
+
+COLUMNS = ["ensg", "name", "biotype", "strand", "baitChr", "baitStart", "baitEnd", "baitID", "baitName",
+           "oeChr", "oeStart", "oeEnd", "oeID", "oeName", "dist"]
+
+
+def rows(nrows, ntissues, seed=1):
+    ''' Return split rows with mostly zero tissue scores. '''
+    rand = random.Random(seed)
+    lines = []
+    for i in range(nrows):
+        start = rand.randint(1, 248956422)
+        parts = ['ENSG%011d' % i, 'GENE%d' % i, 'protein_coding', rand.choice('+-'), '1', str(start),
+                 str(start + 5000), str(i), 'BAIT%d' % i, '1', str(start + 20000), str(start + 24000),
+                 str(i + 1), 'OE%d' % i, str(rand.randint(-100000, 100000))]
+        parts.extend('%.9f' % rand.uniform(0, 20) if rand.random() < 0.3 else '0' for _ in range(ntissues))
+        lines.append('\t'.join(parts).split('\t'))
+    return lines
+
+
+def loader(ntissues, planned, drop_scores=False):
+    ''' Return a gene target loader with the mapping properties set (no server needed). '''
+    from elastic.management.loaders.gene_target import GeneTargetManager
+    gt = GeneTargetManager()
+    GeneTargetManager.tissue_types = ['tissue%d' % i for i in range(ntissues)]
+    props = {name: {"type": "string"} for name in COLUMNS}
+    for name in ("baitStart", "baitEnd", "oeStart", "oeEnd", "dist"):
+        props[name] = {"type": "integer"}
+    props.update({tt: {"type": "float"} for tt in GeneTargetManager.tissue_types})
+    gt.mapping_json = {"gene_target": {"properties": props}}
+    if planned:
+        gt.converters = gt._plan_converters(COLUMNS)
+        gt.drop_scores = drop_scores
+    return gt
+
+
+def parse_encode(gt, lines, column_names, json_codec):
+    ''' Parse the rows and encode them as bulk load lines. '''
+    json_data = bytearray()
+    for (i, parts) in enumerate(lines):
+        json_data += b'{"index":{"_id":"%d"}}\n' % i
+        json_data += json_codec.dumps(gt.parse_line(parts, column_names, 'bench', 'gene_target',
+                                                    False, False)) + b'\n'
+    return json_data
+
+
+def run(nrows=50000, ntissues=17, repeat=3, codec_name='json'):
+    ''' Return the rows per second and the bulk request size for each loading path. '''
+    from elastic.management.loaders.loader import DelimeterLoader
+    lines = rows(nrows, ntissues)
+    json_codec = codec.get_codec(codec_name)
+    column_names = COLUMNS + ['tissue%d' % i for i in range(ntissues)]
+    results = {}
+    for (name, gt) in (('generic', loader(ntissues, False)), ('planned', loader(ntissues, True)),
+                       ('planned, drop zero', loader(ntissues, True, True))):
+        if name == 'generic':
+            # the generic DelimeterLoader parsing used before the planned converters
+            gt.parse_line = lambda *args, gt=gt: DelimeterLoader.parse_line(gt, *args)
+        seconds = best_time(lambda: parse_encode(gt, lines, column_names, json_codec), repeat=repeat)
+        results[name] = (nrows / seconds, len(parse_encode(gt, lines, column_names, json_codec)))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark gene target row loading.')
+    parser.add_argument('--rows', type=int, default=50000, help='Number of rows')
+    parser.add_argument('--tissues', type=int, default=17, help='Number of tissue columns')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repeats (best is reported)')
+    parser.add_argument('--codec', default='json', help='JSON codec (json, orjson or ujson)')
+    args = parser.parse_args()
+
+    from django.conf import settings
+    settings.configure(ELASTIC={'default': {'ELASTIC_URL': 'http://localhost:9200', 'IDX': {'DEFAULT': 'bench'}}})
+
+    print('%-20s %12s %14s' % ('path', 'rows/s', 'bulk MB'))
+    for (name, (rate, size)) in run(args.rows, args.tissues, args.repeat, args.codec).items():
+        print('%-20s %12d %14.1f' % (name, rate, size / 1e6))
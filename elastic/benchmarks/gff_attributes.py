@@ -0,0 +1,63 @@
+''' Benchmark parsing the GTF attributes column (L{GFF.parse_attributes}), as
+the GFF loader does, against the previous regular expression parser. The
+lines of the test GTF file are repeated to the number of lines parsed::
+
+    python -m elastic.benchmarks.gff_attributes [--gtf test.gtf.gz] [--lines 100000]
+'''
+import argparse
+import gzip
+import os
+import re
+
+from elastic.benchmarks import best_time
+from elastic.management.loaders.utils import GFF
+
+
+TEST_GTF = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tests', 'data', 'test.gtf.gz')
+
+
+def attribute_columns(gtf, nlines):
+    ''' Return the attributes column of the GTF lines repeated to I{nlines}. '''
+    with gzip.open(gtf, 'rt') if gtf.endswith('.gz') else open(gtf) as f:
+        columns = [line.rstrip('\n').split('\t')[8] for line in f if not line.startswith('#')]
+    return (columns * (nlines // len(columns) + 1))[:nlines]
+
+
+def regex_attributes(attrs, key_value_delim=' '):
+    ''' The regular expression parser used before L{GFF.parse_attributes}. '''
+    parts = re.split(';', attrs)
+    attrs_arr = {}
+    for p in parts:
+        if(p == ''):
+            continue
+        at = re.split(key_value_delim, p.strip())
+        if len(at) == 2:
+            attrs_arr[at[0]] = at[1]
+        else:
+            attrs_arr[at[0]] = ""
+    return attrs_arr
+
+
+def run(gtf=TEST_GTF, nlines=100000, repeat=5):
+    ''' Return the lines parsed per second by each parser. '''
+    columns = attribute_columns(gtf, nlines)
+    keys = frozenset(['gene_id', 'gene_name', 'transcript_id', 'gene_biotype'])
+    parsers = {
+        'regex': lambda: [regex_attributes(c) for c in columns],
+        'parse_attributes': lambda: [GFF.parse_attributes(c, key_value_delim=' ') for c in columns],
+        'parse_attributes (4 keys)': lambda: [GFF.parse_attributes(c, key_value_delim=' ', keys=keys)
+                                              for c in columns],
+    }
+    return {name: nlines / best_time(fun, repeat=repeat) for (name, fun) in parsers.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the GTF attribute parsers.')
+    parser.add_argument('--gtf', default=TEST_GTF, help='GTF file (default: the test GTF)')
+    parser.add_argument('--lines', type=int, default=100000, help='Number of lines parsed')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of repeats (best is reported)')
+    args = parser.parse_args()
+
+    print('%-28s %14s' % ('parser', 'lines/s'))
+    for (name, rate) in run(args.gtf, args.lines, args.repeat).items():
+        print('%-28s %14d' % (name, rate))
@@ -0,0 +1,88 @@
+''' UCSC style hierarchical binning of genomic features for range overlap queries.
+
+A feature is assigned the smallest bin that contains it, from a hierarchy of
+bins of 128kb, 1Mb, 8Mb, 64Mb and 512Mb (and an extended 4Gb level for
+features ending past 512Mb), see
+U{Kent I{et al.} 2002<https://doi.org/10.1101/gr.229102>}. The features that
+overlap a region can only be in the few bins returned by
+L{Binning.overlapping_bins}, so a C{terms} filter on the bin field limits the
+documents the precise C{range} checks are run on (see
+L{ElasticUtils.range_overlap_query}).
+
+Positions are the start and end (inclusive) of features as stored in the
+indices. Loaders add the bin to each document with the C{--bins} option.
+'''
+
+
+class Binning(object):
+    ''' Compute the bins for genomic ranges. '''
+    FIRST_SHIFT = 17    # 128kb bins at the lowest level
+    NEXT_SHIFT = 3      # each level has bins 8 times larger
+    OFFSETS = (512+64+8+1, 64+8+1, 8+1, 1, 0)
+    OFFSETS_EXTENDED = (4096+512+64+8+1, 512+64+8+1, 64+8+1, 8+1, 1, 0)
+    OFFSET_OLD_TO_EXTENDED = 4681
+    MAX_END = 1 << 29          # 512Mb
+    MAX_END_EXTENDED = 1 << 31
+    MAX_QUERY_BINS = 1024      # larger ranges (over ~60Mb) are not filtered on the bins
+
+    @classmethod
+    def bin_from_range(cls, start, end):
+        ''' Return the bin of a feature.
+        @type  start: int
+        @param start: Start position.
+        @type  end: int
+        @param end: End position (inclusive).
+        @return: int
+        '''
+        (start, end) = Binning._half_open(start, end)
+        if end <= Binning.MAX_END:
+            return Binning._bin(start, end, Binning.OFFSETS, 0)
+        if end <= Binning.MAX_END_EXTENDED:
+            return Binning._bin(start, end, Binning.OFFSETS_EXTENDED, Binning.OFFSET_OLD_TO_EXTENDED)
+        raise ValueError('Range ' + str(start) + '-' + str(end) + ' past the maximum binned position')
+
+    @classmethod
+    def overlapping_bins(cls, start, end):
+        ''' Return the bins of the features that can overlap a range.
+        @type  start: int
+        @param start: Start position.
+        @type  end: int
+        @param end: End position (inclusive).
+        @return: list
+        '''
+        (start, end) = Binning._half_open(start, end)
+        bins = []
+        if start < Binning.MAX_END:
+            bins.extend(Binning._bins(start, min(end, Binning.MAX_END), Binning.OFFSETS, 0))
+        # features ending past 512Mb are in the extended bins
+        bins.extend(Binning._bins(start, min(end, Binning.MAX_END_EXTENDED), Binning.OFFSETS_EXTENDED,
+                                  Binning.OFFSET_OLD_TO_EXTENDED))
+        return bins
+
+    @classmethod
+    def _half_open(cls, start, end):
+        ''' Return the zero-based, half-open range. '''
+        start = max(start - 1, 0)
+        return (start, max(end, start + 1))
+
+    @classmethod
+    def _bin(cls, start, end, offsets, base):
+        start_bin = start >> Binning.FIRST_SHIFT
+        end_bin = (end - 1) >> Binning.FIRST_SHIFT
+        for offset in offsets:
+            if start_bin == end_bin:
+                return base + offset + start_bin
+            start_bin >>= Binning.NEXT_SHIFT
+            end_bin >>= Binning.NEXT_SHIFT
+        raise ValueError('Range ' + str(start) + '-' + str(end) + ' past the maximum binned position')
+
+    @classmethod
+    def _bins(cls, start, end, offsets, base):
+        start_bin = start >> Binning.FIRST_SHIFT
+        end_bin = (end - 1) >> Binning.FIRST_SHIFT
+        bins = []
+        for offset in offsets:
+            bins.extend(range(base + offset + start_bin, base + offset + end_bin + 1))
+            start_bin >>= Binning.NEXT_SHIFT
+            end_bin >>= Binning.NEXT_SHIFT
+        return bins
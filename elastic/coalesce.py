@@ -0,0 +1,85 @@
+''' Coalescing (single-flight) of identical concurrent requests.
+
+While a request is in flight, identical requests (I{e.g.} the same search from
+many Django threads for a popular page) wait for it and share its response
+rather than each being sent to Elastic. Only reads that can be shared are
+coalesced (see L{Search.is_coalesced}) and each caller gets its own copy of
+the shared response, so the decoded JSON can be modified. Coalescing is on by default and can be turned off for a cluster
+with C{'COALESCE_REQUESTS': False} in the C{ELASTIC} settings. The counts are
+available from the cluster node pool::
+
+    ElasticUrl.get_pool().coalescer.as_dict()
+'''
+import logging
+import threading
+
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+class _Call(object):
+    ''' A call in flight. '''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    ''' Run a call once for all the callers with the same key while it is in flight. '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, fun, share=None):
+        ''' Return the result of I{fun}, or the result of the call in flight with
+        the same key. An exception raised by the call is raised for each caller.
+        @type  share: function
+        @keyword share: Function returning a copy of the result for each caller
+        when the result is shared (default: the callers share the result).
+        '''
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            logger.debug('Coalesced request: ' + str(key[:3]))
+            if call.error is not None:
+                raise call.error
+            return call.result if share is None else share(call.result)
+
+        try:
+            call.result = fun()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        if share is not None and call.waiters > 0:
+            return share(call.result)
+        return call.result
+
+    def in_flight(self):
+        ''' Return the number of calls in flight. '''
+        with self._lock:
+            return len(self._calls)
+
+    def as_dict(self):
+        ''' Return the number of calls made and the number coalesced. '''
+        with self._lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced}
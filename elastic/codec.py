@@ -0,0 +1,112 @@
+''' JSON codec used to encode request bodies and decode Elastic responses.
+Bodies are encoded directly to (UTF-8) bytes and decoded from bytes. The codec
+is set by C{JSON_CODEC} in the C{ELASTIC} settings; 'json' (the standard
+library, default), 'orjson', 'ujson' or the import path of an object with
+C{dumps(obj, sort_keys=False)} and C{loads(data)} functions::
+
+    body = codec.dumps(query)
+    resp_json = codec.response_json(response)
+
+L{response_json} decodes a response once and keeps the result on the
+response so repeated calls do not decode it again.
+'''
+import json
+
+from django.utils.module_loading import import_string
+
+from elastic.frozen import FrozenDict
+
+try:
+    import orjson
+except ImportError:  # optional codec
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # optional codec
+    ujson = None
+
+
+class StdlibCodec(object):
+    ''' Codec using the standard library json module. '''
+    name = 'json'
+
+    @staticmethod
+    def dumps(obj, sort_keys=False):
+        return json.dumps(obj, separators=(',', ':'), sort_keys=sort_keys, ensure_ascii=False).encode('utf-8')
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+
+class OrjsonCodec(object):
+    ''' Codec using orjson. '''
+    name = 'orjson'
+
+    @staticmethod
+    def dumps(obj, sort_keys=False):
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option)
+
+    @staticmethod
+    def loads(data):
+        return orjson.loads(data)
+
+
+class UjsonCodec(object):
+    ''' Codec using ujson. '''
+    name = 'ujson'
+
+    @staticmethod
+    def dumps(obj, sort_keys=False):
+        return ujson.dumps(obj, sort_keys=sort_keys, ensure_ascii=False).encode('utf-8')
+
+    @staticmethod
+    def loads(data):
+        return ujson.loads(data)
+
+
+CODECS = {'json': (StdlibCodec, json), 'orjson': (OrjsonCodec, orjson), 'ujson': (UjsonCodec, ujson)}
+
+
+def get_codec(name=None):
+    ''' Return the codec with the given name or import path, by default the one
+    set by C{JSON_CODEC} in the settings. '''
+    if name is None:
+        from elastic.elastic_settings import ElasticSettings
+        name = ElasticSettings.getattr('JSON_CODEC', default='json')
+    if not isinstance(name, str):
+        return name
+    if name in CODECS:
+        (codec, module) = CODECS[name]
+        if module is None:
+            raise ImportError(name + " is required for the JSON_CODEC setting")
+        return codec
+    return import_string(name)
+
+
+def dumps(obj, sort_keys=False):
+    ''' Encode an object as JSON bytes. The encoding of a L{FrozenDict} is
+    cached on it. '''
+    if isinstance(obj, FrozenDict) and not sort_keys:
+        if obj._json is None:
+            obj._json = get_codec().dumps(obj)
+        return obj._json
+    return get_codec().dumps(obj, sort_keys=sort_keys)
+
+
+def loads(data):
+    ''' Decode JSON from bytes (or a string). '''
+    return get_codec().loads(data)
+
+
+def response_json(response):
+    ''' Return the decoded JSON content of a response, decoding it only once. '''
+    try:
+        return response._elastic_json
+    except AttributeError:
+        response._elastic_json = get_codec().loads(response.content)
+        return response._elastic_json
@@ -0,0 +1,127 @@
+''' Run independent Elastic requests concurrently on a shared, bounded thread
+pool. This is for fan-out that cannot be combined into a single multi-search
+request, I{e.g.} requests to different clusters or to different endpoints::
+
+    gathered = gather([Search(query1, idx=idx1).search,
+                       functools.partial(Suggest.suggest, term, idx2),
+                       Search(query2, idx=idx3).get_count], timeout=5)
+    (result1, suggestions, count) = gathered.results
+
+The results are returned in the order of the calls. The size of the pool is
+set by C{CONCURRENT_POOL_SIZE} in the C{ELASTIC} settings (default: 10).
+As the pool is shared and bounded, the calls passed to L{gather} should not
+themselves call L{gather}.
+'''
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import logging
+import threading
+import time
+
+from elastic.elastic_settings import ElasticSettings
+
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+class Gathered(object):
+    ''' Results of L{gather}. Each list is in the order of the calls;
+    I{results} holds the return values, I{timings} the time (seconds) each
+    call took (None if it did not complete), I{errors} any exception raised
+    by a call (or a C{TimeoutError}) and I{elapsed} is the wall-clock time. '''
+
+    def __init__(self, results, timings, errors, elapsed):
+        self.results = results
+        self.timings = timings
+        self.errors = errors
+        self.elapsed = elapsed
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __getitem__(self, index):
+        return self.results[index]
+
+    def __len__(self):
+        return len(self.results)
+
+
+class ElasticExecutor(object):
+    ''' Manage the thread pool shared by L{gather} calls. '''
+    _executor = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_executor(cls):
+        ''' Return the shared thread pool, creating it if needed. '''
+        if ElasticExecutor._executor is None:
+            with ElasticExecutor._lock:
+                if ElasticExecutor._executor is None:
+                    max_workers = ElasticSettings.getattr('CONCURRENT_POOL_SIZE', default=10)
+                    ElasticExecutor._executor = ThreadPoolExecutor(max_workers=max_workers)
+        return ElasticExecutor._executor
+
+    @classmethod
+    def shutdown(cls, wait=True):
+        ''' Shutdown the shared thread pool. '''
+        with ElasticExecutor._lock:
+            if ElasticExecutor._executor is not None:
+                ElasticExecutor._executor.shutdown(wait=wait)
+                ElasticExecutor._executor = None
+
+
+def _timed_call(fn):
+    start = time.perf_counter()
+    result = fn()
+    return (result, time.perf_counter() - start)
+
+
+def gather(calls, timeout=None, return_exceptions=False):
+    ''' Run the callables concurrently and return a L{Gathered} with the results
+    in the same order as I{calls}.
+    @type  calls: list
+    @param calls: Callables taking no arguments (I{e.g.} C{Search(...).search}
+    or a C{functools.partial}).
+    @type  timeout: float
+    @keyword timeout: Seconds allowed for each call, measured from when the
+    calls are submitted. A call that has not completed in time is given a
+    C{TimeoutError}.
+    @type  return_exceptions: bool
+    @keyword return_exceptions: If False (default) the first error (in call
+    order) is raised, otherwise errors are returned in place of the results.
+    '''
+    executor = ElasticExecutor.get_executor()
+    start = time.perf_counter()
+    futures = [executor.submit(_timed_call, fn) for fn in calls]
+
+    results = []
+    timings = []
+    errors = []
+    for future in futures:
+        try:
+            if timeout is None:
+                (result, timing) = future.result()
+            else:
+                (result, timing) = future.result(timeout=max(0, start + timeout - time.perf_counter()))
+            results.append(result)
+            timings.append(timing)
+            errors.append(None)
+        except TimeoutError as e:
+            future.cancel()
+            logger.warning("Concurrent elastic call timed out after " + str(timeout) + "s")
+            results.append(e if return_exceptions else None)
+            timings.append(None)
+            errors.append(e)
+        except Exception as e:
+            results.append(e if return_exceptions else None)
+            timings.append(None)
+            errors.append(e)
+
+    elapsed = time.perf_counter() - start
+    logger.debug("Concurrent elastic calls (" + str(len(futures)) + ") took " + str(elapsed) +
+                 "s; sum of calls " + str(sum(t for t in timings if t is not None)) + "s")
+    if not return_exceptions:
+        for e in errors:
+            if e is not None:
+                raise e
+    return Gathered(results, timings, errors, elapsed)
@@ -1,10 +1,12 @@
 ''' Used to manage and retrieve Elastic settings. '''
 import logging
+import threading
 
 from django.conf import settings
 from django.utils.module_loading import import_string
 
 from elastic.exceptions import SettingsError
+from elastic.nodes import NodePool, Sniffer
 from elastic.result import Document
 
 
@@ -76,6 +78,22 @@ class ElasticSettings:
         ''' Return the Elastic URL '''
         return ElasticUrl.get_url(cluster='default')
 
+    DEFAULT_TIMEOUTS = {'search': (5, 30), 'bulk': (5, 300), 'admin': (5, 300)}
+
+    @classmethod
+    def timeout(cls, call_type='search', cluster='default'):
+        ''' Return the (connect, read) timeouts in seconds for a type of call
+        ('search', 'bulk' or 'admin'). These can be set for each cluster with
+        C{TIMEOUTS} in the settings, I{e.g.} C{{'search': (3, 10), 'bulk': 120}}
+        (a single value is used for both the connect and read timeouts). '''
+        timeouts = cls.getattr('TIMEOUTS', cluster=cluster, default={})
+        timeout = timeouts.get(call_type, ElasticSettings.DEFAULT_TIMEOUTS.get(call_type))
+        if timeout is None:
+            raise SettingsError('Unknown call type for timeout: ' + str(call_type))
+        if isinstance(timeout, (int, float)):
+            return (timeout, timeout)
+        return tuple(timeout)
+
     @classmethod
     def get_idx_types(cls, idx_name='DEFAULT', cluster='default', user=None):
         idxs = cls.getattr('IDX', cluster=cluster)
@@ -175,31 +193,69 @@ class ElasticSettings:
 
 
 class ElasticUrl(object):
-    ''' Manage elastic urls settings. '''
-    URL_INDEX = 0
+    ''' Manage elastic urls settings. The urls (C{ELASTIC_URL}) of each cluster
+    are held in a L{NodePool} that tracks the health of the nodes. '''
+    POOLS = {}
+    _lock = threading.Lock()
 
     @classmethod
-    def get_url(cls, cluster='default'):
+    def get_pool(cls, cluster='default'):
+        ''' Return the L{NodePool} for the cluster urls. The nodes are sniffed
+        (see L{Sniffer}) when requests are made, not when the pool is created. '''
         urls = ElasticSettings.getattr('ELASTIC_URL', cluster=cluster)
         if isinstance(urls, str):
-            return urls
-        try:
-            return urls[ElasticUrl.URL_INDEX]
-        except IndexError:
-            ElasticUrl.URL_INDEX = 0
-            return urls[ElasticUrl.URL_INDEX]
+            urls = [urls]
+        key = (cluster, tuple(urls))
+        pool = ElasticUrl.POOLS.get(key)
+        if pool is None:
+            with ElasticUrl._lock:
+                pool = ElasticUrl.POOLS.get(key)
+                if pool is None:
+                    pool = NodePool(urls,
+                                    selector=ElasticSettings.getattr('NODE_SELECTOR', cluster=cluster,
+                                                                     default=NodePool.ROUND_ROBIN),
+                                    dead_timeout=ElasticSettings.getattr('DEAD_TIMEOUT', cluster=cluster,
+                                                                         default=60),
+                                    max_dead_timeout=ElasticSettings.getattr('MAX_DEAD_TIMEOUT', cluster=cluster,
+                                                                             default=1800),
+                                    failure_threshold=ElasticSettings.getattr('CIRCUIT_BREAKER_THRESHOLD',
+                                                                              cluster=cluster, default=5))
+                    pool.sniffer = ElasticUrl._get_sniffer(pool, cluster)
+                    ElasticUrl.POOLS[key] = pool
+        return pool
 
     @classmethod
-    def rotate_url(cls, cluster='default'):
-        ''' Rotate the host used in an array of elastic urls. '''
-        urls = ElasticSettings.getattr('ELASTIC_URL', cluster=cluster)
-        if isinstance(urls, str):
+    def _get_sniffer(cls, pool, cluster='default'):
+        ''' Return a L{Sniffer} for the pool if sniffing is enabled in the settings. '''
+        interval = ElasticSettings.getattr('SNIFF_INTERVAL', cluster=cluster)
+        on_start = ElasticSettings.getattr('SNIFF_ON_START', cluster=cluster, default=False)
+        on_failure = ElasticSettings.getattr('SNIFF_ON_FAILURE', cluster=cluster, default=False)
+        if interval is None and not on_start and not on_failure:
+            return None
+        node_filter = ElasticSettings.getattr('SNIFF_NODE_FILTER', cluster=cluster)
+        if isinstance(node_filter, str):
+            node_filter = import_string(node_filter)
+        return Sniffer(pool, interval=interval, on_start=on_start, on_failure=on_failure, node_filter=node_filter)
+
+    @classmethod
+    def get_url(cls, cluster='default'):
+        ''' Return the url of the next node to send a request to. '''
+        return ElasticUrl.get_pool(cluster).get_node().url
+
+    @classmethod
+    def rotate_url(cls, cluster='default', url=None):
+        ''' Mark the node with the url as failed so that L{get_url} selects
+        another of the elastic urls. '''
+        pool = ElasticUrl.get_pool(cluster)
+        if len(pool.nodes) == 1:
             logger.warn("Just one elastic url (ELASTIC_URL) defined.")
             return
+        node = pool.get(url)
+        if node is not None:
+            pool.mark_dead(node)
 
-        logger.debug("Rotate old HOST_INDEX = "+str(ElasticUrl.URL_INDEX))
-        if len(urls) <= (ElasticUrl.URL_INDEX+1):
-            ElasticUrl.URL_INDEX = 0
-        else:
-            ElasticUrl.URL_INDEX += 1
-        logger.debug("Rotate new HOST_INDEX = "+str(ElasticUrl.URL_INDEX))
+    @classmethod
+    def reset(cls):
+        ''' Discard the node pools and their health state. '''
+        with ElasticUrl._lock:
+            ElasticUrl.POOLS = {}
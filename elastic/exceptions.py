@@ -23,3 +23,9 @@ class AggregationError(Exception):
     ''' Aggregation error  '''
     def __init__(self, value):
         self.value = value
+
+
+class NodeUnavailableError(Exception):
+    ''' No elastic node available (circuit breakers open) '''
+    def __init__(self, value):
+        self.value = value
@@ -0,0 +1,71 @@
+''' Immutable JSON structures for queries that are built once and reused.
+
+L{freeze} returns a deep immutable copy of a JSON structure; dictionaries
+become L{FrozenDict}s and lists become tuples. A L{FrozenDict} is hashable by
+content, so it can be used as a cache key, and its JSON encoding is cached
+(see L{elastic.codec.dumps}). Frozen parts are shared rather than copied
+when composed into larger queries::
+
+    GENE_QUERY = ElasticQuery(Query.term("biotype", "protein_coding")).freeze()
+    ...
+    result = Search(GENE_QUERY, aggs=aggs, idx=idx).search()
+'''
+
+
+class FrozenDict(dict):
+    ''' Immutable dictionary with the values frozen (see L{freeze}). '''
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, ((k, freeze(v)) for k, v in dict(*args, **kwargs).items()))
+        self._hash = None
+        self._json = None
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(frozenset(self.items()))
+        return self._hash
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("'" + self.__class__.__name__ + "' object is immutable")
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __ior__(self, other):
+        self._immutable()
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(' + dict.__repr__(self) + ')'
+
+    def thaw(self):
+        ''' Return a mutable (deep) copy. '''
+        return thaw(self)
+
+
+def freeze(value):
+    ''' Return an immutable copy of a JSON structure; frozen parts are not copied. '''
+    if isinstance(value, FrozenDict):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    ''' Return a mutable copy of a (frozen) JSON structure. '''
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
@@ -0,0 +1,311 @@
+''' Local cache of small, static feature indices for position queries.
+
+An L{IntervalCache} loads all the documents of an index with C{seqid},
+C{start} and C{end} fields (I{e.g.} bands, recombination rates, regions) by
+scrolling, then answers overlap and point queries locally with an
+L{IntervalIndex}::
+
+    docs = IntervalCache.overlap(idx, '1', 113834946, 113910615)
+    docs = IntervalCache.point(idx, '6', 31164337)
+
+The cache is checked (I{i.e.} the index doc count is requested) at most every
+C{INTERVAL_CACHE_CHECK} seconds (default: 60) and reloaded if the doc count has
+changed or it is older than C{INTERVAL_CACHE_TTL} seconds (default: None, no
+limit). If C{INTERVAL_CACHE_DIR} is set the L{IntervalIndex} is written to a
+file in that directory and memory-mapped, so processes (I{e.g.} gunicorn
+workers) share one copy and one process loads it from Elastic.
+'''
+from array import array
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from elastic import codec
+from elastic.elastic_settings import ElasticSettings
+
+try:
+    import fcntl
+except ImportError:  # no file locking (e.g. Windows) so processes may each load the index
+    fcntl = None
+
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+class IntervalIndex(object):
+    ''' Features sorted by seqid and start in arrays with the maximum end of each
+    node of an implicit interval tree (as in U{cgranges<https://github.com/lh3/cgranges>}).
+    The index is a single buffer (bytes or a memory-mapped file)::
+
+        magic, header size, header (JSON), starts, ends, max ends, doc offsets, docs (JSON)
+    '''
+    MAGIC = b'ELIV0001'
+    SCAN_LEVEL = 3    # subtrees at this level or below are scanned
+
+    def __init__(self, buf):
+        '''
+        @type  buf: bytes or mmap
+        @param buf: Index built by L{IntervalIndex.build}.
+        '''
+        if buf[:8] != IntervalIndex.MAGIC:
+            raise ValueError('Not an interval index')
+        (size, ) = struct.unpack('<q', buf[8:16])
+        self.header = codec.loads(bytes(buf[16:16+size]))
+        self.buf = buf
+        n = self.header['n']
+        offset = 16 + size
+        view = memoryview(buf)
+        (self.starts, self.ends, self.max_ends) = \
+            [view[offset+8*n*i:offset+8*n*(i+1)].cast('q') for i in range(3)]
+        self.doc_offsets = view[offset+24*n:offset+32*n+8].cast('q')
+        self.docs_offset = offset + 32*n + 8
+
+    def __len__(self):
+        return self.header['n']
+
+    @classmethod
+    def build(cls, features, meta=None):
+        ''' Return the index of features as bytes.
+        @type  features: iterable
+        @param features: (seqid, start, end, doc) for each feature with inclusive
+        start and end and the doc (I{e.g.} hit) to return.
+        @type  meta: dict
+        @keyword meta: Stored in the header (I{e.g.} the doc count).
+        '''
+        features = sorted(((str(seqid), start, end + 1, doc) for (seqid, start, end, doc) in features),
+                          key=lambda f: (f[0], f[1]))
+        n = len(features)
+        starts = array('q', (f[1] for f in features))
+        ends = array('q', (f[2] for f in features))
+        max_ends = array('q', ends)
+        seqids = {}
+        for (i, f) in enumerate(features):
+            seqids.setdefault(f[0], [i, 0])[1] += 1
+        for block in seqids.values():
+            block.append(IntervalIndex._index(ends, max_ends, block[0], block[1]))
+
+        docs = bytearray()
+        doc_offsets = array('q', [0])
+        for f in features:
+            docs += codec.dumps(f[3])
+            doc_offsets.append(len(docs))
+
+        header = dict(meta or {}, n=n, seqids=seqids, created=time.time())
+        header = codec.dumps(header)
+        return b''.join((IntervalIndex.MAGIC, struct.pack('<q', len(header)), header, starts.tobytes(),
+                         ends.tobytes(), max_ends.tobytes(), doc_offsets.tobytes(), bytes(docs)))
+
+    @classmethod
+    def _index(cls, ends, max_ends, first, n):
+        ''' Set the maximum ends of the implicit interval tree of a seqid and return
+        the level of the root. '''
+        if n == 0:
+            return -1
+        (last_i, last) = (0, 0)
+        for i in range(0, n, 2):
+            (last_i, last) = (i, ends[first+i])
+        k = 1
+        while 1 << k <= n:
+            x = 1 << (k-1)
+            for i in range((x << 1) - 1, n, x << 2):
+                er = max_ends[first+i+x] if i + x < n else last
+                max_ends[first+i] = max(ends[first+i], max_ends[first+i-x], er)
+            last_i = last_i - x if last_i >> k & 1 else last_i + x
+            if last_i < n and max_ends[first+last_i] > last:
+                last = max_ends[first+last_i]
+            k += 1
+        return k - 1
+
+    def overlap(self, seqid, start, end):
+        ''' Return the docs of the features overlapping a range (inclusive), sorted by start. '''
+        return [self.doc(i) for i in self.overlap_indices(seqid, start, end)]
+
+    def point(self, seqid, position):
+        ''' Return the docs of the features containing a position. '''
+        return self.overlap(seqid, position, position)
+
+    def overlap_indices(self, seqid, start, end):
+        ''' Return the indices of the features overlapping a range (inclusive). '''
+        block = self.header['seqids'].get(str(seqid))
+        if block is None:
+            return []
+        (first, n, level) = block
+        (st, en) = (start, end + 1)
+        (starts, ends, max_ends) = (self.starts, self.ends, self.max_ends)
+        found = []
+        stack = [(level, (1 << level) - 1, False)]
+        while stack:
+            (k, x, left_done) = stack.pop()
+            if k <= IntervalIndex.SCAN_LEVEL:
+                i = x >> k << k
+                i1 = min(i + (1 << (k+1)) - 1, n)
+                while i < i1 and starts[first+i] < en:
+                    if st < ends[first+i]:
+                        found.append(first+i)
+                    i += 1
+            elif not left_done:
+                y = x - (1 << (k-1))
+                stack.append((k, x, True))
+                if y >= n or max_ends[first+y] > st:
+                    stack.append((k-1, y, False))
+            elif x < n and starts[first+x] < en:
+                if st < ends[first+x]:
+                    found.append(first+x)
+                stack.append((k-1, x + (1 << (k-1)), False))
+        found.sort()
+        return found
+
+    def doc(self, i):
+        ''' Return the doc of a feature. '''
+        return codec.loads(bytes(self.buf[self.docs_offset+self.doc_offsets[i]:
+                                          self.docs_offset+self.doc_offsets[i+1]]))
+
+
+class IntervalCache(object):
+    ''' Cache of L{IntervalIndex}es of (small, static) indices. '''
+    _lock = threading.Lock()
+    _indices = {}
+
+    @classmethod
+    def overlap(cls, idx, seqid, start, end, obj_document=None, **kwargs):
+        ''' Return the documents in an index overlapping a range (see L{get}). '''
+        return cls._documents(cls.get(idx, **kwargs).overlap(seqid, start, end), obj_document)
+
+    @classmethod
+    def point(cls, idx, seqid, position, obj_document=None, **kwargs):
+        ''' Return the documents in an index containing a position (see L{get}). '''
+        return cls._documents(cls.get(idx, **kwargs).point(seqid, position), obj_document)
+
+    @classmethod
+    def _documents(cls, hits, obj_document):
+        if obj_document is None:
+            obj_document = ElasticSettings.get_document_factory()
+        return [obj_document(hit) for hit in hits]
+
+    @classmethod
+    def get(cls, idx, idx_type='', cluster='default', seqid_param='seqid', start_param='start',
+            end_param='end', sources=None):
+        ''' Return the L{IntervalIndex} for an index, loading it if it is not cached
+        or out of date.
+        @type  idx: string
+        @param idx: Index name.
+        @type  seqid_param: string
+        @keyword seqid_param: Sequence field (default: 'seqid').
+        @type  start_param: string
+        @keyword start_param: Start field (default: 'start').
+        @type  end_param: string
+        @keyword end_param: End field (default: 'end'), the start is used if a document has no end.
+        @type  sources: list
+        @keyword sources: The _source fields to store (default: all).
+        '''
+        key = (cluster, idx, idx_type, seqid_param, start_param, end_param,
+               tuple(sources) if sources is not None else None)
+        entry = IntervalCache._indices.get(key)
+        check = ElasticSettings.getattr('INTERVAL_CACHE_CHECK', cluster=cluster, default=60)
+        if entry is not None and time.time() - entry['checked'] < check:
+            return entry['index']
+
+        with IntervalCache._lock:
+            entry = IntervalCache._indices.get(key)
+            if entry is not None and time.time() - entry['checked'] < check:
+                return entry['index']
+            from elastic.utils import ElasticUtils
+            doc_count = ElasticUtils.get_docs_count(idx, idx_type)
+            if entry is None or not IntervalCache._is_current(entry['index'], doc_count, cluster):
+                index = IntervalCache._load(key, doc_count)
+            else:
+                index = entry['index']
+            IntervalCache._indices[key] = {'index': index, 'checked': time.time()}
+            return index
+
+    @classmethod
+    def invalidate(cls, idx=None):
+        ''' Remove an index (or all indices) from the cache. Shared files are not removed. '''
+        with IntervalCache._lock:
+            for key in list(IntervalCache._indices):
+                if idx is None or key[1] == idx:
+                    del IntervalCache._indices[key]
+
+    @classmethod
+    def _is_current(cls, index, doc_count, cluster):
+        ttl = ElasticSettings.getattr('INTERVAL_CACHE_TTL', cluster=cluster, default=None)
+        if ttl is not None and time.time() - index.header['created'] > ttl:
+            return False
+        return index.header.get('doc_count') == doc_count
+
+    @classmethod
+    def _load(cls, key, doc_count):
+        ''' Load the index from the shared file if it is current or from Elastic. '''
+        cluster = key[0]
+        cache_dir = ElasticSettings.getattr('INTERVAL_CACHE_DIR', cluster=cluster, default=None)
+        if cache_dir is None:
+            return IntervalIndex(IntervalCache._build(key, doc_count))
+
+        # the same file name in each process for the cluster, index and fields
+        digest = hashlib.sha1(codec.dumps(list(key))).hexdigest()[:16]
+        path = os.path.join(cache_dir, key[1] + '_' + digest + '.intervals')
+        index = IntervalCache._map(path)
+        if index is not None and IntervalCache._is_current(index, doc_count, cluster):
+            return index
+
+        with open(path + '.lock', 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # another process may have loaded it while waiting for the lock
+                index = IntervalCache._map(path)
+                if index is not None and IntervalCache._is_current(index, doc_count, cluster):
+                    return index
+                (fd, tmp_path) = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(IntervalCache._build(key, doc_count))
+                os.replace(tmp_path, path)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        return IntervalCache._map(path)
+
+    @classmethod
+    def _map(cls, path):
+        ''' Return the memory-mapped index in a file or None. '''
+        try:
+            with open(path, 'rb') as f:
+                return IntervalIndex(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def _build(cls, key, doc_count):
+        ''' Scroll through the index and return the L{IntervalIndex} bytes. '''
+        from elastic.query import Query
+        from elastic.search import ElasticQuery, ScanAndScroll
+        (cluster, idx, idx_type, seqid_param, start_param, end_param, _) = key
+        sources = list(key[6]) if key[6] is not None else None
+        query = ElasticQuery(Query.match_all(), sources=sources)
+        query.query['size'] = 1000
+        features = []
+        for hit in ScanAndScroll.docs(idx, idx_type=idx_type, query=query, obj_document=lambda hit: hit):
+            source = hit.get('_source', {})
+            seqid = IntervalCache._value(source, seqid_param)
+            start = IntervalCache._value(source, start_param)
+            end = IntervalCache._value(source, end_param)
+            if seqid is None or start is None:
+                logger.warning('Interval cache ' + idx + ': no position for ' + str(hit.get('_id')))
+                continue
+            doc = {k: hit[k] for k in ('_id', '_type', '_index', '_source') if k in hit}
+            features.append((seqid, start, start if end is None else end, doc))
+        logger.info('Interval cache loaded ' + idx + ': ' + str(len(features)) + ' documents')
+        return IntervalIndex.build(features, meta={'doc_count': doc_count, 'idx': idx})
+
+    @classmethod
+    def _value(cls, source, name):
+        ''' Return the _source value of a (dotted) field name. '''
+        for part in name.split('.'):
+            source = source.get(part) if isinstance(source, dict) else None
+        return source
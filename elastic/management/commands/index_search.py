@@ -23,17 +23,23 @@ class Command(BaseCommand):
     ''' Elastic index mapping and loading tool. '''
     help = "Use to create Elastic index mappings and load data.\n\n" \
            "Options for markers:\n" \
-           " --indexName [index name] --indexSNP All.vcf\n" \
+           " --indexName [index name] --indexSNP All.vcf [--vcfInfo VC,CAF,COMMON]\n" \
            " --indexName [index name] --indexSNPMerge RsMergeArch.bcp.gz\n" \
            "Options for genes:\n" \
            " --indexName [index name] --indexGene genenames.org.txt --org=human\n" \
            " --indexName [index name] --indexGeneGFF gene.gff --build GRCh38\n" \
+           "Options for gene targets:\n" \
+           " --indexName [index name] --indexGTarget gene_targets.tab.gz [--dropZeroScores]\n" \
            "Options for study hits:\n" \
            " --indexName [index name] --indexType [studies] --addStudyData [csv file] --study [study id]\n" \
            "Options for GFF/GTF:\n" \
-           " --indexName [index name] --indexType [gff] --indexGFF file.gff [--isGTF]\n" \
+           " --indexName [index name] --indexType [gff] --indexGFF file.gff [--isGTF] [--attrKeys ID,Name]\n" \
            "Options for BED:\n" \
            " --indexName [index name] --indexType [bed] --indexBED file.bed\n" \
+           "Options for genomic bins (range overlap queries):\n" \
+           " --bins with --indexSNP, --indexGFF, --indexBED, --indexGene and --indexGeneGFF\n" \
+           "Options for incremental reloads (GFF/BED/SNP/gene/gene target/alias/JSON):\n" \
+           " --docId key --incremental [--hashDir dir]\n" \
            "Options for t1d/criteria:\n" \
            " indexCriteria 'true' --indexName [index name] --indexProject t1dbase --applyFilter" \
            "Options for imb/criteria:\n" \
@@ -47,6 +53,10 @@ class Command(BaseCommand):
                     dest='indexSNP',
                     help='VCF file (from dbSNP) to index'),
         ) + (
+        make_option('--vcfInfo',
+                    dest='vcfInfo',
+                    help='VCF INFO sub-fields to index as typed fields (comma separated or all)'),
+        ) + (
         make_option('--indexSNPMerge',
                     dest='indexSNPMerge',
                     help='RS Merge (from dbSNP)'),
@@ -87,6 +97,11 @@ class Command(BaseCommand):
                     dest='indexGTarget',
                     help='Load gene targets'),
         ) + (
+        make_option('--dropZeroScores',
+                    dest='dropZeroScores',
+                    help='Do not index zero or NaN gene target tissue scores',
+                    action="store_true"),
+        ) + (
         make_option('--indexGFF',
                     dest='indexGFF',
                     help='Load GFF targets'),
@@ -96,6 +111,10 @@ class Command(BaseCommand):
                     help='GTF file type',
                     action="store_true"),
         ) + (
+        make_option('--attrKeys',
+                    dest='attrKeys',
+                    help='GFF/GTF attributes to index (comma separated, default: all)'),
+        ) + (
         make_option('--indexBED',
                     dest='indexBED',
                     help='Load BED file'),
@@ -132,6 +151,29 @@ class Command(BaseCommand):
                     dest='shards',
                     default=5,
                     help='No. of shards [default: %default]'),
+        ) + (
+        make_option('--docId',
+                    dest='docId',
+                    default='auto',
+                    help='Document IDs: auto (numbered), hash (of the document), key (natural key '
+                         'of the loader, e.g. id for SNPs) or field names (e.g. seqid,start,end) '
+                         '[default: %default]'),
+        ) + (
+        make_option('--incremental',
+                    dest='incremental',
+                    help='Only send new and changed documents and delete those no longer in the file '
+                         '(needs --docId key, hash or field names)',
+                    action="store_true"),
+        ) + (
+        make_option('--hashDir',
+                    dest='hashDir',
+                    help='Directory for the document hash files of incremental loads '
+                         '(default: the hashes are stored in the index)'),
+        ) + (
+        make_option('--bins',
+                    dest='bins',
+                    help='Add genomic bins for range overlap queries (GFF/BED/SNP/gene)',
+                    action="store_true"),
         )
 
     def handle(self, *args, **options):
@@ -8,6 +8,7 @@ logger = logging.getLogger(__name__)
 
 
 class AliasManager(DelimeterLoader):
+    NATURAL_KEY = ('internal_id', 'alias')
 
     def create_alias(self, **options):
         ''' Create alias index mapping and load data '''
@@ -53,7 +54,8 @@ class AliasManager(DelimeterLoader):
                     self._create_alias_mapping(type_, **options)
                     f = self.open_file_to_load('indexAlias', **options)
                     column_names = ["internal_id", "alias", "preferred_name", "type"]
-                    self.load(column_names, f, idx_name_cur, type_)
+                    self.load(column_names, f, idx_name_cur, type_, id_strategy=self.get_id_strategy(**options),
+                              incremental=self.get_incremental(idx_name_cur, type_, **options))
                     logger.warn('Index created for ' + type_ + ' with index name ' + idx_name_cur)
                 else:
                     logger.warn(idx_file + ' Does not Exists ..... Proceeding to quit')
@@ -3,6 +3,7 @@ import re
 
 
 class BEDManager(DelimeterLoader):
+    NATURAL_KEY = ('seqid', 'start', 'end', 'name')
 
     def create_load_bed_index(self, **options):
         ''' Index bed data '''
@@ -15,7 +16,9 @@ class BEDManager(DelimeterLoader):
         line = f.readline().decode("utf-8")
         parts = re.split('\t', line)
         column_names = column_names[:len(parts)]
-        self.load(column_names, f, idx_name, idx_type)
+        self.load(column_names, f, idx_name, idx_type, bin_param=self.get_bin_param(**options),
+                  id_strategy=self.get_id_strategy(**options),
+                  incremental=self.get_incremental(idx_name, idx_type, **options))
 
     def _create_bed_mapping(self, **options):
         ''' Create the mapping for bed index '''
@@ -26,6 +29,7 @@ class BEDManager(DelimeterLoader):
              .add_property("end", "integer", index="not_analyzed")
         props.add_property("name", "string", index="not_analyzed")
         props.add_property("score", "string", index="no")
+        self.add_bin_property(props, **options)
 
         self.mapping(props, idx_type, **options)
 
@@ -1,4 +1,5 @@
 ''' Old web-site criteria builder. '''
+from elastic import codec
 from elastic.management.loaders.loader import JSONLoader, MappingProperties
 import requests
 import logging
@@ -182,4 +183,4 @@ class CriteriaManager(JSONLoader):
         urlTemplate += '</Dataset>' + '</Query>'
         queryURL = urlTemplate
         req = requests.get(queryURL, stream=True, verify=False)
-        return req.json()
+        return codec.response_json(req)
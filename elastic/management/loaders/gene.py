@@ -1,11 +1,12 @@
 ''' Loader for gene data. '''
 import re
+from elastic import codec
+from elastic.binning import Binning
 from elastic.search import Search
 from elastic.management.loaders.loader import Loader
 from elastic.management.loaders.mapping import MappingProperties
 from elastic.management.loaders.utils import GFF
 import sys
-import json
 import logging
 
 # Get an instance of a logger
@@ -13,6 +14,7 @@ logger = logging.getLogger(__name__)
 
 
 class GeneManager(Loader):
+    NATURAL_KEY = ('hgnc', )
 
     def load_genename(self, **options):
         '''
@@ -39,7 +41,12 @@ class GeneManager(Loader):
         dbxrefColumns = ["entrez", "ensembl", "mgi", "refseq"]
         idx_n = 0
         n = 0
-        data = ''
+        data = bytearray()
+        id_strategy = self.get_id_strategy(**options)
+        incremental = self.get_incremental(idx_name, 'gene', **options)
+        bulk_load = self.bulk_load if incremental is None else incremental.track(self.bulk_load)
+        loaded_ids = set()
+        nrepeated = 0
 
         try:
             for line in f:
@@ -80,23 +87,34 @@ class GeneManager(Loader):
                             for syn in syns:
                                 synonym_data.append(syn.strip())
 
-                    data += '{"index": {"_id": "%s"}}\n' % idx_n
-                    data += json.dumps({"gene_symbol":
-                                        col_dict["approved symbol"],
-                                        "organism": org,
-                                        "hgnc": col_dict["hgnc id"][5:],
-                                        "dbxrefs": dbxref_data,
-                                        "synonyms": synonym_data
-                                        })+'\n'
+                    doc_data = {"gene_symbol": col_dict["approved symbol"],
+                                "organism": org,
+                                "hgnc": col_dict["hgnc id"][5:],
+                                "dbxrefs": dbxref_data,
+                                "synonyms": synonym_data
+                                }
+                    idx_id = self.doc_id(doc_data, id_strategy, idx_n)
+                    if idx_id is None:
+                        logger.warn("WARNING: no document ID: " + col_dict["approved symbol"])
+                        continue
+                    if id_strategy is not None and self.is_repeated_id(idx_id, loaded_ids):
+                        nrepeated += 1
+                    if incremental is not None and not incremental.is_changed(idx_id, doc_data):
+                        continue
+                    data += codec.dumps({"index": {"_id": idx_id}}) + b'\n'
+                    data += codec.dumps(doc_data) + b'\n'
                     idx_n += 1
                     n += 1
 
                     if(n > 5000):
                         n = 0
-                        self.bulk_load(idx_name, 'gene', data)
-                        data = ''
+                        bulk_load(idx_name, 'gene', data)
+                        data = bytearray()
         finally:
-            self.bulk_load(idx_name, 'gene', data)
+            bulk_load(idx_name, 'gene', data)
+            self.log_repeated_ids(idx_name, nrepeated)
+        if incremental is not None:
+            incremental.finish(self.bulk_load)
 
     def update_gene(self, **options):
         ''' Use gene span GFF coordinates to add coordinates '''
@@ -110,8 +128,9 @@ class GeneManager(Loader):
         f = self.open_file_to_load('indexGeneGFF', **options)
         line_num = 0
         auto_num = 1
-        json_data = ''
+        json_data = bytearray()
         chunk = 1000
+        bin_param = self.get_bin_param(**options)
 
         try:
             for line in f:
@@ -138,7 +157,7 @@ class GeneManager(Loader):
 
                 doc_data = {"update": {"_id": gdata["idx_id"], "_type": "gene",
                                        "_index": idx_name, "_retry_on_conflict": 3}}
-                json_data += json.dumps(doc_data) + '\n'
+                json_data += codec.dumps(doc_data) + b'\n'
                 doc_data = {"doc": {"featureloc":
                                     {"start": gff.start,
                                      "end": gff.end,
@@ -148,14 +167,16 @@ class GeneManager(Loader):
                                     "biotype": gff.attrs["biotype"]
                                     }
                             }
-                json_data += json.dumps(doc_data) + '\n'
+                if bin_param is not None:
+                    doc_data["doc"]["featureloc"][bin_param] = Binning.bin_from_range(gff.start, gff.end)
+                json_data += codec.dumps(doc_data) + b'\n'
                 line_num += 1
                 auto_num += 1
                 if(line_num > chunk):
                     line_num = 0
                     print('.', end="", flush=True)
                     self.bulk_load(idx_name, 'gene', json_data)
-                    json_data = ''
+                    json_data = bytearray()
         finally:
             self.bulk_load(idx_name, 'gene', json_data)
 
@@ -192,6 +213,7 @@ class GeneManager(Loader):
                         .add_property("end", "integer") \
                         .add_property("seqid", "string") \
                         .add_property("build", "string")
+        self.add_bin_property(featureloc_props, **options)
         props.add_properties(featureloc_props)
 
         ''' create index and add mapping '''
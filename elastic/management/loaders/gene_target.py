@@ -1,6 +1,9 @@
 ''' Loader for gene target data. '''
 import logging
+import math
 import re
+from itertools import compress
+from operator import itemgetter
 
 from elastic.management.loaders.loader import DelimeterLoader
 from elastic.management.loaders.mapping import MappingProperties
@@ -10,15 +13,17 @@ from elastic.management.loaders.mapping import MappingProperties
 logger = logging.getLogger(__name__)
 
 
-# Get an instance of a logger
-logger = logging.getLogger(__name__)
-
-
 class GeneTargetManager(DelimeterLoader):
+    NATURAL_KEY = ('ensg', 'baitID', 'oeID')
     tissue_types = []
+    CONVERTERS = {"integer": int, "float": float}
+    converters = None       # column converters planned from the mapping (see _plan_converters)
+    drop_scores = False     # leave out zero and NaN tissue scores
 
     def create_load_gene_target_index(self, **options):
-        ''' Index gene target data '''
+        ''' Index gene target data. The columns are converted with functions chosen
+        from the mapping once and the tissue scores of a row in one pass. With the
+        dropZeroScores option zero and NaN tissue scores are not indexed. '''
         idx_name = self.get_index_name(**options)
         f = self.open_file_to_load('indexGTarget', **options)
         column_names = ["ensg", "name", "biotype", "strand",
@@ -30,7 +35,10 @@ class GeneTargetManager(DelimeterLoader):
         GeneTargetManager.tissue_types = parts[len(column_names):]
         column_names.extend(GeneTargetManager.tissue_types)
         self._create_gene_mapping(**options)
-        self.load(column_names, f, idx_name, 'gene_target')
+        self.converters = self._plan_converters(column_names[:len(column_names) - len(GeneTargetManager.tissue_types)])
+        self.drop_scores = bool(options.get('dropZeroScores'))
+        self.load(column_names, f, idx_name, 'gene_target', id_strategy=self.get_id_strategy(**options),
+                  incremental=self.get_incremental(idx_name, 'gene_target', **options))
 
     def _create_gene_mapping(self, **options):
         ''' Create the mapping for gene target index '''
@@ -57,3 +65,55 @@ class GeneTargetManager(DelimeterLoader):
             meta["tissue_type"][tt] = "tissue_type"
 
         self.mapping(props, idx_type='gene_target', meta=meta, **options)
+
+    def _plan_converters(self, column_names):
+        ''' Return the columns grouped by the conversion function for their mapping
+        type, as (names, getter, function), so that a row is converted with a map
+        over each group. '''
+        props = self.mapping_json['gene_target']['properties']
+        groups = {}
+        for (i, name) in enumerate(column_names):
+            convert = GeneTargetManager.CONVERTERS.get(props[name]['type'], str.strip)
+            groups.setdefault(convert, []).append((i, name))
+        converters = []
+        for (convert, cols) in groups.items():
+            (idxs, names) = zip(*cols)
+            getter = itemgetter(*idxs) if len(idxs) > 1 else (lambda parts, i=idxs[0]: (parts[i], ))
+            converters.append((names, getter, convert))
+        return converters
+
+    def parse_line(self, parts, column_names, idx_name, idx_type, is_GFF, is_GTF):
+        ''' Overrides Delimeter.parse_line() - to convert the columns with the
+        planned converters and the tissue scores in bulk. '''
+        if self.converters is None:
+            return super().parse_line(parts, column_names, idx_name, idx_type, is_GFF, is_GTF)
+        ncols = len(column_names) - len(GeneTargetManager.tissue_types)
+        doc_data = {}
+        try:
+            for (names, getter, convert) in self.converters:
+                values = list(map(convert, getter(parts)))
+                if convert is str.strip and '::' in '\t'.join(values):
+                    values = [v.split('::') if '::' in v else v for v in values]
+                doc_data.update(zip(names, values))
+        except ValueError:
+            doc_data = super().parse_line(parts[:ncols], column_names, idx_name, idx_type, is_GFF, is_GTF)
+
+        try:
+            scores = list(map(float, parts[ncols:]))
+        except ValueError:
+            scores = None
+        if scores is None or not all(map(math.isfinite, scores)):    # NA, NaN or infinite scores
+            scores = [GeneTargetManager._score(score) for score in parts[ncols:]]
+        scored = zip(GeneTargetManager.tissue_types, scores)
+        doc_data.update(compress(scored, scores) if self.drop_scores else scored)
+        return doc_data
+
+    @classmethod
+    def _score(cls, value):
+        ''' Return the float of a tissue score or None if it is not a finite number
+        (I{e.g.} NA, NaN or inf). '''
+        try:
+            score = float(value)
+        except ValueError:
+            return None
+        return score if math.isfinite(score) else None
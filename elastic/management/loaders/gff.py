@@ -4,6 +4,7 @@ from elastic.management.loaders.mapping import MappingProperties
 
 
 class GFFManager(DelimeterLoader):
+    NATURAL_KEY = ('seqid', 'start', 'end', 'type')
 
     def create_load_gff_index(self, **options):
         ''' Index gff data '''
@@ -12,7 +13,10 @@ class GFFManager(DelimeterLoader):
         mapping_props = self._create_gff_mapping(idx_type, **options)
         f = self.open_file_to_load('indexGFF', **options)
         column_names = mapping_props.get_column_names()
-        self.load(column_names, f, idx_name, idx_type, is_GFF=True, is_GTF=options['isGTF'])
+        self.attr_keys = self.get_attr_keys(**options)
+        self.load(column_names, f, idx_name, idx_type, is_GFF=True, is_GTF=options['isGTF'],
+                  bin_param=self.get_bin_param(**options), id_strategy=self.get_id_strategy(**options),
+                  incremental=self.get_incremental(idx_name, idx_type, **options))
 
     def _create_gff_mapping(self, idx_type, **options):
         ''' Create the mapping for gff index '''
@@ -26,5 +30,6 @@ class GFFManager(DelimeterLoader):
              .add_property("strand", "string", index="no") \
              .add_property("phase", "string", index="no") \
              .add_property("attr", "object")
+        self.add_bin_property(props, **options)
         self.mapping(props, idx_type, **options)
         return props
@@ -0,0 +1,202 @@
+''' Incremental (diff-based) loading. The content hash of each document is
+compared with the hash from the previous load so that only the new and
+changed documents are sent and the documents no longer in the file are
+deleted. The previous hashes are read from a sidecar hash file or from a
+hash field stored in each document. The hash file is only used for the index
+it was written for (identified by the index UUID or creation date) and if
+the index has documents. '''
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+
+from elastic import codec
+from elastic.management.loaders.exceptions import LoaderError
+from elastic.query import Query
+from elastic.search import ElasticQuery, ScanAndScroll, Search, ElasticSettings
+
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+class IncrementalLoad(object):
+    ''' Track the changes between an index type and the documents being loaded.
+
+    The documents need IDs that are stable between loads (see
+    L{Loader.get_id_strategy}). Without a hash file the content hash is stored
+    in each document (L{HASH_FIELD}) and the previous hashes are fetched with a
+    scan that only returns that field. '''
+
+    HASH_FIELD = 'doc_hash'
+    HEADER = '#index\t'    # hash file header followed by the index UUID
+
+    def __init__(self, idx_name, idx_type, hash_file=None, chunk=5000):
+        '''
+        @type  idx_name: string
+        @param idx_name: Index name.
+        @type  idx_type: string
+        @param idx_type: Index type.
+        @type  hash_file: string
+        @keyword hash_file: Sidecar file of document IDs and hashes from the previous load
+        (gzipped if it ends with .gz), rewritten by L{finish}.
+        @type  chunk: integer
+        @keyword chunk: Number of deletes per bulk request.
+        '''
+        self.idx_name = idx_name
+        self.idx_type = idx_type
+        self.hash_file = hash_file
+        self.chunk = chunk
+        self.counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'failed': 0}
+        self.previous = self._previous_hashes()
+        self.current = {}
+        self.request_failed = False
+
+    @classmethod
+    def doc_hash(cls, doc):
+        ''' Return the content hash of a document (independent of the key order). '''
+        return hashlib.sha1(codec.dumps(doc, sort_keys=True)).hexdigest()
+
+    def is_changed(self, idx_id, doc):
+        ''' Return True if the document is new or has changed since the previous load
+        and so needs to be sent. Without a hash file the hash is added to the document. '''
+        doc_hash = self.doc_hash(doc)
+        if self.hash_file is None:
+            doc[self.HASH_FIELD] = doc_hash
+        if idx_id in self.current:
+            # repeated ID, the last document loaded replaces the earlier ones
+            self.current[idx_id] = doc_hash
+            return True
+        self.current[idx_id] = doc_hash
+
+        if idx_id not in self.previous:
+            self.counts['inserted'] += 1
+        elif self.previous[idx_id] == doc_hash:
+            self.counts['unchanged'] += 1
+            return False
+        else:
+            self.counts['updated'] += 1
+        return True
+
+    def track(self, bulk_load):
+        ''' Return a function that calls the I{bulk_load} function (see
+        L{Loader.bulk_load}) and records the documents that failed to load. '''
+        def tracked_load(idx_name, idx_type, json_data):
+            failed_ids = bulk_load(idx_name, idx_type, json_data)
+            self.failed(failed_ids)
+            return failed_ids
+        return tracked_load
+
+    def failed(self, failed_ids):
+        ''' Record the documents of a bulk request that failed to load (or delete),
+        so that their hashes are those of the documents still in the index. If
+        I{failed_ids} is None the whole request failed and the hashes are not saved. '''
+        if failed_ids is None:
+            self.request_failed = True
+            return
+        for idx_id in failed_ids:
+            self.counts['failed'] += 1
+            if idx_id in self.previous:
+                self.current[idx_id] = self.previous[idx_id]
+            else:
+                self.current.pop(idx_id, None)
+
+    def finish(self, bulk_load):
+        ''' Delete the documents that were not in this load (using the I{bulk_load}
+        function, see L{Loader.bulk_load}), save the hashes and return the change
+        summary. The hashes are not saved if a bulk request of the load failed. '''
+        bulk_load = self.track(bulk_load)
+        json_data = bytearray()
+        n = 0
+        for idx_id in self.previous:
+            if idx_id in self.current:
+                continue
+            json_data += codec.dumps({"delete": {"_id": idx_id}}) + b'\n'
+            self.counts['deleted'] += 1
+            n += 1
+            if n >= self.chunk:
+                bulk_load(self.idx_name, self.idx_type, json_data)
+                json_data = bytearray()
+                n = 0
+        if len(json_data) > 0:
+            bulk_load(self.idx_name, self.idx_type, json_data)
+
+        if self.hash_file is not None:
+            if self.request_failed:
+                logger.error('ERROR: bulk request failed, hash file ' + self.hash_file + ' not updated')
+            else:
+                self._save_hashes()
+        logger.info('Incremental load ' + self.idx_name + '/' + self.idx_type + ': ' +
+                    ', '.join(k + ' ' + str(v) for k, v in self.counts.items()))
+        return self.counts
+
+    def _previous_hashes(self):
+        ''' Return the document IDs and hashes of the previous load. Documents
+        loaded without a hash have a hash of None, so are always updated. '''
+        if self.hash_file is not None:
+            if not os.path.exists(self.hash_file):
+                logger.warn('WARNING: no hash file ' + self.hash_file + ' (all documents are loaded)')
+                return {}
+            hashes = {}
+            with self._open(self.hash_file, 'rt') as f:
+                index_id = self._index_id()
+                if index_id is None or f.readline().rstrip('\n') != self.HEADER + index_id:
+                    logger.warn('WARNING: hash file ' + self.hash_file + ' is not for the index ' +
+                                self.idx_name + ' (all documents are loaded)')
+                    return {}
+                count = Search(idx=self.idx_name, idx_type=self.idx_type).get_count().get('count', 0)
+                if count == 0:
+                    logger.warn('WARNING: no documents in ' + self.idx_name + '/' + self.idx_type +
+                                ', hash file ' + self.hash_file + ' ignored (all documents are loaded)')
+                    return {}
+                for line in f:
+                    (idx_id, doc_hash) = line.rstrip('\n').split('\t')
+                    hashes[idx_id] = doc_hash
+            return hashes
+
+        resp = Search.elastic_request(ElasticSettings.url(), self.idx_name, is_post=False, call_type='admin')
+        if resp.status_code != 200:
+            return {}
+        query = ElasticQuery(Query.match_all(), sources=[self.HASH_FIELD])
+        query.query['size'] = 1000
+        hashes = {}
+        for hit in ScanAndScroll.docs(self.idx_name, idx_type=self.idx_type, query=query,
+                                      obj_document=lambda hit: hit):
+            hashes[hit['_id']] = hit.get('_source', {}).get(self.HASH_FIELD)
+        return hashes
+
+    def _save_hashes(self):
+        ''' Write the hashes of this load to the hash file. '''
+        index_id = self._index_id()
+        hash_dir = os.path.dirname(os.path.abspath(self.hash_file))
+        (fd, tmp_name) = tempfile.mkstemp(dir=hash_dir, prefix='.hashes')
+        os.close(fd)
+        try:
+            with self._open(tmp_name, 'wt') as f:
+                if index_id is not None:
+                    f.write(self.HEADER + index_id + '\n')
+                for (idx_id, doc_hash) in self.current.items():
+                    f.write(idx_id + '\t' + doc_hash + '\n')
+            os.replace(tmp_name, self.hash_file)
+        except OSError as e:
+            os.unlink(tmp_name)
+            raise LoaderError('failed to write hash file ' + self.hash_file + ': ' + str(e))
+
+    def _index_id(self):
+        ''' Return the UUID of the index (or its creation date if there is no UUID)
+        or None if the index does not exist. '''
+        resp = Search.elastic_request(ElasticSettings.url(), self.idx_name + '/_settings', is_post=False,
+                                      call_type='admin')
+        if resp.status_code != 200:
+            return None
+        for idx_settings in codec.response_json(resp).values():
+            settings = idx_settings.get('settings', {}).get('index', {})
+            index_id = settings.get('uuid', settings.get('creation_date'))
+            return str(index_id) if index_id is not None else None
+        return None
+
+    def _open(self, file_name, mode):
+        if self.hash_file.endswith('.gz'):
+            return gzip.open(file_name, mode)
+        return open(file_name, mode)
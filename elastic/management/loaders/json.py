@@ -1,6 +1,6 @@
 ''' Loader for JSON data. '''
-import json
 import logging
+from elastic import codec
 from elastic.management.loaders.loader import JSONLoader
 from elastic.management.loaders.mapping import MappingProperties
 
@@ -21,8 +21,8 @@ class JsonManager(JSONLoader):
         idx_name = self.get_index_name(**options)
         idx_type = self.get_index_type('marker', **options)
 
-        with open(options['indexJson']) as data_file:
-            json_data = json.load(data_file)
+        with open(options['indexJson'], 'rb') as data_file:
+            json_data = codec.loads(data_file.read())
 
         if len(json_data["docs"]) < 1:
             logger.debug("No documents to load!")
@@ -30,7 +30,8 @@ class JsonManager(JSONLoader):
 
         if 'mapping' in json_data:
             self._create_json_mapping(idx_type, json_data["mapping"], **options)
-        self.load(json_data["docs"], idx_name, idx_type)
+        self.load(json_data["docs"], idx_name, idx_type, id_strategy=self.get_id_strategy(**options),
+                  incremental=self.get_incremental(idx_name, idx_type, **options))
 
     def _create_json_mapping(self, idx_type, mapping, **options):
         ''' Create the mapping for indexing '''
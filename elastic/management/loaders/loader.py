@@ -1,14 +1,17 @@
 ''' Parent loaders to handle mapping and bulk loading. '''
 import gzip
-import json
 import logging
+import os
 import re
 
-import requests
-
+from elastic import codec
+from elastic.binning import Binning
+from elastic.mapping import MappingCache
 from elastic.management.loaders.analysis import Analyzer
 from elastic.management.loaders.exceptions import LoaderError
+from elastic.management.loaders.incremental import IncrementalLoad
 from elastic.management.loaders.mapping import MappingProperties
+from elastic.management.loaders.utils import GFF
 from elastic.search import Search, ElasticSettings, Bulk
 
 
@@ -22,6 +25,7 @@ class Loader:
 
     KEYWORD_ANALYZER = Analyzer("full_name", tokenizer="keyword",
                                 token_filters=["standard", "lowercase"]).analyzer
+    NATURAL_KEY = None    # fields that identify a document, used by the docId 'key' option
 
     def mapping(self, mapping, idx_type, meta=None, analyzer=None, **options):
         ''' Put the mapping (L{MappingProperties}) to the Elastic server. '''
@@ -30,8 +34,9 @@ class Loader:
 
         idx_name = self.get_index_name(**options)
         number_of_shards = self.get_number_of_shards(**options)
-        url = ElasticSettings.url() + '/' + idx_name
-        resp = requests.get(url)
+        elastic_url = ElasticSettings.url()
+        url = idx_name
+        resp = Search.elastic_request(elastic_url, url, is_post=False, call_type='admin')
         if resp.status_code == 200:
             logger.warn('WARNING: '+idx_name + ' index already exists!')
         else:
@@ -40,16 +45,21 @@ class Loader:
             if analyzer is not None:
                 idx_settings['settings'].update(analyzer)
 
-            resp = requests.put(url, data=json.dumps(idx_settings))
+            resp = Search.elastic_request(elastic_url, url, data=codec.dumps(idx_settings),
+                                          method='PUT', call_type='admin')
 
         mapping_json = mapping.mapping_properties
         if meta is not None:
             mapping_json[idx_type]["_meta"] = meta
+        if options.get('incremental') and not options.get('hashDir'):
+            mapping_json[idx_type]["properties"][IncrementalLoad.HASH_FIELD] = {"type": "string", "index": "no"}
 
         # add mapping to index
         url += '/_mapping/' + idx_type
-        resp = requests.put(url, data=json.dumps(mapping_json))
+        resp = Search.elastic_request(elastic_url, url, data=codec.dumps(mapping_json),
+                                      method='PUT', call_type='admin')
         self.mapping_json = mapping_json
+        MappingCache.invalidate(idx_name)
 
         if(resp.status_code != 200):
             logger.warn('WARNING: '+idx_name+' mapping status: '+str(resp.status_code)+' '+str(resp.content))
@@ -57,8 +67,11 @@ class Loader:
         return True
 
     def bulk_load(self, idx_name, idx_type, json_data):
-        ''' Bulk load documents. '''
-        Bulk.load(idx_name, idx_type, json_data)
+        ''' Bulk load documents. Return the IDs of the documents that failed to load,
+        or None if the bulk request failed (see L{Bulk.failed_ids}). '''
+        if len(json_data) == 0:
+            return set()
+        return Bulk.failed_ids(Bulk.load(idx_name, idx_type, json_data))
 
     def get_index_name(self, **options):
         ''' Get indexName option. '''
@@ -81,8 +94,9 @@ class Loader:
 
     def is_str(self, column_name, idx_name, idx_type):
         ''' Looks at the mapping to determine if the type is a string. '''
-        if not self.mapping_json:
-            self.mapping_json = Search(idx=idx_name).get_mapping(idx_type)[idx_name]['mappings']
+        if not getattr(self, 'mapping_json', None):
+            mapping = MappingCache.get(idx_name)
+            return mapping is not None and mapping.is_string(column_name, idx_type)
         try:
             map_type = self.mapping_json[idx_type]["properties"][column_name]["type"]
         except KeyError:
@@ -91,6 +105,91 @@ class Loader:
             return True
         return False
 
+    def get_bin_param(self, **options):
+        ''' Get the bins option, the name of the genomic bin field (see L{Binning}) or None. '''
+        if options.get('bins'):
+            return 'bin'
+        return None
+
+    def add_bin_property(self, props, **options):
+        ''' Add the genomic bin field to the mapping properties if the bins option
+        is used. It is not a column of the files loaded. '''
+        bin_param = self.get_bin_param(**options)
+        if bin_param is not None:
+            props.add_property(bin_param, "integer", index="not_analyzed")
+            props.column_names.remove(bin_param)
+        return props
+
+    def get_id_strategy(self, **options):
+        ''' Get the docId option, how document IDs are assigned: 'auto' (default) numbers
+        the documents in the order loaded, 'hash' uses a hash of the document, 'key'
+        the natural key of the loader (L{NATURAL_KEY}) or comma separated field names
+        (I{e.g.} 'seqid,start,end'). With 'hash' or key IDs reloading a file replaces
+        the documents in place rather than duplicating or shifting them. Documents with
+        the same key are loaded as one document (the last loaded) and counted in a
+        warning; I{e.g.} GTF exons shared by transcripts have the same GFF natural key. '''
+        doc_id = options.get('docId') or 'auto'
+        if doc_id == 'auto':
+            return None
+        if doc_id == 'hash':
+            return 'hash'
+        if doc_id == 'key':
+            if self.NATURAL_KEY is None:
+                raise LoaderError("no natural key for " + self.__class__.__name__)
+            return tuple(self.NATURAL_KEY)
+        return tuple(name.strip() for name in doc_id.split(','))
+
+    def doc_id(self, doc, id_strategy, auto_num):
+        ''' Return the ID of a document for the ID strategy (see L{get_id_strategy})
+        or None if it has no value for a key field. '''
+        if id_strategy is None:
+            return str(auto_num)
+        if id_strategy == 'hash':
+            return IncrementalLoad.doc_hash(doc)
+        values = []
+        for name in id_strategy:
+            value = doc
+            for part in name.split('.'):
+                value = value.get(part) if isinstance(value, dict) else None
+            if value is None or value == '':
+                return None
+            values.append(','.join(str(v) for v in value) if isinstance(value, list) else str(value))
+        return ':'.join(values)
+
+    def is_repeated_id(self, idx_id, loaded_ids):
+        ''' Return True if a document with the ID has already been loaded (and is
+        replaced by this one), otherwise add the ID to the I{loaded_ids} set. '''
+        if idx_id in loaded_ids:
+            logger.debug('Repeated document ID: ' + idx_id)
+            return True
+        loaded_ids.add(idx_id)
+        return False
+
+    def log_repeated_ids(self, idx_name, nrepeated):
+        ''' Warn that documents were replaced by later documents with the same ID. '''
+        if nrepeated > 0:
+            logger.warn('WARNING: ' + str(nrepeated) + ' documents loaded into ' + idx_name +
+                        ' replaced earlier documents with the same ID (see the docId option)')
+
+    def get_incremental(self, idx_name, idx_type, **options):
+        ''' Get the incremental option, an L{IncrementalLoad} to only send the new and
+        changed documents and delete those not loaded, or None. The previous document
+        hashes are read from a file in the hashDir option directory or from the index. '''
+        if not options.get('incremental'):
+            return None
+        if self.get_id_strategy(**options) is None:
+            raise LoaderError("incremental loading needs key or hash document IDs (docId option)")
+        hash_file = None
+        if options.get('hashDir'):
+            hash_file = os.path.join(options['hashDir'], idx_name + '.' + idx_type + '.hashes.gz')
+        return IncrementalLoad(idx_name, idx_type, hash_file=hash_file)
+
+    def get_attr_keys(self, **options):
+        ''' Get the attrKeys option, the set of GFF/GTF attributes to index or None for all. '''
+        if options.get('attrKeys'):
+            return frozenset(name.strip() for name in options['attrKeys'].split(','))
+        return None
+
     def get_index_type(self, default_type, **options):
         if options['indexType']:
             return options['indexType'].lower()
@@ -99,13 +198,22 @@ class Loader:
 
 class DelimeterLoader(Loader):
     ''' Loader for files with delimited columns (comma, tab I{etc}). '''
+    attr_keys = None    # GFF/GTF attributes to keep (see get_attr_keys)
 
     def load(self, column_names, file_handle, idx_name, idx_type='tab', delim='\t',
-             is_GFF=False, is_GTF=False, chunk=5000):
-        ''' Index tab data '''
-        json_data = ''
+             is_GFF=False, is_GTF=False, chunk=5000, bin_param=None, id_strategy=None,
+             incremental=None):
+        ''' Index tab data. If I{bin_param} is given the genomic bin of the start and
+        end (or just start) columns is added to each document (see L{Binning}).
+        The document IDs are assigned by the I{id_strategy} (see L{get_id_strategy}).
+        With an I{incremental} load (see L{get_incremental}) only the changed
+        documents are sent. '''
+        json_data = bytearray()
         line_num = 0
         auto_num = 1
+        bulk_load = self.bulk_load if incremental is None else incremental.track(self.bulk_load)
+        loaded_ids = set()
+        nrepeated = 0
 
         try:
             for line in file_handle:
@@ -118,21 +226,38 @@ class DelimeterLoader(Loader):
                     line_num += 1
                     continue
 
-                idx_id = str(auto_num)
-                json_data += '{"index": {"_id": "%s"}}\n' % idx_id
                 doc_data = self.parse_line(parts, column_names, idx_name, idx_type, is_GFF, is_GTF)
-                json_data += json.dumps(doc_data) + '\n'
+                if bin_param is not None:
+                    doc_data[bin_param] = Binning.bin_from_range(doc_data['start'],
+                                                                 doc_data.get('end', doc_data['start']))
+                if id_strategy is None:
+                    json_data += b'{"index":{"_id":"%d"}}\n' % auto_num
+                else:
+                    idx_id = self.doc_id(doc_data, id_strategy, auto_num)
+                    if idx_id is None:
+                        logger.warn("WARNING: no document ID: ["+str(line_num+1)+'] '+line)
+                        line_num += 1
+                        continue
+                    if self.is_repeated_id(idx_id, loaded_ids):
+                        nrepeated += 1
+                    if incremental is not None and not incremental.is_changed(idx_id, doc_data):
+                        continue
+                    json_data += codec.dumps({"index": {"_id": idx_id}}) + b'\n'
+                json_data += codec.dumps(doc_data) + b'\n'
 
                 line_num += 1
                 auto_num += 1
                 if(line_num > chunk):
                     line_num = 0
                     print('.', end="", flush=True)
-                    self.bulk_load(idx_name, idx_type, json_data)
-                    json_data = ''
+                    bulk_load(idx_name, idx_type, json_data)
+                    json_data = bytearray()
         finally:
-            self.bulk_load(idx_name, idx_type, json_data)
+            bulk_load(idx_name, idx_type, json_data)
             logger.info('No. documents loaded: '+str(auto_num-1))
+            self.log_repeated_ids(idx_name, nrepeated)
+        if incremental is not None:
+            return incremental.finish(self.bulk_load)
 
     def parse_line(self, parts, column_names, idx_name, idx_type, is_GFF, is_GTF):
         ''' Parse the parts that make up the line. '''
@@ -163,18 +288,9 @@ class DelimeterLoader(Loader):
         return doc_data
 
     def _getAttributes(self, attrs, key_value_delim='='):
-        ''' Parse the attributes column '''
-        parts = re.split(';', attrs)
-        attrs_arr = {}
-        for p in parts:
-            if(p == ''):
-                continue
-            at = re.split(key_value_delim, p.strip())
-            if len(at) == 2:
-                attrs_arr[at[0]] = at[1]
-            else:
-                attrs_arr[at[0]] = ""
-        return attrs_arr
+        ''' Parse the attributes column (see L{GFF.parse_attributes}), keeping
+        only the L{attr_keys} if set. '''
+        return GFF.parse_attributes(attrs, key_value_delim=key_value_delim, keys=self.attr_keys)
 
     def _isfloat(self, value):
         try:
@@ -187,10 +303,15 @@ class DelimeterLoader(Loader):
 class JSONLoader(Loader):
     ''' Loader for JSON data. '''
 
-    def load(self, raw_json_data, idx_name, idx_type='json'):
-        ''' Index raw json data '''
-        json_data = ''
+    def load(self, raw_json_data, idx_name, idx_type='json', id_strategy=None, incremental=None):
+        ''' Index raw json data. Rows without an _id are given one by the I{id_strategy}
+        (see L{get_id_strategy}) if it is not 'auto'. With an I{incremental} load
+        (see L{get_incremental}) only the changed documents are sent. '''
+        json_data = bytearray()
         line_num = 0
+        bulk_load = self.bulk_load if incremental is None else incremental.track(self.bulk_load)
+        loaded_ids = set()
+        nrepeated = 0
         try:
             for row in raw_json_data:
                 row_obj = {"index": {}}
@@ -200,14 +321,27 @@ class JSONLoader(Loader):
                 if '_parent' in row:
                     row_obj['index'].update({"parent": row['_parent']})
                     del row['_parent']
-                json_data += json.dumps(row_obj) + '\n'
-                json_data += json.dumps(row) + '\n'
+                if '_id' not in row_obj['index'] and id_strategy is not None:
+                    idx_id = self.doc_id(row, id_strategy, line_num)
+                    if idx_id is None:
+                        logger.warn("WARNING: no document ID: "+str(row))
+                        continue
+                    row_obj['index'].update({"_id": idx_id})
+                    if self.is_repeated_id(idx_id, loaded_ids):
+                        nrepeated += 1
+                if incremental is not None and not incremental.is_changed(str(row_obj['index']['_id']), row):
+                    continue
+                json_data += codec.dumps(row_obj) + b'\n'
+                json_data += codec.dumps(row) + b'\n'
                 line_num += 1
 
                 if(line_num > 5000):
                     line_num = 0
                     print('.', end="", flush=True)
-                    self.bulk_load(idx_name, idx_type, json_data)
-                    json_data = ''
+                    bulk_load(idx_name, idx_type, json_data)
+                    json_data = bytearray()
         finally:
-            self.bulk_load(idx_name, idx_type, json_data)
+            bulk_load(idx_name, idx_type, json_data)
+            self.log_repeated_ids(idx_name, nrepeated)
+        if incremental is not None:
+            return incremental.finish(self.bulk_load)
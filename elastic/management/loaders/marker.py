@@ -1,17 +1,30 @@
 ''' Loader for marker data (I{e.g.} VCF). '''
 from elastic.management.loaders.loader import DelimeterLoader, Loader
 from elastic.management.loaders.mapping import MappingProperties
+from elastic.management.loaders.utils import VCFInfo
 
 
 class MarkerManager(DelimeterLoader):
+    NATURAL_KEY = ('id', )
+    vcf_info = None    # L{VCFInfo} INFO parser if the vcfInfo option is used
 
     def create_load_snp_index(self, **options):
-        ''' Index VCF dbSNP data '''
+        ''' Index VCF dbSNP data. With the vcfInfo option the listed INFO sub-fields
+        (or 'all' those in the header) are indexed as typed fields of I{info} and
+        multi-allelic I{alt} values are split into arrays. '''
         idx_name = self.get_index_name(**options)
         idx_type = self.get_index_type('marker', **options)
-        map_props = self._create_snp_mapping(idx_type, **options)
         f = self.open_file_to_load('indexSNP', **options)
-        self.load(map_props.get_column_names()[:-1], f, idx_name, idx_type, chunk=20000)
+        if options.get('vcfInfo'):
+            fields = None if options['vcfInfo'] == 'all' else \
+                [name.strip() for name in options['vcfInfo'].split(',')]
+            self.vcf_info = VCFInfo(VCFInfo.read_header(f), fields)
+        map_props = self._create_snp_mapping(idx_type, **options)
+        self.load(map_props.get_column_names()[:-1], f, idx_name, idx_type, chunk=20000,
+                  bin_param=self.get_bin_param(**options), id_strategy=self.get_id_strategy(**options),
+                  incremental=self.get_incremental(idx_name, idx_type, **options))
+        if self.vcf_info is not None:
+            self.vcf_info.log_failures()
 
     def _create_snp_mapping(self, idx_type, **options):
         ''' Create the mapping for snp index '''
@@ -20,19 +33,36 @@ class MarkerManager(DelimeterLoader):
              .add_property("start", "integer", index="not_analyzed") \
              .add_property("id", "string", analyzer="full_name") \
              .add_property("ref", "string", index="no") \
-             .add_property("alt", "string", index="no") \
+             .add_property("alt", "string", index="no" if self.vcf_info is None else "not_analyzed") \
              .add_property("qual", "string", index="no") \
-             .add_property("filter", "string", index="no") \
-             .add_property("info", "string", index="no") \
-             .add_property("suggest", "completion", analyzer="full_name")
+             .add_property("filter", "string", index="no")
+        if self.vcf_info is None:
+            props.add_property("info", "string", index="no")
+        else:
+            props.add_property("info", "object")
+            props.add_properties(self.vcf_info.mapping_properties())
+        props.add_property("suggest", "completion", analyzer="full_name")
+        self.add_bin_property(props, **options)
         tags = MappingProperties("tags")
         tags.add_property("weight", "integer", index="not_analyzed")
         props.add_properties(tags)
         self.mapping(props, idx_type, analyzer=Loader.KEYWORD_ANALYZER, **options)
         return props
 
+    def parse_line(self, parts, column_names, idx_name, idx_type, is_GFF, is_GTF):
+        ''' Overrides Delimeter.parse_line() - to parse the VCF columns directly
+        when the INFO sub-fields are typed (see L{VCFInfo}). '''
+        if self.vcf_info is None:
+            return super().parse_line(parts, column_names, idx_name, idx_type, is_GFF, is_GTF)
+        alt = parts[4].strip()
+        return {"seqid": parts[0].strip(), "start": int(parts[1]), "id": parts[2].strip(),
+                "ref": parts[3].strip(), "alt": [] if alt == '.' else alt.split(','),
+                "qual": parts[5].strip(), "filter": parts[6].strip(),
+                "info": self.vcf_info.parse(parts[7].strip())}
+
 
 class RsMerge(DelimeterLoader):
+    NATURAL_KEY = ('rshigh', )
 
     def create_load_snp_merge_index(self, **options):
         ''' Index rs number merge dbSNP data '''
@@ -40,7 +70,9 @@ class RsMerge(DelimeterLoader):
         idx_type = self.get_index_type('rs_merge', **options)
         map_props = self._create_rs_merge_mapping(idx_type, **options)
         f = self.open_file_to_load('indexSNPMerge', **options)
-        self.load(map_props.get_column_names(), f, idx_name, idx_type, chunk=10000)
+        self.load(map_props.get_column_names(), f, idx_name, idx_type, chunk=10000,
+                  id_strategy=self.get_id_strategy(**options),
+                  incremental=self.get_incremental(idx_name, idx_type, **options))
 
     def _create_rs_merge_mapping(self, idx_type, **options):
         ''' Create the mapping for rs index '''
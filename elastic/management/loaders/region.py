@@ -4,9 +4,9 @@ Created on 28 Jan 2016
 @author: ellen
 '''
 import csv
-import json
 import re
 
+from elastic import codec
 from elastic.elastic_settings import ElasticSettings
 from elastic.query import Query, BoolQuery, RangeQuery
 from elastic.search import ElasticQuery, Search, Sort, Delete
@@ -155,7 +155,7 @@ class RegionManager(object):
                 }
 
                 r = Search.elastic_request(ElasticSettings.url(), ElasticSettings.idx('REGION', 'STUDY_HITS'),
-                                           json.dumps(data))
+                                           codec.dumps(data))
                 if r.status_code != 201:
                     message += "ERROR loading row of gwas data for "+row[0]+" - Failed to create document; <br />\n"
 
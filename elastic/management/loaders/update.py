@@ -1,8 +1,8 @@
 ''' Update manager to update indexes '''
+from elastic import codec
 from elastic.search import Search, ScanAndScroll, ElasticQuery
 from elastic.management.loaders.loader import Loader
 import sys
-import json
 import logging
 from elastic.query import Query
 import random
@@ -32,13 +32,14 @@ def fetch_update(resp_json):
 
     line_num = 0
     auto_num = 1
-    json_data = ''
+    json_data = bytearray()
     chunk = 500
+    json_lines = codec.dumps(JSON_LINES) + b'\n'
     try:
         for doc in resp_json['hits']['hits']:
             doc_data = {"update": {"_id": doc["_id"], "_type": IDX_TYPE, "_index": IDX_NAME, "_retry_on_conflict": 3}}
-            json_data += json.dumps(doc_data) + '\n'
-            json_data += json.dumps(JSON_LINES) + '\n'
+            json_data += codec.dumps(doc_data) + b'\n'
+            json_data += json_lines
 
             line_num += 1
             auto_num += 1
@@ -47,7 +48,7 @@ def fetch_update(resp_json):
                 line_num = 0
                 print('.', end="", flush=True)
                 Loader().bulk_load(IDX_NAME, IDX_TYPE, json_data)
-                json_data = ''
+                json_data = bytearray()
 
     finally:
         Loader().bulk_load(IDX_NAME, IDX_TYPE, json_data)
@@ -85,7 +86,7 @@ class UpdateManager(Loader):
             for line in f:
                 lines += line.decode("utf-8").rstrip()
 
-            JSON_LINES = json.loads(lines)
+            JSON_LINES = codec.loads(lines)
 
             if options['random_update']:
                 logger.debug('Random updates')
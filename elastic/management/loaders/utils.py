@@ -1,6 +1,11 @@
 ''' Utilities for loaders. '''
+import logging
 import sys
-import re
+
+from elastic.management.loaders.mapping import MappingProperties
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
 
 
 class GFF:
@@ -8,7 +13,7 @@ class GFF:
 
     def __init__(self, line='dummy\tdummy\tregion\t' + str(sys.maxsize) +
                  '\t-1\t.\t.\t.\t\t', field_delim=';', key_value_delim='='):
-        parts = re.split('\t', line)
+        parts = line.split('\t')
         if(len(parts) != 9):
             raise GFFError("GFF error: wrong number of columns")
         self.seqid = parts[0]
@@ -25,15 +30,68 @@ class GFF:
 
     def _parseAttributes(self, field_delim, key_value_delim):
         ''' Parse the attributes column '''
-        parts = re.split(field_delim, self.attrStr.strip())
-        for p in parts:
-            if(p == ''):
+        self.attrs = GFF.parse_attributes(self.attrStr, field_delim, key_value_delim)
+
+    @classmethod
+    def parse_attributes(cls, attr_str, field_delim=';', key_value_delim='=', keys=None):
+        ''' Parse a GFF3 (I{tag=value}) or GTF (I{tag "value"}) attributes column.
+        Double quotes around values are removed (and field delimiters inside them
+        are kept), repeated tags give a list of values and the tag names are
+        interned as they repeat on every line.
+        @type  keys: set
+        @keyword keys: Only return these attributes (default: all).
+        '''
+        attrs = {}
+        if '"' not in attr_str:
+            GFF._add_fields(attrs, attr_str, field_delim, key_value_delim, keys)
+            return attrs
+
+        # split on the quotes, the odd pieces are the quoted values and the key of
+        # each is the last field of the piece before it (I{e.g.} '; gene_id ')
+        intern = sys.intern
+        pieces = attr_str.split('"')
+        last = len(pieces) - 1
+        for i in range(0, last, 2):
+            piece = pieces[i]
+            pos = piece.rfind(field_delim)
+            if pos >= 0:
+                if pos > 0 and not piece[:pos].isspace():
+                    GFF._add_fields(attrs, piece[:pos], field_delim, key_value_delim, keys)
+                piece = piece[pos + 1:]
+            key = piece.strip()
+            if key.endswith(key_value_delim):
+                key = key[:-len(key_value_delim)].rstrip()
+            if keys is None or key in keys:
+                key = intern(key)
+                if key in attrs:
+                    GFF._add_repeated(attrs, key, pieces[i + 1])
+                else:
+                    attrs[key] = pieces[i + 1]
+        if last % 2 == 0 and pieces[last].strip(' ' + field_delim) != '':
+            GFF._add_fields(attrs, pieces[last], field_delim, key_value_delim, keys)
+        return attrs
+
+    @classmethod
+    def _add_fields(cls, attrs, attr_str, field_delim, key_value_delim, keys):
+        ''' Add the unquoted I{tag=value} fields. '''
+        intern = sys.intern
+        for p in attr_str.split(field_delim):
+            (key, _, value) = p.strip().partition(key_value_delim)
+            if key == '' or (keys is not None and key not in keys):
                 continue
-            at = re.split(key_value_delim, p.strip())
-            if len(at) == 2:
-                self.attrs[at[0]] = at[1]
+            key = intern(key)
+            if key in attrs:
+                GFF._add_repeated(attrs, key, value.strip())
             else:
-                self.attrs[at[0]] = ""
+                attrs[key] = value.strip()
+
+    @classmethod
+    def _add_repeated(cls, attrs, key, value):
+        ''' Add the value of a repeated tag to its list of values. '''
+        if isinstance(attrs[key], list):
+            attrs[key].append(value)
+        else:
+            attrs[key] = [attrs[key], value]
 
     def getAttributes(self):
         return self.attrs
@@ -46,3 +104,118 @@ class GFFError(Exception):
 
     def __str__(self):
         return repr(self.value)
+
+
+class VCFInfo:
+    ''' Parser for the INFO column of VCF records. The sub-fields to keep are
+    typed from the ##INFO header lines and each has a converter chosen once,
+    so parsing a record is a split and a dictionary lookup per sub-field. '''
+
+    CONVERTERS = {'Integer': int, 'Float': float, 'Character': str, 'String': str}
+    MAPPING_TYPES = {'Integer': 'long', 'Float': 'float', 'Flag': 'boolean',
+                     'Character': 'string', 'String': 'string'}
+
+    def __init__(self, header, fields=None):
+        '''
+        @type  header: dict
+        @param header: INFO IDs and their (Number, Type) from the VCF header (see L{read_header}).
+        @type  fields: list
+        @keyword fields: INFO IDs to keep (default: all those in the header). The
+        type and number can be given (or overridden) as ID:Type[:Number], I{e.g.}
+        'CAF:Float:R' or 'ASP:Flag'. IDs missing from the header are kept as strings.
+        '''
+        if fields is None:
+            fields = list(header.keys())
+        self.types = {}
+        self.converters = {}
+        for field in fields:
+            parts = field.split(':')
+            key = parts[0]
+            if len(parts) > 1:
+                (number, info_type) = (parts[2] if len(parts) > 2 else header.get(key, ('1', ))[0], parts[1])
+            elif key in header:
+                (number, info_type) = header[key]
+            else:
+                logger.warning('VCF INFO ' + key + ': not in the header, indexed as a string')
+                (number, info_type) = ('1', 'String')
+            if info_type not in VCFInfo.MAPPING_TYPES:
+                info_type = 'String'
+            if number == '0':
+                info_type = 'Flag'
+            self.types[key] = info_type
+            self.converters[sys.intern(key)] = VCFInfo._converter(number, info_type)
+        self.failures = {}
+
+    @classmethod
+    def read_header(cls, file_handle):
+        ''' Read the VCF meta-information lines up to and including the #CHROM line
+        and return the INFO IDs and their (Number, Type). If there is no #CHROM line
+        the file (which must be seekable) is left at the first data line. '''
+        header = {}
+        while True:
+            pos = file_handle.tell()
+            line = file_handle.readline()
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")
+            if not line.startswith('#'):
+                file_handle.seek(pos)
+                break
+            if not line.startswith('##'):
+                break
+            if not line.startswith('##INFO=<'):
+                continue
+            attrs = {}
+            for part in line[8:].rstrip().rstrip('>').split(','):
+                (key, _, value) = part.partition('=')
+                if key in ('ID', 'Number', 'Type'):
+                    attrs[key] = value
+            if 'ID' in attrs:
+                header[attrs['ID']] = (attrs.get('Number', '1'), attrs.get('Type', 'String'))
+        return header
+
+    @classmethod
+    def _converter(cls, number, info_type):
+        ''' Return the function to convert an INFO value, a list for Number A, R, G,
+        . or greater than 1. Missing values ('.') are None. '''
+        if info_type == 'Flag':
+            return lambda value: True
+        convert = VCFInfo.CONVERTERS[info_type]
+        if number == '1':
+            return lambda value: None if value == '.' else convert(value)
+        return lambda value: [None if v == '.' else convert(v) for v in value.split(',')]
+
+    def parse(self, info):
+        ''' Return the typed sub-fields kept from an INFO column value. Values that
+        can not be converted to the header type are left out and counted, only
+        the first is logged for each sub-field (see L{log_failures}). '''
+        converters = self.converters
+        info_data = {}
+        for item in info.split(';'):
+            (key, _, value) = item.partition('=')
+            convert = converters.get(key)
+            if convert is None:
+                continue
+            try:
+                info_data[key] = convert(value)
+            except ValueError:
+                if key not in self.failures:
+                    logger.warning('VCF INFO ' + key + ': not a ' + self.types[key] + ' ' + value)
+                    self.failures[key] = 0
+                self.failures[key] += 1
+        return info_data
+
+    def log_failures(self):
+        ''' Log the number of values of each sub-field that could not be converted. '''
+        for (key, count) in sorted(self.failures.items()):
+            logger.warning('VCF INFO ' + key + ': ' + str(count) + ' values not a ' + self.types[key] +
+                           ' left out')
+
+    def mapping_properties(self, idx_type='info'):
+        ''' Return the L{MappingProperties} of the INFO sub-fields. '''
+        props = MappingProperties(idx_type)
+        for (key, info_type) in self.types.items():
+            if info_type == 'String' or info_type == 'Character':
+                props.add_property(key, VCFInfo.MAPPING_TYPES[info_type], index="not_analyzed")
+            else:
+                props.add_property(key, VCFInfo.MAPPING_TYPES[info_type])
+        return props
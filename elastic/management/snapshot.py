@@ -1,5 +1,6 @@
+from elastic import codec
 from elastic.elastic_settings import ElasticSettings
-import requests
+from elastic.search import Search
 import json
 import logging
 import os
@@ -14,12 +15,12 @@ class Snapshot():
 
     @classmethod
     def is_running(cls, repo=''):
-        url = ElasticSettings.url() + '/_snapshot/' + repo + '/_status'
-        resp = requests.get(url)
+        url = '_snapshot/' + repo + '/_status'
+        resp = Search.elastic_request(ElasticSettings.url(), url, is_post=False, call_type='admin')
         if resp.status_code != 200:
             logger.debug(url+' :: '+resp.status_code)
         else:
-            json_resp = resp.json()
+            json_resp = codec.response_json(resp)
             try:
                 return len(json_resp['snapshots']) > 0
             except Exception as e:
@@ -29,8 +30,8 @@ class Snapshot():
     @classmethod
     def exists(cls, repo, snapshot):
         ''' Test if the repository/snapshot exists. '''
-        url = ElasticSettings.url() + '/_snapshot/' + repo + '/' + snapshot
-        resp = requests.get(url)
+        url = '_snapshot/' + repo + '/' + snapshot
+        resp = Search.elastic_request(ElasticSettings.url(), url, is_post=False, call_type='admin')
         if resp.status_code != 200:
             return False
         else:
@@ -53,18 +54,18 @@ class Snapshot():
         if all_repos:
             repo = ''
             snapshots = ''
-        url = ElasticSettings.url() + '/_snapshot/' + repo + '/' + snapshots
-        resp = requests.get(url)
+        url = '_snapshot/' + repo + '/' + snapshots
+        resp = Search.elastic_request(ElasticSettings.url(), url, is_post=False, call_type='admin')
         if resp.status_code != 200:
             logger.error("Returned status (for "+url+"): "+str(resp.status_code))
-            logger.error(resp.json()["error"])
+            logger.error(codec.response_json(resp)["error"])
             return False
-        print(json.dumps(resp.json(), indent=4))
+        print(json.dumps(codec.response_json(resp), indent=4))
         return True
 
     @classmethod
     def create_repository(self, repo, location):
-        url = ElasticSettings.url() + '/_snapshot/' + repo
+        url = '_snapshot/' + repo
         if Snapshot.exists(repo, ''):
             logger.error("Repository "+repo+" already exists!")
             return False
@@ -76,17 +77,18 @@ class Snapshot():
         data = {"type": "fs",
                 "settings": {"location": location}
                 }
-        resp = requests.put(url, data=json.dumps(data))
+        resp = Search.elastic_request(ElasticSettings.url(), url, data=codec.dumps(data), method='PUT',
+                                      call_type='admin')
         if resp.status_code != 200:
-            logger.error("Status ("+url+"): "+str(resp.status_code) + " :: " + str(resp.json()["error"]))
+            logger.error("Status ("+url+"): "+str(resp.status_code) + " :: " + str(codec.response_json(resp)["error"]))
         return True
 
     @classmethod
     def delete_repository(cls, repo):
-        url = ElasticSettings.url() + '/_snapshot/' + repo
-        resp = requests.delete(url)
+        url = '_snapshot/' + repo
+        resp = Search.elastic_request(ElasticSettings.url(), url, method='DELETE', call_type='admin')
         if resp.status_code != 200:
-            logger.error("Status ("+url+"): "+str(resp.status_code) + " :: " + str(resp.json()["error"]))
+            logger.error("Status ("+url+"): "+str(resp.status_code) + " :: " + str(codec.response_json(resp)["error"]))
             return False
         return True
 
@@ -94,8 +96,8 @@ class Snapshot():
     def create_snapshot(cls, repo, snapshot, indices):
         ''' Create a snapshot for the specified indices or all if
         indices is None. '''
-        url = ElasticSettings.url() + '/_snapshot/' + repo + '/' + snapshot + '?wait_for_completion=true'
-        resp = requests.get(url)
+        url = '_snapshot/' + repo + '/' + snapshot + '?wait_for_completion=true'
+        resp = Search.elastic_request(ElasticSettings.url(), url, is_post=False, call_type='admin')
         if resp.status_code == 200:
             logger.error("Snapshot "+snapshot+" already exists!")
             return False
@@ -103,24 +105,26 @@ class Snapshot():
         data = {}
         if indices is not None:
             data = {"indices": indices}
-        resp = requests.put(url, data=json.dumps(data))
+        resp = Search.elastic_request(ElasticSettings.url(), url, data=codec.dumps(data), method='PUT',
+                                      call_type='admin')
         if resp.status_code != 200:
-            logger.error("Snapshot "+snapshot+" create error! :: " + str(resp.json()["error"]))
+            logger.error("Snapshot "+snapshot+" create error! :: " + str(codec.response_json(resp)["error"]))
         return True
 
     @classmethod
     def delete_snapshot(cls, repo, snapshot):
-        url = ElasticSettings.url() + '/_snapshot/' + repo + '/' + snapshot
-        resp = requests.delete(url)
+        url = '_snapshot/' + repo + '/' + snapshot
+        resp = Search.elastic_request(ElasticSettings.url(), url, method='DELETE', call_type='admin')
         if resp.status_code != 200:
-            logger.error("Status ("+url+"): "+str(resp.status_code) + " :: " + str(resp.json()["error"]))
+            logger.error("Status ("+url+"): "+str(resp.status_code) + " :: " + str(codec.response_json(resp)["error"]))
 
     @classmethod
     def restore_snapshot(cls, repo, snapshot, url, indices):
-        url += '/_snapshot/' + repo + '/' + snapshot + '/_restore'
+        elastic_url = url
+        url = '_snapshot/' + repo + '/' + snapshot + '/_restore'
         data = {}
         if indices is not None:
             data = {"indices": indices}
-        resp = requests.post(url, data=json.dumps(data))
+        resp = Search.elastic_request(elastic_url, url, data=codec.dumps(data), call_type='admin')
         if resp.status_code != 200:
-            logger.error("Status ("+url+"): "+str(resp.status_code) + " :: " + str(resp.json()["error"]))
+            logger.error("Status ("+url+"): "+str(resp.status_code) + " :: " + str(codec.response_json(resp)["error"]))
@@ -0,0 +1,243 @@
+''' Cached index mappings and client-side validation of queries against them.
+
+The L{MappingCache} holds the mapping of each index, fetched when first used.
+After C{MAPPING_CACHE_TTL} seconds (default: 300) the index metadata version
+is checked (Elastic 5+, older versions fetch the mapping again) and the
+mapping is reloaded if it has changed. An index that is not found is also
+cached for the TTL, so it is not requested for every search. Loading a mapping with a L{Loader}
+also clears it from the cache.
+
+The L{QueryValidator} checks a search body (query and aggregations) against
+the mapping before it is sent and raises a L{QueryError} for:
+
+    - fields that are not in the mapping (I{e.g.} a typo in a L{Query.term});
+    - range queries on string fields;
+    - aggregations on analyzed string fields.
+
+L{Search} validates queries when C{VALIDATE_QUERIES} is set in the C{ELASTIC}
+settings or the I{validate} argument is True.
+'''
+import logging
+import threading
+import time
+
+from elastic import codec
+from elastic.elastic_settings import ElasticSettings
+from elastic.exceptions import QueryError
+
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+class IndexMapping(object):
+    ''' The fields of the mapping of one or more indices by type, with the
+    names of object, nested and multi-fields flattened (I{e.g.} 'featureloc.start'). '''
+    STRING_TYPES = ('string', 'text', 'keyword')
+
+    def __init__(self, mapping_json, version=None):
+        '''
+        @type  mapping_json: dict
+        @param mapping_json: Response of the C{_mapping} API.
+        @type  version: tuple
+        @keyword version: Metadata version of the indices.
+        '''
+        self.version = version
+        self.types = {}
+        for idx_mapping in mapping_json.values():
+            mappings = idx_mapping.get('mappings', {})
+            if 'properties' in mappings:
+                mappings = {'_doc': mappings}    # Elastic 7+ mapping without types
+            for (idx_type, type_mapping) in mappings.items():
+                fields = self.types.setdefault(idx_type, {})
+                IndexMapping._add_fields(fields, type_mapping.get('properties', {}), '')
+
+    @classmethod
+    def _add_fields(cls, fields, properties, prefix):
+        for (name, props) in properties.items():
+            fields[prefix + name] = props
+            if 'properties' in props:
+                IndexMapping._add_fields(fields, props['properties'], prefix + name + '.')
+            for (sub_name, sub_props) in props.get('fields', {}).items():
+                fields[prefix + name + '.' + sub_name] = sub_props
+
+    def field(self, name, idx_type=None):
+        ''' Return the mapping properties of a field or None if it is not mapped. '''
+        types = [idx_type] if idx_type else self.types.keys()
+        for t in types:
+            props = self.types.get(t, {}).get(name)
+            if props is not None:
+                return props
+        return None
+
+    def field_type(self, name, idx_type=None):
+        ''' Return the type of a field (I{e.g.} 'string', 'integer') or None. '''
+        props = self.field(name, idx_type)
+        if props is None:
+            return None
+        return props.get('type', 'object' if 'properties' in props else None)
+
+    def is_string(self, name, idx_type=None):
+        return self.field_type(name, idx_type) in IndexMapping.STRING_TYPES
+
+    def is_analyzed(self, name, idx_type=None):
+        ''' Return True if the field is an analyzed string. '''
+        props = self.field(name, idx_type)
+        if props is None:
+            return False
+        if props.get('type') == 'text':
+            return True
+        return props.get('type') == 'string' and props.get('index', 'analyzed') == 'analyzed'
+
+
+class MappingCache(object):
+    ''' Per-index cache of the L{IndexMapping}s. '''
+    _lock = threading.Lock()
+    _mappings = {}
+
+    @classmethod
+    def get(cls, idx, cluster='default', refresh=False):
+        ''' Return the L{IndexMapping} for an index (or comma separated indices,
+        optionally followed by '/' and the type) or None if the index does not exist. '''
+        key = (cluster, idx)
+        entry = MappingCache._mappings.get(key)
+        if entry is not None and not refresh:
+            (mapping, checked) = entry
+            ttl = ElasticSettings.getattr('MAPPING_CACHE_TTL', cluster=cluster, default=300)
+            if time.time() - checked < ttl:
+                return mapping
+            if mapping is not None:
+                version = MappingCache._version(idx, cluster)
+                if version is not None and version == mapping.version:
+                    MappingCache._mappings[key] = (mapping, time.time())
+                    return mapping
+
+        mapping = MappingCache._load(idx, cluster)
+        with MappingCache._lock:
+            MappingCache._mappings[key] = (mapping, time.time())
+        return mapping
+
+    @classmethod
+    def invalidate(cls, idx=None, cluster='default'):
+        ''' Remove an index (or all indices) from the cache. '''
+        with MappingCache._lock:
+            if idx is None:
+                MappingCache._mappings.clear()
+            else:
+                for key in [k for k in MappingCache._mappings
+                            if k[0] == cluster and idx in MappingCache._indices(k[1]).split(',')]:
+                    del MappingCache._mappings[key]
+
+    @classmethod
+    def _load(cls, idx, cluster):
+        from elastic.search import Search
+        version = MappingCache._version(idx, cluster)
+        response = Search.elastic_request(ElasticSettings.url(cluster), idx + '/_mapping', is_post=False,
+                                          cluster=cluster, call_type='admin')
+        if response.status_code != 200:
+            logger.warning('Mapping not found for ' + idx + ' (' + str(response.status_code) + ')')
+            return None
+        return IndexMapping(codec.response_json(response), version=version)
+
+    @classmethod
+    def _version(cls, idx, cluster):
+        ''' Return the metadata versions of the indices (Elastic 5+) or None. '''
+        from elastic.search import Search
+        url = '_cluster/state/metadata/' + MappingCache._indices(idx) + '?filter_path=metadata.indices.*.version'
+        response = Search.elastic_request(ElasticSettings.url(cluster), url, is_post=False,
+                                          cluster=cluster, call_type='admin')
+        if response.status_code != 200:
+            return None
+        indices = codec.response_json(response).get('metadata', {}).get('indices', {})
+        versions = [(name, meta['version']) for (name, meta) in indices.items() if 'version' in meta]
+        return tuple(sorted(versions)) if len(versions) > 0 else None
+
+    @classmethod
+    def _indices(cls, idx):
+        ''' Return the indices of an 'idx/type' string. '''
+        return idx.split('/', 1)[0]
+
+
+class QueryValidator(object):
+    ''' Validate the fields used in a search body against the index mapping. '''
+    FIELD_QUERIES = ('term', 'terms', 'range', 'match', 'match_phrase', 'match_phrase_prefix',
+                     'prefix', 'wildcard', 'regexp', 'fuzzy', 'common')
+    FIELDS_QUERIES = ('query_string', 'simple_query_string', 'multi_match')
+    OPTIONS = ('boost', '_name', '_cache', '_cache_key', 'execution', 'minimum_should_match')
+    META_FIELDS = ('_id', '_uid', '_type', '_index', '_parent', '_routing', '_source', '_all', '_score')
+
+    @classmethod
+    def validate(cls, body, idx, idx_type=None, cluster='default'):
+        ''' Raise a L{QueryError} if the search body uses fields that are not
+        mapped, ranges over strings or aggregations on analyzed strings. '''
+        errors = QueryValidator.errors(body, idx, idx_type, cluster)
+        if len(errors) > 0:
+            raise QueryError('Invalid query for ' + idx + ': ' + '; '.join(errors))
+
+    @classmethod
+    def errors(cls, body, idx, idx_type=None, cluster='default'):
+        ''' Return a list of the problems found in a search body. '''
+        mapping = MappingCache.get(idx, cluster=cluster)
+        if mapping is None or not isinstance(body, dict):
+            return []
+        errors = []
+        for key in ('query', 'post_filter'):
+            if key in body:
+                cls._query(body[key], mapping, idx_type, errors)
+        for key in ('aggregations', 'aggs'):
+            if key in body:
+                cls._aggs(body[key], mapping, idx_type, errors)
+        return errors
+
+    @classmethod
+    def _query(cls, query, mapping, idx_type, errors):
+        if isinstance(query, (list, tuple)):
+            for q in query:
+                cls._query(q, mapping, idx_type, errors)
+            return
+        if not isinstance(query, dict):
+            return
+        for (qtype, qbody) in query.items():
+            if qtype in QueryValidator.FIELD_QUERIES and isinstance(qbody, dict):
+                for name in qbody:
+                    if name in QueryValidator.OPTIONS:
+                        continue
+                    if cls._check_field(name, mapping, idx_type, errors) and qtype == 'range' and \
+                            mapping.is_string(name, idx_type):
+                        errors.append('range query on string field ' + name)
+            elif qtype in ('exists', 'missing') and isinstance(qbody, dict) and 'field' in qbody:
+                cls._check_field(qbody['field'], mapping, idx_type, errors)
+            elif qtype in QueryValidator.FIELDS_QUERIES and isinstance(qbody, dict):
+                for name in qbody.get('fields', []):
+                    cls._check_field(name.split('^')[0], mapping, idx_type, errors)
+            else:
+                cls._query(qbody, mapping, idx_type, errors)
+
+    @classmethod
+    def _aggs(cls, aggs, mapping, idx_type, errors):
+        if not isinstance(aggs, dict):
+            return
+        for agg in aggs.values():
+            if not isinstance(agg, dict):
+                continue
+            for (atype, abody) in agg.items():
+                if atype in ('aggs', 'aggregations'):
+                    cls._aggs(abody, mapping, idx_type, errors)
+                elif atype == 'filter':
+                    cls._query(abody, mapping, idx_type, errors)
+                elif atype == 'filters' and isinstance(abody, dict):
+                    cls._query(list(abody.get('filters', {}).values()), mapping, idx_type, errors)
+                elif isinstance(abody, dict) and isinstance(abody.get('field'), str):
+                    name = abody['field']
+                    if cls._check_field(name, mapping, idx_type, errors) and mapping.is_analyzed(name, idx_type):
+                        errors.append('aggregation (' + atype + ') on analyzed field ' + name)
+
+    @classmethod
+    def _check_field(cls, name, mapping, idx_type, errors):
+        ''' Return True if the field is mapped (or cannot be checked) otherwise add an error. '''
+        if '*' in name or name in QueryValidator.META_FIELDS:
+            return False
+        if mapping.field(name, idx_type) is None:
+            errors.append('unknown field ' + name)
+            return False
+        return True
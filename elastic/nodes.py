@@ -0,0 +1,347 @@
+''' Health-aware pool of the Elastic nodes (URLs) of a cluster.
+
+Each L{Node} keeps its health state: the number of consecutive failures,
+the time until which it is considered dead and an exponentially weighted
+moving average (EWMA) of its response latency. A failing node is marked
+dead for C{DEAD_TIMEOUT} seconds, doubling on each consecutive failure up
+to C{MAX_DEAD_TIMEOUT}, after which it is tried again (resurrected).
+
+Each node also acts as a circuit breaker. After C{CIRCUIT_BREAKER_THRESHOLD}
+consecutive failures the circuit is open and the node is not used, even if
+all other nodes are dead, until its dead timeout has passed. It is then
+half-open and a single request is allowed through as a probe; success closes
+the circuit and failure opens it again. The probe is claimed (L{NodePool.claim})
+by the thread that sends the request, just before it is sent, and is given up
+if no response is received within the node's dead timeout. Selecting a node
+(I{e.g.} to get a url) does not claim it. When the circuits of all the nodes
+are open requests fail fast with L{NodeUnavailableError}.
+
+The L{NodePool} selects the next node, either round-robin or the node with
+the lowest latency, from the nodes that are alive. If all the nodes are
+dead the one due to be resurrected first is used. Selection and updates are
+thread-safe. The pool is configured in the C{ELASTIC} cluster settings::
+
+    'NODE_SELECTOR': 'round_robin',    # or 'least_latency'
+    'DEAD_TIMEOUT': 60,                # seconds
+    'MAX_DEAD_TIMEOUT': 1800,          # seconds
+    'MAX_RETRIES': 3,                  # retries of idempotent requests
+    'CIRCUIT_BREAKER_THRESHOLD': 5,    # consecutive failures to open the circuit
+
+The nodes can also be discovered by a L{Sniffer} that requests C{_nodes/http}
+from the cluster and replaces the nodes in the pool with the HTTP enabled
+nodes found, excluding master-only nodes (or using C{SNIFF_NODE_FILTER})::
+
+    'SNIFF_ON_START': True,            # sniff before the first request
+    'SNIFF_INTERVAL': 300,             # seconds between sniffs (in a background thread)
+    'SNIFF_ON_FAILURE': True,          # sniff after a node fails
+    'SNIFF_NODE_FILTER': 'path.to.node_filter',  # callable(node_info) -> bool
+'''
+import logging
+import re
+import threading
+import time
+
+import requests
+
+from elastic import codec
+from elastic.coalesce import SingleFlight
+from elastic.exceptions import NodeUnavailableError
+
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+class Node(object):
+    ''' An Elastic node and its health state. '''
+
+    def __init__(self, url):
+        self.url = url
+        self.failures = 0
+        self.dead_until = None
+        self.latency = None
+        self.probing = False
+        self.probe_owner = None
+        self.probe_until = None
+
+    def is_alive(self, now=None):
+        ''' Return True if the node is not marked dead (or is due to be resurrected). '''
+        if self.dead_until is None:
+            return True
+        return (time.time() if now is None else now) >= self.dead_until
+
+    def __repr__(self):
+        return ('Node(' + self.url + ', failures=' + str(self.failures) +
+                ', latency=' + str(self.latency) + ')')
+
+
+class NodePool(object):
+    ''' Thread-safe pool of L{Node}s with round-robin or least latency selection. '''
+    ROUND_ROBIN = 'round_robin'
+    LEAST_LATENCY = 'least_latency'
+
+    def __init__(self, urls, selector=ROUND_ROBIN, dead_timeout=60, max_dead_timeout=1800, ewma_alpha=0.3,
+                 failure_threshold=5):
+        if selector not in (NodePool.ROUND_ROBIN, NodePool.LEAST_LATENCY):
+            raise ValueError('Unknown node selector: ' + str(selector))
+        self.selector = selector
+        self.dead_timeout = dead_timeout
+        self.max_dead_timeout = max_dead_timeout
+        self.ewma_alpha = ewma_alpha
+        self.failure_threshold = failure_threshold
+        self._lock = threading.Lock()
+        self._index = 0
+        self.nodes = [Node(url) for url in urls]
+        self.sniffer = None
+        self.stats = WireStats()
+        self.coalescer = SingleFlight()
+
+    def urls(self):
+        ''' Return the urls of the nodes in the pool. '''
+        return [node.url for node in self.nodes]
+
+    def set_urls(self, urls):
+        ''' Replace the nodes in the pool, keeping the health state of the nodes
+        already in the pool. '''
+        if len(urls) == 0:
+            logger.warning('No elastic nodes to set in the pool')
+            return
+        with self._lock:
+            current = {node.url: node for node in self.nodes}
+            self.nodes = [current.get(url, Node(url)) for url in urls]
+
+    def get_node(self, exclude=None, claim=False):
+        ''' Select a node to send a request to.
+        @type  exclude: list
+        @keyword exclude: Nodes not to select (I{e.g.} already tried) unless there are no others.
+        @type  claim: bool
+        @keyword claim: Claim the probe if the circuit of the node selected is
+        half-open, when the request is about to be sent (see L{claim}).
+        '''
+        with self._lock:
+            now = time.time()
+            nodes = [n for n in self.nodes if not exclude or n not in exclude]
+            if len(nodes) == 0:
+                nodes = self.nodes
+            nodes = [n for n in nodes if self._is_available(n, now)]
+            if len(nodes) == 0:
+                raise NodeUnavailableError('No elastic node available (circuit breakers open)')
+            live = [n for n in nodes if n.is_alive(now)]
+            if len(live) == 0:
+                # all dead so try the one due to be resurrected first
+                node = min(nodes, key=lambda n: n.dead_until)
+            elif self.selector == NodePool.LEAST_LATENCY:
+                untried = [n for n in live if n.latency is None]
+                node = untried[0] if len(untried) > 0 else min(live, key=lambda n: n.latency)
+            else:
+                self._index = (self._index + 1) % len(live)
+                node = live[self._index]
+            if claim:
+                self._claim(node, now)
+            return node
+
+    def claim(self, node):
+        ''' Claim a node to send a request to now. If its circuit is half-open the
+        request of this thread is the probe. Return False if the circuit is open
+        or another request is probing it. '''
+        with self._lock:
+            now = time.time()
+            if not self._is_available(node, now):
+                return False
+            self._claim(node, now)
+            return True
+
+    def _claim(self, node, now):
+        if self.is_circuit_open(node) and not self._is_owner(node):
+            node.probing = True
+            node.probe_owner = threading.get_ident()
+            node.probe_until = now + self.dead_timeout
+
+    def is_circuit_open(self, node):
+        ''' Return True if the node has failed enough times to open its circuit breaker. '''
+        return node.failures >= self.failure_threshold
+
+    def is_available(self, node):
+        ''' Return False if the circuit breaker of the node is open (or half-open
+        with a probe in progress) so requests should not be sent to it. The
+        thread that claimed the probe (see L{claim}) can send it. '''
+        with self._lock:
+            return self._is_available(node, time.time())
+
+    def _is_available(self, node, now):
+        if not self.is_circuit_open(node) or self._is_owner(node):
+            return True
+        return node.is_alive(now) and (not node.probing or now >= node.probe_until)
+
+    def _is_owner(self, node):
+        return node.probing and node.probe_owner == threading.get_ident()
+
+    def release_probe(self, node):
+        ''' Give up the probe of a half-open node claimed by this thread without a
+        result (I{e.g.} the request raised an unexpected exception) so another
+        request can probe it. '''
+        with self._lock:
+            if self._is_owner(node):
+                node.probing = False
+                node.probe_owner = None
+
+    def get(self, url):
+        ''' Return the node for a url or None if it is not in the pool. '''
+        for node in self.nodes:
+            if node.url == url:
+                return node
+        return None
+
+    def mark_dead(self, node):
+        ''' Mark a node as dead following a failed request. '''
+        with self._lock:
+            node.failures += 1
+            node.probing = False
+            node.probe_owner = None
+            timeout = min(self.dead_timeout * 2 ** (node.failures - 1), self.max_dead_timeout)
+            node.dead_until = time.time() + timeout
+        logger.warning('Elastic node ' + node.url + ' marked dead for ' + str(timeout) + 's (failures: ' +
+                       str(node.failures) + ')')
+
+    def mark_live(self, node, latency=None):
+        ''' Mark a node as alive following a successful request and update its latency. '''
+        with self._lock:
+            if node.failures > 0:
+                logger.info('Elastic node ' + node.url + ' resurrected')
+            node.failures = 0
+            node.dead_until = None
+            node.probing = False
+            node.probe_owner = None
+            if latency is not None:
+                if node.latency is None:
+                    node.latency = latency
+                else:
+                    node.latency = self.ewma_alpha * latency + (1 - self.ewma_alpha) * node.latency
+
+
+class WireStats(object):
+    ''' Totals of the request and response bytes for a cluster, before (body)
+    and after (wire) any compression. '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.request_bytes = 0
+        self.request_wire_bytes = 0
+        self.response_bytes = 0
+        self.response_wire_bytes = 0
+
+    def record(self, request_bytes, request_wire_bytes, response_bytes, response_wire_bytes):
+        ''' Add the sizes for a request. '''
+        with self._lock:
+            self.requests += 1
+            self.request_bytes += request_bytes
+            self.request_wire_bytes += request_wire_bytes
+            self.response_bytes += response_bytes
+            self.response_wire_bytes += response_wire_bytes
+
+    def as_dict(self):
+        ''' Return the totals as a dictionary. '''
+        with self._lock:
+            return {'requests': self.requests,
+                    'request_bytes': self.request_bytes, 'request_wire_bytes': self.request_wire_bytes,
+                    'response_bytes': self.response_bytes, 'response_wire_bytes': self.response_wire_bytes}
+
+
+class Sniffer(object):
+    ''' Discover the HTTP enabled nodes of the cluster (C{_nodes/http}) and
+    set them in the L{NodePool}. '''
+
+    def __init__(self, pool, interval=None, on_start=False, on_failure=False, node_filter=None, timeout=5):
+        self.pool = pool
+        self.interval = interval
+        self.on_failure = on_failure
+        self.node_filter = node_filter if node_filter is not None else Sniffer.is_not_master_only
+        self.timeout = timeout
+        self.scheme = pool.nodes[0].url.split('://', 1)[0] if '://' in pool.nodes[0].url else 'http'
+        self.last_sniff = None if on_start else time.time()
+        self.thread = None
+        self._lock = threading.Lock()
+        self._due_lock = threading.Lock()
+
+    def sniff(self):
+        ''' Request the cluster nodes from a live node and update the pool. Only
+        one thread sniffs at a time; others carry on using the current nodes. '''
+        if not self._lock.acquire(False):
+            return
+        try:
+            self.last_sniff = time.time()
+            tried = []
+            for _ in range(len(self.pool.nodes)):
+                try:
+                    node = self.pool.get_node(exclude=tried)
+                except NodeUnavailableError:
+                    break
+                tried.append(node)
+                try:
+                    resp = requests.get(node.url.rstrip('/') + '/_nodes/http', timeout=self.timeout)
+                    if resp.status_code == 200:
+                        urls = Sniffer.parse_nodes(codec.response_json(resp), scheme=self.scheme, node_filter=self.node_filter)
+                        logger.debug('Sniffed elastic nodes: ' + str(urls))
+                        self.pool.set_urls(urls)
+                        return
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    logger.warning('Sniffing nodes from ' + node.url + ' failed: ' + str(e))
+            logger.error('Sniffing elastic nodes failed')
+        finally:
+            self._lock.release()
+
+    def is_due(self):
+        ''' Return True if the nodes have not been sniffed yet (on start) or the
+        interval since the last sniff has passed. '''
+        if self.last_sniff is None:
+            return True
+        return self.interval is not None and time.time() - self.last_sniff >= self.interval
+
+    def maybe_sniff(self):
+        ''' Called before a request is sent to sniff if it is due. The first sniff
+        is made by the request so it is sent to the nodes found; later sniffs run
+        in a background thread while the requests use the current nodes. '''
+        with self._due_lock:
+            if not self.is_due():
+                return
+            first = self.last_sniff is None
+            self.last_sniff = time.time()
+        if first:
+            self.sniff()
+        else:
+            self.thread = threading.Thread(target=self.sniff, name='elastic-sniffer', daemon=True)
+            self.thread.start()
+
+    def node_failed(self):
+        ''' Called after a request to a node fails. '''
+        if self.on_failure:
+            self.sniff()
+
+    @classmethod
+    def parse_nodes(cls, resp_json, scheme='http', node_filter=None):
+        ''' Return the node urls from a C{_nodes/http} response. '''
+        urls = []
+        for node_info in resp_json.get('nodes', {}).values():
+            if 'http' not in node_info or 'publish_address' not in node_info['http']:
+                continue
+            if node_filter is not None and not node_filter(node_info):
+                continue
+            address = node_info['http']['publish_address']
+            # e.g. 'inet[/10.0.0.1:9200]' (Elastic 1), 'hostname/10.0.0.1:9200' (Elastic 7)
+            address = re.sub(r'^inet\[(.*)\]$', r'\1', address)
+            if '/' in address:
+                (host, address) = address.split('/', 1)
+                if host != '':
+                    address = host + ':' + address.rsplit(':', 1)[1]
+            urls.append(scheme + '://' + address)
+        return sorted(urls)
+
+    @staticmethod
+    def is_not_master_only(node_info):
+        ''' Default node filter excluding dedicated master nodes. '''
+        if 'roles' in node_info:
+            return node_info['roles'] != ['master']
+        attrs = node_info.get('attributes', {})
+        return not (attrs.get('data', 'true') == 'false' and attrs.get('client', 'false') == 'false' and
+                    attrs.get('master', 'true') == 'true')
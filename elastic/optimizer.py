@@ -0,0 +1,269 @@
+''' Rewrite search queries to equivalents that Elastic runs more efficiently.
+
+The L{QueryOptimizer} walks the C{query} of a search body and:
+
+    - moves clauses that do not need scoring (I{e.g.} C{term}, C{terms} and
+      C{range} without a boost) from C{must} to the C{filter} context, where
+      they are not scored and can be cached by Elastic;
+    - flattens redundant C{bool} nesting (I{e.g.} a C{bool} with just C{must}
+      clauses inside a C{must}, or a C{bool} with a single clause);
+    - removes C{match_all} clauses combined with other clauses (one is kept
+      where it stops the C{should} clauses being required to match);
+    - merges C{term}/C{terms} clauses on the same field into a single C{terms}
+      where they are alternatives (C{should} when not scoring, C{must_not} and
+      C{or} filters) and removes duplicate filters.
+
+Scores may change (I{e.g.} moved clauses no longer contribute to the score)
+but the documents matched do not. Clauses with a C{boost} are not moved. The
+optimizer is used by L{Search} when C{QUERY_OPTIMIZER} is set in the C{ELASTIC}
+settings, or the I{optimize} argument is given, to True or to C{'debug'} to
+also log the query before and after. It requires Elastic 2+ (bool C{filter}).
+'''
+import json
+import logging
+
+from elastic.elastic_settings import ElasticSettings
+from elastic.frozen import thaw
+
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+class QueryOptimizer(object):
+    ''' Rewrite the query of a search body. '''
+    OCCURS = ('must', 'filter', 'should', 'must_not')
+    FILTER_TYPES = ('term', 'terms', 'range', 'exists', 'missing', 'ids', 'type')
+    MAX_PASSES = 5
+
+    @classmethod
+    def optimize(cls, body, debug=False, cluster='default'):
+        ''' Return the search body with the query optimized, or the body itself if
+        it is unchanged (the body is not modified).
+        @type  body: dict
+        @param body: Search request body.
+        @type  debug: bool
+        @keyword debug: Log the query before and after (default: False).
+        '''
+        if not isinstance(body, dict) or 'query' not in body:
+            return body
+        if ElasticSettings.version(cluster=cluster)['major'] < 2:
+            return body
+        original = thaw(body['query'])
+        query = original
+        for _ in range(QueryOptimizer.MAX_PASSES):
+            optimized = cls._query(query, True)
+            if optimized == query:
+                break
+            query = optimized
+        if query == original:
+            return body
+
+        if debug:
+            logger.info("Query optimized from: " + json.dumps(body['query']))
+            logger.info("Query optimized to: " + json.dumps(query))
+        optimized_body = dict(body)
+        optimized_body['query'] = query
+        return optimized_body
+
+    @classmethod
+    def _query(cls, query, scoring):
+        ''' Optimize a query. If I{scoring} is False the query is in a filter context. '''
+        if not isinstance(query, dict) or len(query) != 1:
+            return query
+        (qtype, qbody) = next(iter(query.items()))
+        if not isinstance(qbody, dict) and qtype not in ('or', 'and'):
+            return query
+
+        if qtype == 'bool':
+            return cls._bool(qbody, scoring)
+        if qtype == 'query':
+            # query wrapper used within filters before Elastic 2
+            return cls._query(qbody, scoring)
+        if qtype == 'constant_score' and 'filter' in qbody:
+            return {qtype: dict(qbody, filter=cls._query(qbody['filter'], False))}
+        if qtype in ('nested', 'has_child', 'has_parent', 'function_score') and 'query' in qbody:
+            return {qtype: dict(qbody, query=cls._query(qbody['query'], scoring))}
+        if qtype in ('or', 'and'):
+            filters = qbody.get('filters', qbody) if isinstance(qbody, dict) else qbody
+            if not isinstance(filters, list):
+                return query
+            filters = cls._unique([cls._query(q, False) for q in filters])
+            if qtype == 'or':
+                filters = cls._merge_terms(filters)
+            if len(filters) == 1:
+                return filters[0]
+            return {qtype: dict(qbody, filters=filters) if isinstance(qbody, dict) else filters}
+        return query
+
+    @classmethod
+    def _bool(cls, qbody, scoring):
+        ''' Optimize a bool query. '''
+        clauses = {}
+        for occur in QueryOptimizer.OCCURS:
+            value = qbody.get(occur, [])
+            clauses[occur] = list(value) if isinstance(value, (list, tuple)) else [value]
+        options = {k: v for k, v in qbody.items() if k not in QueryOptimizer.OCCURS}
+
+        clauses['must'] = [cls._query(q, scoring) for q in clauses['must']]
+        clauses['filter'] = [cls._query(q, False) for q in clauses['filter']]
+        clauses['should'] = [cls._query(q, scoring) for q in clauses['should']]
+        clauses['must_not'] = [cls._query(q, False) for q in clauses['must_not']]
+
+        if scoring:
+            # clauses that do not need scoring are moved to the filter context
+            must = []
+            for q in clauses['must']:
+                (clauses['filter'] if cls._is_filter(q) else must).append(q)
+            clauses['must'] = must
+        else:
+            # not scored so must and filter are equivalent
+            clauses['filter'] = clauses['must'] + clauses['filter']
+            clauses['must'] = []
+
+        # with must or filter clauses the should clauses are optional (by default)
+        optional_should = len(clauses['must']) + len(clauses['filter']) > 0 and \
+            'minimum_should_match' not in options
+        cls._flatten(clauses, not scoring and 'minimum_should_match' not in options)
+
+        # match_all is redundant when combined with other clauses (a filter is
+        # added back below if needed to keep the should clauses optional)
+        if len(clauses['should']) + len(clauses['must_not']) > 0 or \
+                any('match_all' not in q for q in clauses['must'] + clauses['filter']):
+            clauses['must'] = [q for q in clauses['must'] if 'match_all' not in q]
+            clauses['filter'] = [q for q in clauses['filter'] if 'match_all' not in q]
+        elif len(clauses['must']) > 0:
+            clauses['must'] = clauses['must'][:1]
+            clauses['filter'] = []
+        else:
+            clauses['filter'] = clauses['filter'][:1]
+
+        clauses['filter'] = cls._unique(clauses['filter'])
+        if optional_should and len(clauses['should']) > 0 and len(clauses['must']) + len(clauses['filter']) == 0:
+            # keep a filter so that a should clause is still not required to match
+            clauses['filter'] = [{'match_all': {}}]
+        clauses['must_not'] = cls._merge_terms(cls._unique(clauses['must_not']))
+        if not scoring and 'minimum_should_match' not in options:
+            clauses['should'] = cls._merge_terms(clauses['should'])
+
+        nclauses = sum(len(v) for v in clauses.values())
+        if len(options) == 0 and nclauses == 1 and len(clauses['must_not']) == 0:
+            # a bool with a single clause is just that clause
+            if len(clauses['must']) == 1 or not scoring:
+                return (clauses['must'] + clauses['filter'] + clauses['should'])[0]
+
+        bool_query = {occur: clauses[occur] for occur in QueryOptimizer.OCCURS if len(clauses[occur]) > 0}
+        bool_query.update(options)
+        return {'bool': bool_query}
+
+    @classmethod
+    def _flatten(cls, clauses, flatten_should):
+        ''' Move the clauses of nested bool queries into the parent clauses where
+        the result is equivalent. '''
+        for occur in ('must', 'filter'):
+            flattened = []
+            for q in clauses[occur]:
+                child = cls._child_bool(q, ('must', 'filter', 'must_not'))
+                if child is None:
+                    flattened.append(q)
+                    continue
+                if occur == 'must':
+                    flattened.extend(child.get('must', []))
+                    clauses['filter'].extend(child.get('filter', []))
+                else:
+                    flattened.extend(child.get('must', []) + child.get('filter', []))
+                clauses['must_not'].extend(child.get('must_not', []))
+            clauses[occur] = flattened
+
+        # not (a or b) is (not a) and (not b)
+        must_not = []
+        for q in clauses['must_not']:
+            child = cls._child_bool(q, ('should',))
+            must_not.extend(child['should'] if child is not None else [q])
+        clauses['must_not'] = must_not
+
+        if flatten_should:
+            should = []
+            for q in clauses['should']:
+                child = cls._child_bool(q, ('should',))
+                should.extend(child['should'] if child is not None else [q])
+            clauses['should'] = should
+
+    @classmethod
+    def _child_bool(cls, query, occurs):
+        ''' Return the clauses of a bool query with only the given occurrence types
+        (as lists) and no options, otherwise None. '''
+        if not isinstance(query, dict) or list(query.keys()) != ['bool'] or not isinstance(query['bool'], dict):
+            return None
+        qbody = query['bool']
+        if len(qbody) == 0 or any(k not in occurs for k in qbody):
+            return None
+        return {k: list(v) if isinstance(v, (list, tuple)) else [v] for k, v in qbody.items()}
+
+    @classmethod
+    def _is_filter(cls, query):
+        ''' Return True if the query does not need to be scored. '''
+        if not isinstance(query, dict) or len(query) != 1:
+            return False
+        (qtype, qbody) = next(iter(query.items()))
+        if qtype not in QueryOptimizer.FILTER_TYPES or not isinstance(qbody, dict):
+            return False
+        if 'boost' in qbody:
+            return False
+        return not any(isinstance(v, dict) and 'boost' in v for v in qbody.values())
+
+    @classmethod
+    def _unique(cls, queries):
+        ''' Remove duplicate queries, keeping the order. '''
+        seen = set()
+        unique = []
+        for q in queries:
+            key = json.dumps(q, sort_keys=True)
+            if key not in seen:
+                seen.add(key)
+                unique.append(q)
+        return unique
+
+    @classmethod
+    def _merge_terms(cls, queries):
+        ''' Merge alternative term/terms queries on the same field into a terms query. '''
+        values = {}
+        for q in queries:
+            field = cls._terms_field(q)
+            if field is not None:
+                values.setdefault(field, [])
+                (qtype, qbody) = next(iter(q.items()))
+                values[field].extend(qbody[field] if qtype == 'terms' else [qbody[field]])
+
+        merged = []
+        for q in queries:
+            field = cls._terms_field(q)
+            if field is None or len(values[field]) == 0:
+                if field is None:
+                    merged.append(q)
+                continue
+            if len([v for v in queries if cls._terms_field(v) == field]) == 1:
+                merged.append(q)
+            else:
+                unique = []
+                for v in values[field]:
+                    if v not in unique:
+                        unique.append(v)
+                merged.append({'terms': {field: unique}})
+            values[field] = []
+        return merged
+
+    @classmethod
+    def _terms_field(cls, query):
+        ''' Return the field of a simple term or terms query or None. '''
+        if not isinstance(query, dict) or len(query) != 1:
+            return None
+        (qtype, qbody) = next(iter(query.items()))
+        if qtype not in ('term', 'terms') or not isinstance(qbody, dict) or len(qbody) != 1:
+            return None
+        (field, value) = next(iter(qbody.items()))
+        if qtype == 'term' and isinstance(value, (dict, list, tuple)):
+            return None
+        if qtype == 'terms' and not isinstance(value, (list, tuple)):
+            return None
+        return field
@@ -1,6 +1,8 @@
 ''' Define L{Query} and L{Filter} to be used in an L{ElasticQuery} '''
 from elastic.exceptions import QueryError, FilterError
 from elastic.elastic_settings import ElasticSettings
+from elastic.frozen import freeze
+import copy
 import logging
 
 # Get an instance of a logger
@@ -37,6 +39,15 @@ class Query:
         self.query = query_wrap
         return self
 
+    def freeze(self):
+        ''' Return an immutable copy of the query that is hashable and caches
+        its JSON encoding (see L{elastic.frozen}).
+        @return: L{Query}
+        '''
+        frozen = copy.copy(self)
+        frozen.query = freeze(self.query)
+        return frozen
+
     @classmethod
     def match_all(cls):
         ''' Factory method for Match All Query
@@ -224,7 +235,7 @@ class FunctionScoreQuery(Query):
         if isinstance(query_or_filter, Query):
             self.query = {"function_score": {"query": query_or_filter.query}}
         elif isinstance(query_or_filter, Filter):
-            self.query = {"function_score": query_or_filter.filter}
+            self.query = {"function_score": dict(query_or_filter.filter)}
         else:
             raise QueryError("not a Query or Filter")
 
@@ -261,7 +272,8 @@ class FilteredQuery(Query):
             self.query["filtered"].update(query_filter.filter)
         else:
             if 'match_all' in query.query:
-                query.query_wrap()
+                # wrap a copy so the callers query is not changed
+                query = Query(query.query).query_wrap()
             self.query = BoolQuery(must_arr=query, b_filter=query_filter).query
 
 
@@ -359,6 +371,14 @@ class Filter:
             raise FilterError("not a Query")
         self.filter = {"filter": query.query}
 
+    def freeze(self):
+        ''' Return an immutable copy of the filter (see L{elastic.frozen}).
+        @return: L{Filter}
+        '''
+        frozen = copy.copy(self)
+        frozen.filter = freeze(self.filter)
+        return frozen
+
     def extend(self, filter_name, arr):
         ''' Used to extend the named filter (I{e.g.} L{AndFilter}, L{OrFilter}).
 
@@ -372,10 +392,13 @@ class Filter:
             arr = [arr]
         Query._is_array_query(arr)
         filter_arr = Query._query_to_str_array(arr)
+        # copy rather than change the query the filter was built from
+        self.filter["filter"] = dict(self.filter["filter"])
         if filter_name in self.filter["filter"]:
-            if not isinstance(self.filter["filter"][filter_name], list):
-                self.filter["filter"][filter_name] = [self.filter["filter"][filter_name]]
-            self.filter["filter"][filter_name].extend(filter_arr)
+            current = self.filter["filter"][filter_name]
+            if not isinstance(current, (list, tuple)):
+                current = [current]
+            self.filter["filter"][filter_name] = list(current) + filter_arr
         else:
             self.filter["filter"][filter_name] = filter_arr
         return self
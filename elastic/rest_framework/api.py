@@ -1,7 +1,7 @@
 ''' Django REST framework Elastic resources. '''
 from rest_framework import serializers, viewsets
 from elastic.rest_framework.resources import ListElasticMixin, ElasticLimitOffsetPagination,\
-    RetrieveElasticMixin
+    RetrieveElasticMixin, ElasticCursorPagination
 from elastic.elastic_settings import ElasticSettings
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 # from rest_framework.authentication import TokenAuthentication
@@ -10,6 +10,10 @@ from rest_framework.response import Response
 import logging
 logger = logging.getLogger(__name__)
 
+# cursor pagination of large resources uses search_after (available from Elastic 5)
+DeepPagination = ElasticCursorPagination if ElasticSettings.version()['major'] >= 5 \
+    else ElasticLimitOffsetPagination
+
 
 class PublicationSerializer(serializers.Serializer):
     ''' Publication resource. '''
@@ -32,7 +36,8 @@ class PublicationViewSet(RetrieveElasticMixin, ListElasticMixin, viewsets.Generi
     permission_classes = (IsAuthenticated,)
 
     serializer_class = PublicationSerializer
-    pagination_class = ElasticLimitOffsetPagination
+    pagination_class = DeepPagination
+    es_ordering = 'PMID'
     idx = ElasticSettings.idx('PUBLICATION')
     filter_fields = ('PMID', 'title', 'authors__name', 'tags__disease')
 
@@ -84,7 +89,8 @@ class MarkerSerializer(serializers.Serializer):
 
 class MarkerViewSet(RetrieveElasticMixin, ListElasticMixin, viewsets.GenericViewSet):
     serializer_class = MarkerSerializer
-    pagination_class = ElasticLimitOffsetPagination
+    pagination_class = DeepPagination
+    es_ordering = 'seqid,start'
     idx = resource_name = ElasticSettings.idx('MARKER', 'MARKER')
     filter_fields = ('seqid', 'id', 'start')
     # model = TheModel
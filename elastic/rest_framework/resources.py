@@ -1,15 +1,41 @@
 ''' Pagination, filter and elastic list and retrieve views. '''
-from elastic.search import Search, ElasticQuery
-from elastic.query import Query, AndFilter
+from collections import OrderedDict
+
+from elastic.search import Search, ElasticQuery, SearchAfter, Sort
+from elastic.query import Query, AndFilter, QueryError
+from elastic.result import Result
 from rest_framework.filters import DjangoFilterBackend, OrderingFilter
 from rest_framework.response import Response
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.pagination import LimitOffsetPagination, BasePagination
+from rest_framework.exceptions import NotFound
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param, remove_query_param
 from django.http.response import Http404
 from elastic.rest_framework.elastic_obj import ElasticObject
 
 
+def get_serializer_sources(view):
+    ''' Return the document fields used by the view's serializer so that just these
+    are requested from elastic. A view can set I{es_sources} to override this. '''
+    if hasattr(view, 'es_sources'):
+        return view.es_sources
+    serializer_class = getattr(view, 'serializer_class', None)
+    if serializer_class is None:
+        return None
+    sources = []
+    for name, field in serializer_class().fields.items():
+        source = field.source if field.source is not None else name
+        if source == '*':
+            return None
+        sources.append(source)
+    return sources
+
+
 class ElasticLimitOffsetPagination(LimitOffsetPagination):
-    ''' Extend L{LimitOffsetPagination} for pagination of elastic resources. '''
+    ''' Extend L{LimitOffsetPagination} for pagination of elastic resources.
+    Set I{count_threshold} to only count the hits accurately up to that number
+    (Elastic 7+), larger counts are then reported as a lower bound. '''
+    count_threshold = None
 
     def paginate_queryset(self, queryset, request, view=None):
         if not hasattr(view, 'es_count'):
@@ -21,6 +47,7 @@ class ElasticLimitOffsetPagination(LimitOffsetPagination):
 
         self.offset = self.get_offset(request)
         self.count = view.es_count
+        self.count_relation = getattr(view, 'es_count_relation', 'eq')
         self.request = request
         if self.count > self.limit and self.template is not None:
             self.display_page_controls = True
@@ -33,14 +60,140 @@ class ElasticLimitOffsetPagination(LimitOffsetPagination):
             return 10
         return limit
 
+    def get_search_kwargs(self, request, view):
+        ''' Return the L{Search} size and offset for the requested page. '''
+        kwargs = {'size': self.get_limit(request), 'search_from': self.get_offset(request)}
+        if self.count_threshold is not None:
+            kwargs['track_total_hits'] = self.count_threshold
+        return kwargs
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if getattr(self, 'count_relation', 'eq') != 'eq':
+            response.data['count_relation'] = self.count_relation
+        return response
+
+
+class ElasticCursorPagination(BasePagination):
+    ''' Cursor based pagination of elastic resources using search_after (Elastic 5+).
+    The sort values of the first/last hit of a page are encoded in an opaque
+    I{cursor} query parameter for the previous/next links, so fetching a page
+    costs the same regardless of its depth. The results are sorted by the view
+    I{es_ordering} (I{e.g.} 'seqid,start') plus a unique tiebreaker. The hits
+    count can be capped (Elastic 7+) with I{count_threshold} or skipped by setting
+    it to False. '''
+    cursor_query_param = 'cursor'
+    count_threshold = None
+    page_size_query_param = 'page_size'
+    page_size = api_settings.PAGE_SIZE or 10
+    max_page_size = 1000
+    ordering = None
+    template = None
+
+    NEXT = 'n'
+    PREVIOUS = 'p'
+
+    def get_search_kwargs(self, request, view):
+        ''' Return the L{Search} size, sort and search_after for the requested page.
+        One more hit than the page size is requested to tell if there is another page. '''
+        self.page_size = self.get_page_size(request)
+        (self.direction, search_after) = self.decode_cursor(request)
+        qsort = self.get_sort(view)
+        if self.direction == self.PREVIOUS:
+            qsort = qsort.reverse()
+        kwargs = {'size': self.page_size + 1, 'qsort': qsort}
+        if self.count_threshold is not None:
+            kwargs['track_total_hits'] = self.count_threshold
+        if search_after is not None:
+            kwargs['search_after'] = search_after
+        return kwargs
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.count = getattr(view, 'es_count', None)
+        self.count_relation = getattr(view, 'es_count_relation', 'eq')
+        sort_values = getattr(view, 'es_sort_values', [])
+        results = list(queryset)
+
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        sort_values = sort_values[:self.page_size]
+        if self.direction == self.PREVIOUS:
+            results.reverse()
+            sort_values.reverse()
+            (self.has_previous, self.has_next) = (has_more, True)
+        else:
+            (self.has_previous, self.has_next) = (self.direction is not None, has_more)
+
+        self.first_sort_values = sort_values[0] if len(sort_values) > 0 else None
+        self.last_sort_values = sort_values[-1] if len(sort_values) > 0 else None
+        return results
+
+    def get_paginated_response(self, data):
+        response = [('next', self.get_next_link()),
+                    ('previous', self.get_previous_link()),
+                    ('results', data)]
+        if self.count is not None:
+            response.insert(0, ('count', self.count))
+            if self.count_relation != 'eq':
+                response.insert(1, ('count_relation', self.count_relation))
+        return Response(OrderedDict(response))
+
+    def get_next_link(self):
+        if not self.has_next or self.last_sort_values is None:
+            return None
+        return self._link(self.NEXT, self.last_sort_values)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.first_sort_values is None:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self._link(self.PREVIOUS, self.first_sort_values)
+
+    def get_page_size(self, request):
+        ''' Page size from the I{page_size} query parameter or the default. '''
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def get_sort(self, view):
+        ''' Sort on the view I{es_ordering} with a unique tiebreaker. '''
+        ordering = getattr(view, 'es_ordering', self.ordering)
+        tiebreaker = SearchAfter.default_tiebreaker()
+        if ordering is None:
+            return Sort(tiebreaker)
+        return Sort(ordering).with_tiebreaker(tiebreaker)
+
+    def decode_cursor(self, request):
+        ''' Return the direction and sort values encoded in the cursor parameter. '''
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor is None:
+            return (None, None)
+        try:
+            (direction, sort_values) = SearchAfter.decode_cursor(cursor)
+        except (QueryError, ValueError):
+            raise NotFound('Invalid cursor')
+        if direction not in (self.NEXT, self.PREVIOUS) or not isinstance(sort_values, list):
+            raise NotFound('Invalid cursor')
+        return (direction, sort_values)
+
+    def _link(self, direction, sort_values):
+        cursor = SearchAfter.encode_cursor([direction, sort_values])
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
 
 class ElasticFilterBackend(OrderingFilter, DjangoFilterBackend):
     ''' Extend L{DjangoFilterBackend} for filtering elastic resources. '''
+    filter_path = 'hits.total,hits.hits._id,hits.hits._source,hits.hits.sort'
 
     def filter_queryset(self, request, queryset, view):
         ''' Override this method to request just the documents required from elastic. '''
-        q_size = view.paginator.get_limit(request)
-        q_from = view.paginator.get_offset(request)
+        search_kwargs = view.paginator.get_search_kwargs(request, view)
 
         filterable = getattr(view, 'filter_fields', [])
         filters = dict([(k, v) for k, v in request.GET.items() if k in filterable])
@@ -49,14 +202,19 @@ class ElasticFilterBackend(OrderingFilter, DjangoFilterBackend):
             q = ElasticQuery.filtered(Query.match_all(), search_filters)
         else:
             q = ElasticQuery(Query.match_all())
-        s = Search(search_query=q, idx=getattr(view, 'idx'), size=q_size, search_from=q_from)
+        s = Search(search_query=q, idx=getattr(view, 'idx'), sources=get_serializer_sources(view),
+                   filter_path=self.filter_path, **search_kwargs)
         json_results = s.get_json_response()
+        hits = json_results.get('hits', {})
         results = []
-        for result in json_results['hits']['hits']:
+        sort_values = []
+        for result in hits.get('hits', []):
             new_obj = ElasticObject(initial=result['_source'])
             new_obj.uuid = result['_id']
             results.append(new_obj)
-        view.es_count = json_results['hits']['total']
+            sort_values.append(result.get('sort'))
+        (view.es_count, view.es_count_relation) = Result.parse_total(json_results)
+        view.es_sort_values = sort_values
         return results
 
     def _build_filters(self, filters=None):
@@ -112,7 +270,8 @@ class RetrieveElasticMixin(object):
 
     def get_object(self):
         q = ElasticQuery(Query.ids(self.kwargs[self.lookup_field]))
-        s = Search(search_query=q, idx=getattr(self, 'idx'))
+        s = Search(search_query=q, idx=getattr(self, 'idx'), size=1,
+                   sources=get_serializer_sources(self), filter_path='hits.hits._id,hits.hits._source')
         try:
             result = s.get_json_response()['hits']['hits'][0]
             obj = ElasticObject(initial=result['_source'])
@@ -121,5 +280,5 @@ class RetrieveElasticMixin(object):
             # May raise a permission denied
             self.check_object_permissions(self.request, obj)
             return obj
-        except (TypeError, ValueError, IndexError):
+        except (TypeError, ValueError, IndexError, KeyError):
             raise Http404
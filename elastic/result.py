@@ -1,12 +1,18 @@
-''' Elastic L{Result}, hit L{Document} and L{Aggregation} objects. '''
+''' Elastic L{Result}, hit L{Document}, L{Aggregation} and L{Columns} objects. '''
 import re
 
+try:
+    import numpy
+except ImportError:  # numpy is only required for columnar results
+    numpy = None
+
 
 class Result(object):
     ''' Result container for Document and Aggregation stores. '''
 
     def __init__(self, took=None, hits_total=None, size=None,
-                 docs=None, aggs=None, idx=None, query=None):
+                 docs=None, aggs=None, idx=None, query=None, cursor=None,
+                 hits_total_relation='eq', timed_out=False, shards=None):
         ''' Store Documents and Aggregations and search meta data.
         @type  took: integer
         @keyword took: Time in milliseconds for search to run.
@@ -22,6 +28,15 @@ class Result(object):
         @keyword idx: Indices searched.
         @type  query: dict
         @keyword query: search query
+        @type  cursor: string
+        @keyword cursor: cursor token for the next page (see L{SearchAfter}).
+        @type  hits_total_relation: string
+        @keyword hits_total_relation: 'eq' if hits_total is exact or 'gte' if it is
+        a lower bound (I{e.g.} counting was capped or terminated early).
+        @type  timed_out: bool
+        @keyword timed_out: True if the search timed out (see the L{Search} deadline).
+        @type  shards: dict
+        @keyword shards: Shard counts (total, successful, failed) of the search.
         '''
         self.took = took
         self.hits_total = hits_total
@@ -30,6 +45,37 @@ class Result(object):
         self.aggs = aggs
         self.idx = idx
         self.query = query
+        self.cursor = cursor
+        self.hits_total_relation = hits_total_relation
+        self.timed_out = timed_out
+        self.shards = shards
+
+    def is_partial(self):
+        ''' Return True if the results are partial as the search timed out or shards failed. '''
+        if self.timed_out:
+            return True
+        return self.shards is not None and self.shards.get('failed', 0) > 0
+
+    def hits_total_str(self):
+        ''' Total number of hits for display, I{e.g.} '≥10000' for a lower bound. '''
+        if self.hits_total is None:
+            return ''
+        if self.hits_total_relation == 'gte':
+            return '≥' + str(self.hits_total)
+        return str(self.hits_total)
+
+    @classmethod
+    def parse_total(cls, json_response):
+        ''' Return the hits total and its relation ('eq' or 'gte') from a search
+        response. Handles the total as a number or as an object (Elastic 7+). '''
+        total = json_response.get('hits', {}).get('total')
+        relation = 'eq'
+        if isinstance(total, dict):
+            relation = total.get('relation', 'eq')
+            total = total.get('value')
+        if json_response.get('terminated_early', False):
+            relation = 'gte'
+        return (total, relation)
 
 
 class Document(object):
@@ -80,6 +126,12 @@ class Document(object):
             return self.__dict__['_meta']['_parent']
         return None
 
+    def sort_values(self):
+        ''' Sort values of the hit (when the search is sorted). '''
+        if 'sort' in self.__dict__['_meta']:
+            return self.__dict__['_meta']['sort']
+        return None
+
     def highlight(self):
         ''' Highlight match. '''
         if 'highlight' in self.__dict__['_meta']:
@@ -154,3 +206,118 @@ class Aggregation(object):
                     aggs = {}
                 aggs[agg_name] = Aggregation(aggs_list[agg_name])
         return aggs
+
+
+class Columns(object):
+    ''' Column store for the hits of a search. Each requested field is held
+    as an array (numeric fields as NumPy numeric arrays, other fields as
+    object arrays) so that the hits can be processed in a vectorised way. '''
+
+    def __init__(self, fields, took=None, hits_total=None, idx=None, query=None):
+        ''' Set up an empty column store.
+        @type  fields: list
+        @param fields: Field names (dotted for nested objects, I{e.g.} featureloc.start).
+        @type  took: integer
+        @keyword took: Time in milliseconds for search to run.
+        @type  hits_total: integer
+        @keyword hits_total: Total number of docs matching search criteria.
+        @type  idx: string
+        @keyword idx: Indices searched.
+        @type  query: dict
+        @keyword query: search query
+        '''
+        if numpy is None:
+            raise ImportError("numpy is required for columnar search results")
+        self.fields = list(fields)
+        self.took = took
+        self.hits_total = hits_total
+        self.idx = idx
+        self.query = query
+        self._chunks = {f: [] for f in self.fields + ['_id']}
+        self._columns = None
+
+    def add_hits(self, hits):
+        ''' Convert a page of hits into arrays and append them to the columns. '''
+        if len(hits) == 0:
+            return
+        paths = [(f, f.split('.')) for f in self.fields]
+        values = {f: [] for f in self.fields}
+        for hit in hits:
+            src = hit.get('_source', {})
+            for (f, path) in paths:
+                values[f].append(Columns._get_value(src, path))
+        for f in self.fields:
+            self._chunks[f].append(Columns._to_array(values[f]))
+        self._chunks['_id'].append(Columns._to_object_array([hit['_id'] for hit in hits]))
+        self._columns = None
+
+    def add_response(self, json_response):
+        ''' Append the hits in a search (or scroll page) JSON response. '''
+        self.add_hits(json_response['hits']['hits'])
+
+    def __getitem__(self, field):
+        ''' Return the array for a field. '''
+        return self.columns()[field]
+
+    def __len__(self):
+        return len(self.columns()['_id'])
+
+    def columns(self):
+        ''' Return a dictionary of field name to array, concatenating
+        the pages of hits added. '''
+        if self._columns is None:
+            self._columns = {}
+            for f, chunks in self._chunks.items():
+                if len(chunks) == 0:
+                    self._columns[f] = numpy.array([], dtype=object)
+                elif len(chunks) == 1:
+                    self._columns[f] = chunks[0]
+                else:
+                    self._columns[f] = numpy.concatenate(chunks)
+                self._chunks[f] = [self._columns[f]]
+        return self._columns
+
+    def doc_ids(self):
+        ''' Document ids, in the same order as the column values. '''
+        return self['_id']
+
+    def categorical(self, field):
+        ''' Return a field as a categorical, i.e. a tuple of the sorted
+        unique values and an integer code array indexing into them. '''
+        arr = self[field]
+        if arr.dtype == object:
+            arr = Columns._to_object_array(['' if v is None else str(v) for v in arr])
+        return numpy.unique(arr, return_inverse=True)
+
+    @classmethod
+    def _get_value(cls, src, path):
+        ''' Get a (possibly nested) field value from a document source. '''
+        for p in path:
+            if not isinstance(src, dict):
+                return None
+            src = src.get(p)
+        return src
+
+    @classmethod
+    def _to_array(cls, values):
+        ''' Convert a list of values to an integer or float array if all the
+        values are numeric (missing values become NaN) otherwise an object array. '''
+        is_int = True
+        for v in values:
+            if v is None:
+                is_int = False
+            elif isinstance(v, bool) or not isinstance(v, (int, float)):
+                return Columns._to_object_array(values)
+            elif isinstance(v, float):
+                is_int = False
+        if is_int:
+            return numpy.array(values, dtype=numpy.int64)
+        return numpy.array([numpy.nan if v is None else v for v in values], dtype=numpy.float64)
+
+    @classmethod
+    def _to_object_array(cls, values):
+        ''' One dimensional object array (list values are kept as elements). '''
+        arr = numpy.empty(len(values), dtype=object)
+        for i, v in enumerate(values):
+            arr[i] = v
+        return arr
@@ -14,16 +14,26 @@ the factory methods in L{ElasticQuery}. If this does not provide the
 exact components needed for the query then look into building it
 from the L{Query} and L{Filter} parent and child classes.
 '''
+import base64
 from builtins import classmethod
-import json
+import copy
+import functools
+import gzip
 import logging
+import time
 
 import requests
+import urllib3
 
+from elastic import codec
 from elastic.elastic_settings import ElasticSettings, ElasticUrl
+from elastic.frozen import freeze
+from elastic.mapping import MappingCache, QueryValidator
+from elastic.optimizer import QueryOptimizer
+from elastic.stream import HitStream
 from elastic.query import Query, QueryError, BoolQuery, FilteredQuery, \
     Filter, HasParentQuery, HasChildQuery
-from elastic.result import Result, Aggregation
+from elastic.result import Result, Aggregation, Columns
 
 
 # Get an instance of a logger
@@ -32,10 +42,16 @@ logger = logging.getLogger(__name__)
 
 class Search:
     ''' Used to run Elastic queries and return search hits, hit count or the mapping. '''
+    RETRY_STATUS = (502, 503, 504)
+    IDEMPOTENT_ENDPOINTS = ('_search', '_count', '_suggest', '_msearch', '_mapping', '_refresh', '_nodes')
+    COALESCED_ENDPOINTS = ('_search', '_count', '_suggest', '_msearch', '_mapping')
+    DEADLINE_GRACE = 1    # seconds to wait past a deadline for the partial results
 
     def __init__(self, search_query=None, aggs=None, search_from=0, size=20,
                  search_type=None, idx=ElasticSettings.idx('DEFAULT'), idx_type='',
-                 qsort=None, elastic_url=None):
+                 qsort=None, elastic_url=None, sources=None, filter_path=None,
+                 search_after=None, track_total_hits=None, terminate_after=None, deadline=None,
+                 optimize=None, validate=None):
         ''' Set up parameters to use in the search. L{ElasticQuery} is used to
         define a search query.
         @type  search_query: L{ElasticQuery}
@@ -56,14 +72,40 @@ class Search:
         @keyword qsort: defines sorting for the query.
         @type  url: string
         @keyword url: Elastic URL (default: default cluster URL).
+        @type  sources: list
+        @keyword sources: Only return these fields of the document _source (default: None).
+        @type  filter_path: string or list
+        @keyword filter_path: Response filtering, I{e.g.} 'hits.total,hits.hits._source' (default: None).
+        @type  search_after: list
+        @keyword search_after: Sort values of the last hit of the previous page, used with
+        qsort for deep pagination instead of search_from (default: None).
+        @type  track_total_hits: bool or integer
+        @keyword track_total_hits: False to skip counting the hits or a number to
+        count accurately up to (Elastic 7+, ignored for older versions) (default: None).
+        @type  terminate_after: integer
+        @keyword terminate_after: Maximum number of documents to collect per shard,
+        the hits total is then a lower bound (default: None).
+        @type  deadline: float
+        @keyword deadline: Seconds allowed for the search, sent as the Elastic search
+        timeout so that the hits collected by then are returned (see L{Result.is_partial})
+        (default: None).
+        @type  optimize: bool or string
+        @keyword optimize: Rewrite the query with the L{QueryOptimizer}, 'debug' to also
+        log the query before and after (default: the C{QUERY_OPTIMIZER} setting).
+        @type  validate: bool
+        @keyword validate: Check the query against the cached index mapping with the
+        L{QueryValidator} (default: the C{VALIDATE_QUERIES} setting).
         '''
         if search_query is not None:
             if not isinstance(search_query, ElasticQuery):
                 raise QueryError("not an ElasticQuery")
             self.query = search_query.query
 
+        # the search query and aggregations are not changed (nor copied) but
+        # composed into a new request body
         if aggs is not None:
             if hasattr(self, 'query'):
+                self.query = dict(self.query)
                 self.query.update(aggs.aggs)
             else:
                 self.query = aggs.aggs
@@ -72,13 +114,49 @@ class Search:
             if not isinstance(qsort, Sort):
                 raise QueryError("not a Sort")
             if hasattr(self, 'query'):
+                self.query = dict(self.query)
                 self.query.update(qsort.qsort)
             else:
                 logger.error("no query to sort")
 
+        if sources is not None:
+            # copy so the source filtering is not added to the callers query
+            self.query = dict(self.query) if hasattr(self, 'query') else {}
+            self.query['_source'] = sources
+
+        if search_after is not None:
+            if search_from != 0:
+                raise QueryError("search_from must be 0 when using search_after")
+            if not hasattr(self, 'query') or 'sort' not in self.query:
+                raise QueryError("search_after requires a sort")
+            self.query = dict(self.query)
+            self.query['search_after'] = search_after
+
+        if track_total_hits is not None:
+            if ElasticSettings.version()['major'] >= 7:
+                self.query = dict(self.query) if hasattr(self, 'query') else {}
+                self.query['track_total_hits'] = track_total_hits
+            else:
+                logger.debug("track_total_hits ignored, requires Elastic 7+")
+
+        if deadline is not None:
+            self.query = dict(self.query) if hasattr(self, 'query') else {}
+            self.query['timeout'] = str(int(deadline * 1000)) + 'ms'
+
+        if validate is None:
+            validate = ElasticSettings.getattr('VALIDATE_QUERIES', default=False)
+        if validate and hasattr(self, 'query'):
+            QueryValidator.validate(self.query, idx, idx_type=idx_type)
+
+        if optimize is None:
+            optimize = ElasticSettings.getattr('QUERY_OPTIMIZER', default=False)
+        if optimize and hasattr(self, 'query'):
+            self.query = QueryOptimizer.optimize(self.query, debug=(optimize == 'debug'))
+
         if elastic_url is None:
             elastic_url = ElasticSettings.url()
 
+        self.deadline = deadline
         self.size = size
         self.search_from = search_from
         self.search_type = search_type
@@ -90,34 +168,230 @@ class Search:
                         '/_search?size=' + str(self.size) + '&from='+str(self.search_from))
         else:
             self.url = (self.idx + '/' + self.idx_type + '/_search?search_type='+search_type)
+        if terminate_after is not None:
+            self.url += '&terminate_after=' + str(terminate_after)
+        if filter_path is not None:
+            self.url += '&' + Search.filter_path_param(filter_path)
 
     @classmethod
-    def elastic_request(cls, elastic_url, url, data=None, is_post=True):
-        ''' Make GET/POST request and return response from elastic server. '''
-        try:
-            if is_post:
-                response = requests.post(elastic_url + '/' + url, data=data)
-            else:
-                response = requests.get(elastic_url + '/' + url)
-        except requests.exceptions.ConnectionError:
-            logger.error('ConnectionError ' + elastic_url)
-            ElasticUrl.rotate_url()
-            elastic_url = ElasticUrl.get_url()
-            if is_post:
-                response = requests.post(elastic_url + '/' + url, data=data)
+    def filter_path_param(cls, filter_path):
+        ''' Return the URL parameter to filter the response to the given paths. '''
+        if isinstance(filter_path, (list, tuple)):
+            filter_path = ','.join(filter_path)
+        return 'filter_path=' + filter_path
+
+    @classmethod
+    def elastic_request(cls, elastic_url, url, data=None, is_post=True, cluster='default',
+                        method=None, call_type='search', timeout=None, stream=False):
+        ''' Make GET/POST (or the given method) request and return response from
+        elastic server. If the node fails to respond (connection error) the request
+        is retried on another node of the cluster. Idempotent requests are also
+        retried after a timeout or a 502/503/504 response (see L{NodePool}).
+        Identical concurrent reads share the one request and each caller gets a
+        copy of the response (see L{elastic.coalesce}).
+        @type  call_type: string
+        @keyword call_type: 'search', 'bulk' or 'admin' used to set the timeouts
+        (see L{ElasticSettings.timeout}).
+        @type  timeout: tuple
+        @keyword timeout: (connect, read) timeouts in seconds to use instead of the
+        call type timeouts.
+        @type  stream: bool
+        @keyword stream: Return once the response headers are received, the body is
+        then read from the response (see L{Search.hit_stream}).
+        '''
+        if method is None:
+            method = 'POST' if is_post else 'GET'
+        if not stream and Search.is_coalesced(url, method, data, cluster):
+            pool = ElasticUrl.get_pool(cluster)
+            # nodes of the cluster are interchangeable so any node can serve the request
+            target = cluster if pool.get(elastic_url) is not None else elastic_url
+            key = (method, target, url, data.encode('utf-8') if isinstance(data, str) else bytes(data or b''),
+                   call_type, timeout)
+            return pool.coalescer.do(key, functools.partial(Search._elastic_request, elastic_url, url, data,
+                                                            cluster, method, call_type, timeout),
+                                     share=copy.copy)
+        return Search._elastic_request(elastic_url, url, data, cluster, method, call_type, timeout, stream)
+
+    @classmethod
+    def _elastic_request(cls, elastic_url, url, data, cluster, method, call_type, timeout, stream=False):
+        ''' Make the request, retrying on other nodes (see L{elastic_request}). '''
+        if timeout is None:
+            timeout = ElasticSettings.timeout(call_type, cluster=cluster)
+        pool = ElasticUrl.get_pool(cluster)
+        idempotent = Search.is_idempotent(url, method)
+        max_retries = ElasticSettings.getattr('MAX_RETRIES', cluster=cluster, default=3)
+        (body, headers, body_size) = Search.encode_body(data, cluster=cluster)
+        node = pool.get(elastic_url)
+        if pool.sniffer is not None:
+            pool.sniffer.maybe_sniff()
+            if node is not None and pool.get(elastic_url) is None:
+                # the node has been replaced by the nodes sniffed
+                elastic_url = pool.get_node().url
+                node = pool.get(elastic_url)
+        if node is not None and not pool.claim(node):
+            # circuit breaker open so fail fast and use another node
+            node = pool.get_node(exclude=[node], claim=True)
+            elastic_url = node.url
+        tried = []
+        while True:
+            start = time.perf_counter()
+            response = None
+            try:
+                response = requests.request(method, elastic_url + '/' + url, data=body, headers=headers,
+                                            timeout=timeout, stream=stream)
+                if response.status_code not in Search.RETRY_STATUS:
+                    if node is not None:
+                        pool.mark_live(node, time.perf_counter() - start)
+                    if stream:
+                        # recorded once the body has been read
+                        response._record_wire_bytes = functools.partial(Search.record_wire_bytes, pool, url,
+                                                                        body, body_size)
+                    else:
+                        Search.record_wire_bytes(pool, url, body, body_size, len(response.content),
+                                                 Search.response_wire_bytes(response))
+                    return response
+                error = None
+                retry = idempotent
+            except requests.exceptions.ConnectionError as e:
+                error = e
+                retry = idempotent or Search.is_unsent(e)
+            except requests.exceptions.Timeout as e:
+                error = e
+                retry = idempotent
+            except Exception:
+                if node is not None:
+                    pool.release_probe(node)
+                raise
+
+            logger.error('Request failed ' + elastic_url + ' (' +
+                         (str(error) if error is not None else str(response.status_code)) + ')')
+            if node is None:
+                retry = False   # not a node of the cluster pool
             else:
-                response = requests.get(elastic_url + '/' + url)
-        return response
+                pool.mark_dead(node)
+                tried.append(node)
+            if pool.sniffer is not None:
+                pool.sniffer.node_failed()
+            if not retry or len(tried) > max_retries or len(tried) >= len(pool.nodes):
+                if error is not None:
+                    raise error
+                return response
+            node = pool.get_node(exclude=tried, claim=True)
+            elastic_url = node.url
+
+    @classmethod
+    def is_unsent(cls, error):
+        ''' Return True if a connection error was raised before the request was sent
+        (connect timeout, refused connection or unresolved host) so it can be retried
+        on another node even if it is not idempotent. '''
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        reason = error.args[0] if len(error.args) > 0 else None
+        reason = getattr(reason, 'reason', reason)    # urllib3 MaxRetryError
+        return isinstance(reason, (urllib3.exceptions.NewConnectionError, ConnectionRefusedError))
+
+    @classmethod
+    def encode_body(cls, data, cluster='default'):
+        ''' Return the request body, headers and the size of the body before compression.
+        If C{HTTP_COMPRESS} is set for the cluster compressed responses are requested
+        and bodies of at least C{HTTP_COMPRESS_MIN_SIZE} bytes (default: 1024) are
+        gzip compressed. '''
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        elif isinstance(data, bytearray):
+            data = bytes(data)
+        body_size = len(data) if isinstance(data, bytes) else 0
+        if not ElasticSettings.getattr('HTTP_COMPRESS', cluster=cluster, default=False):
+            return (data, {}, body_size)
+
+        headers = {'Accept-Encoding': 'gzip'}
+        if body_size >= ElasticSettings.getattr('HTTP_COMPRESS_MIN_SIZE', cluster=cluster, default=1024):
+            data = gzip.compress(data)
+            headers['Content-Encoding'] = 'gzip'
+        return (data, headers, body_size)
+
+    @classmethod
+    def response_wire_bytes(cls, response):
+        ''' Return the size of the (compressed) response body received. '''
+        length = response.headers.get('Content-Length')
+        if length is not None:
+            return int(length)
+        try:
+            return response.raw.tell()
+        except AttributeError:
+            return len(response.content)
+
+    @classmethod
+    def record_wire_bytes(cls, pool, url, body, body_size, response_size, response_wire_size):
+        ''' Add the request and response sizes to the cluster statistics. '''
+        body_wire_size = len(body) if isinstance(body, bytes) else 0
+        pool.stats.record(body_size, body_wire_size, response_size, response_wire_size)
+        logger.debug(url.split('?', 1)[0] + " sent: " + str(body_size) + " bytes (" + str(body_wire_size) +
+                     " on wire), received: " + str(response_size) + " bytes (" + str(response_wire_size) +
+                     " on wire)")
+
+    @classmethod
+    def hit_stream(cls, response):
+        ''' Return a L{HitStream} over the hits of a streamed search response
+        (see L{elastic_request}) with the response metadata before the hits read. '''
+        if response.status_code != 200:
+            logger.warning("Error: elastic response 200:" + response.url)
+            raise QueryError(response.content.decode("utf-8"))
+
+        def on_close(response_size):
+            response.close()
+            if hasattr(response, '_record_wire_bytes'):
+                response._record_wire_bytes(response_size, Search.response_wire_bytes(response))
+
+        hit_stream = HitStream(response.iter_content(HitStream.CHUNK_SIZE), on_close=on_close)
+        hit_stream.read_meta()
+        return hit_stream
+
+    @classmethod
+    def is_coalesced(cls, url, method, data, cluster='default'):
+        ''' Return True if identical concurrent requests can share a response;
+        reads (L{COALESCED_ENDPOINTS}) other than scrolls, unless C{COALESCE_REQUESTS}
+        is False. Requests with side effects, such as a refresh, are never shared as
+        a caller could see a response from before its own writes. '''
+        if method not in ('GET', 'POST') or 'scroll' in url:
+            return False
+        if data is not None and not isinstance(data, (str, bytes, bytearray)):
+            return False
+        if not ElasticSettings.getattr('COALESCE_REQUESTS', cluster=cluster, default=True):
+            return False
+        return Search._endpoint(url) in Search.COALESCED_ENDPOINTS
+
+    @classmethod
+    def is_idempotent(cls, url, method='POST'):
+        ''' Return True if the request can safely be retried on another node. POST
+        requests are retried if the endpoint (the last path segment starting with
+        an underscore, as index names cannot) is a read, other than a scroll which
+        would skip a page. '''
+        if method in ('GET', 'HEAD'):
+            return True
+        if method != 'POST':
+            return False
+        return Search._endpoint(url) in Search.IDEMPOTENT_ENDPOINTS
+
+    @classmethod
+    def _endpoint(cls, url):
+        ''' Return the endpoint of a request url, the last path segment starting with
+        an underscore, or None if there is none or it is a scroll. '''
+        segments = url.split('?', 1)[0].strip('/').split('/')
+        if 'scroll' in segments:
+            return None
+        endpoints = [segment for segment in segments if segment.startswith('_')]
+        return endpoints[-1] if len(endpoints) > 0 else None
 
     @classmethod
     def index_exists(cls, idx, idx_type='', url=None):
         ''' Check if an index exists. '''
-        if url is None:
-            elastic_url = ElasticSettings.url()
+        elastic_url = ElasticSettings.url() if url is None else url
         url = idx + '/' + idx_type + '/_mapping'
-        response = Search.elastic_request(elastic_url, url, is_post=False)
-        if "error" in response.json():
-            logger.warning(response.json())
+        response = Search.elastic_request(elastic_url, url, is_post=False, call_type='admin')
+        resp_json = codec.response_json(response)
+        if "error" in resp_json:
+            logger.warning(resp_json)
             return False
         return True
 
@@ -125,10 +399,9 @@ class Search:
     def index_refresh(cls, idx, url=None):
         ''' Refresh to make all operations performed since the last refresh
         available for search'''
-        if url is None:
-            elastic_url = ElasticSettings.url()
-        response = Search.elastic_request(elastic_url, idx + '/_refresh')
-        if "error" in response.json():
+        elastic_url = ElasticSettings.url() if url is None else url
+        response = Search.elastic_request(elastic_url, idx + '/_refresh', call_type='admin')
+        if "error" in codec.response_json(response):
             logger.warning(response.content.decode("utf-8"))
             return False
         return True
@@ -136,14 +409,31 @@ class Search:
     @classmethod
     def range_overlap_query(cls, seqid, start_range, end_range,
                             search_from=0, size=20, idx=ElasticSettings.idx('DEFAULT'),
-                            field_list=None, seqid_param="seqid", start_param="start", end_param="end"):
-        ''' Constructs a range overlap query '''
+                            field_list=None, seqid_param="seqid", start_param="start", end_param="end",
+                            bin_param=None):
+        ''' Constructs a range overlap query. The bins are used if I{bin_param} is the
+        name of the bin field, or True to use the bin field next to the start field
+        (I{e.g.} 'featureloc.bin') if it is in the index mapping (see
+        L{ElasticUtils.range_overlap_query}). '''
         from elastic import utils
         query = utils.ElasticUtils.range_overlap_query(seqid, start_range, end_range, field_list=field_list,
                                                        seqid_param=seqid_param, start_param=start_param,
-                                                       end_param=end_param)
+                                                       end_param=end_param,
+                                                       bin_param=Search._bin_param(idx, start_param, bin_param))
         return cls(search_query=query, search_from=search_from, size=size, idx=idx)
 
+    @classmethod
+    def _bin_param(cls, idx, start_param, bin_param):
+        ''' Return the name of the bin field to use or None. If I{bin_param} is True
+        the bin field is used if it is in the (cached) index mapping. '''
+        if bin_param is not True:
+            return bin_param or None
+        bin_param = start_param[:start_param.rfind('.') + 1] + 'bin'
+        mapping = MappingCache.get(idx)
+        if mapping is not None and mapping.field(bin_param) is not None:
+            return bin_param
+        return None
+
     @classmethod
     def field_search_query(cls, query_term, aggs=None, fields=None, search_from=0,
                            size=20, idx=ElasticSettings.idx('DEFAULT')):
@@ -158,50 +448,200 @@ class Search:
             self.mapping_url += '/'+mapping_type
         elif self.idx_type is not None:
             self.mapping_url += '/'+self.idx_type
-        response = Search.elastic_request(ElasticSettings.url(), self.mapping_url, is_post=False)
+        response = Search.elastic_request(ElasticSettings.url(), self.mapping_url, is_post=False, call_type='admin')
         if response.status_code != 200:
-            json_err = json.dumps({"error": response.status_code,
+            json_err = codec.dumps({"error": response.status_code,
                                    "response": response.content.decode("utf-8"),
-                                   "url": self.mapping_url})
+                                   "url": self.mapping_url}).decode('utf-8')
             logger.warning(json_err)
             return json_err
-        return response.json()
+        return codec.response_json(response)
 
-    def get_count(self):
-        ''' Return the elastic count for a query result '''
+    def get_count(self, filter_path=None):
+        ''' Return the elastic count for a query result
+        @type  filter_path: string or list
+        @keyword filter_path: Response filtering, I{e.g.} 'count' (default: None).
+        '''
         url = self.idx + '/' + self.idx_type + '/_count?'
+        if filter_path is not None:
+            url += Search.filter_path_param(filter_path)
         data = {}
         if hasattr(self, 'query'):
-            data = json.dumps(self.query)
+            # the count API does not take a search timeout
+            data = codec.dumps({k: v for k, v in self.query.items() if k != 'timeout'})
         response = Search.elastic_request(ElasticSettings.url(), url, data=data)
-        return response.json()
+        logger.debug(url + " response size: " + str(len(response.content)) + " bytes")
+        return codec.response_json(response)
 
-    def get_json_response(self):
-        ''' Return the elastic json response '''
-        response = Search.elastic_request(self.elastic_url, self.url, data=json.dumps(self.query))
-        logger.debug("curl '" + self.elastic_url + '/' + self.url + "&pretty' -d '" + json.dumps(self.query) + "'")
+    def get_json_response(self, query=None):
+        ''' Return the elastic json response
+        @type  query: dict
+        @keyword query: Request body to use in place of the search query (default: None).
+        '''
+        if query is None:
+            query = self.query
+        data = codec.dumps(query)
+        response = Search.elastic_request(self.elastic_url, self.url, data=data,
+                                          timeout=self.request_timeout())
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("curl '" + self.elastic_url + '/' + self.url + "&pretty' -d '" + data.decode('utf-8') + "'")
+        return self._json_response(response)
+
+    def request_timeout(self):
+        ''' Return the (connect, read) request timeouts allowing for the deadline
+        or None to use the search timeouts in the settings. '''
+        if self.deadline is None:
+            return None
+        connect = ElasticSettings.timeout('search')[0]
+        return (connect, self.deadline + Search.DEADLINE_GRACE)
+
+    def _json_response(self, response):
+        ''' Return the JSON of a search response or a JSON error string. '''
+        logger.debug(self.url + " response size: " + str(len(response.content)) + " bytes")
         if response.status_code != 200:
             logger.warning("Error: elastic response 200:" + self.url)
-            json_err = json.dumps({"error": response.status_code,
+            json_err = codec.dumps({"error": response.status_code,
                                    "response": response.content.decode("utf-8"),
-                                   "url": self.url})
+                                   "url": self.url}).decode('utf-8')
             return json_err
-        return response.json()
+        return codec.response_json(response)
 
-    def search(self, obj_document=ElasticSettings.get_document_factory()):
+    def search(self, obj_document=ElasticSettings.get_document_factory(), stream=False):
         ''' Run the search and return a L{Result} that stores the
         L{Document} and L{Aggregation} objects.
         @type  obj_document: L{Document}
         @keyword obj_document: Document object.
+        @type  stream: bool
+        @keyword stream: Parse the response as it is received. The L{Result} docs
+        are then an iterator over the L{Document}s, built as each hit is decoded,
+        and the aggregations are set once all the docs have been iterated over
+        (default: False).
         '''
-        json_response = self.get_json_response()
-        hits = json_response['hits']['hits']
-        docs = [obj_document(hit) for hit in hits]
+        if stream:
+            return self._stream_result(self.stream_hits(), obj_document)
+        return self._result(self.get_json_response(), obj_document)
+
+    def stream_hits(self, query=None):
+        ''' Run the search streaming the response and return a L{HitStream} over the hits.
+        @type  query: dict
+        @keyword query: Request body to use in place of the search query (default: None).
+        '''
+        if query is None:
+            query = self.query
+        response = Search.elastic_request(self.elastic_url, self.url, data=codec.dumps(query),
+                                          timeout=self.request_timeout(), stream=True)
+        return Search.hit_stream(response)
+
+    def _stream_result(self, hit_stream, obj_document):
+        ''' Build the L{Result} from a L{HitStream}. '''
+        (hits_total, hits_total_relation) = Result.parse_total(hit_stream.meta)
+        result = Result(took=hit_stream.meta.get('took'),
+                        hits_total=hits_total, hits_total_relation=hits_total_relation,
+                        size=self.size, idx=self.idx, query=self.query,
+                        timed_out=hit_stream.meta.get('timed_out', False),
+                        shards=hit_stream.meta.get('_shards'))
+        result.docs = Search._stream_docs(hit_stream, obj_document, result)
+        if result.is_partial():
+            logger.warning("Partial results: " + self.url + " (timed out: " + str(result.timed_out) +
+                           ", shards: " + str(result.shards) + ")")
+        return result
+
+    @classmethod
+    def _stream_docs(cls, hit_stream, obj_document, result):
+        ''' Yield the L{Document} for each hit and then set the result aggregations. '''
+        try:
+            for hit in hit_stream:
+                yield obj_document(hit)
+            result.aggs = Aggregation.build_aggs(hit_stream.meta)
+        finally:
+            hit_stream.close()
+
+    def _result(self, json_response, obj_document):
+        ''' Build the L{Result} from a search JSON response. '''
+        # parts of the response may be removed by filter_path
+        hits = json_response.get('hits', {})
+        docs = [obj_document(hit) for hit in hits.get('hits', [])]
         aggs = Aggregation.build_aggs(json_response)
-        return Result(took=json_response['took'],
-                      hits_total=json_response['hits']['total'],
-                      size=self.size, docs=docs, aggs=aggs,
-                      idx=self.idx, query=self.query)
+        (hits_total, hits_total_relation) = Result.parse_total(json_response)
+        result = Result(took=json_response.get('took'),
+                        hits_total=hits_total, hits_total_relation=hits_total_relation,
+                        size=self.size, docs=docs, aggs=aggs,
+                        idx=self.idx, query=self.query,
+                        timed_out=json_response.get('timed_out', False),
+                        shards=json_response.get('_shards'))
+        if result.is_partial():
+            logger.warning("Partial results: " + self.url + " (timed out: " + str(result.timed_out) +
+                           ", shards: " + str(result.shards) + ")")
+        return result
+
+    def exists(self):
+        ''' Return True if any document matches the search query. This requests no
+        hits and terminates the search on each shard after the first match. '''
+        (url, data) = self._exists_request()
+        return self._exists_response(url, Search.elastic_request(self.elastic_url, url, data=data))
+
+    def _exists_request(self):
+        ''' Return the URL and body for an existence check. '''
+        url = (self.idx + '/' + self.idx_type + '/_search?size=0&terminate_after=1&' +
+               Search.filter_path_param('hits.total'))
+        data = {}
+        if hasattr(self, 'query') and 'query' in self.query:
+            data['query'] = self.query['query']
+        return (url, codec.dumps(data))
+
+    def _exists_response(self, url, response):
+        if response.status_code != 200:
+            logger.warning("Error: elastic response 200:" + url)
+            raise QueryError(response.content.decode("utf-8"))
+        return (Result.parse_total(codec.response_json(response))[0] or 0) > 0
+
+    def search_columns(self, fields, scroll=False, time_to_keep_scoll=1):
+        ''' Run the search requesting just the given fields and return the
+        hits as a L{Columns} store (an array per field) rather than as
+        L{Document}s. Requires numpy.
+        @type  fields: list
+        @param fields: Field names to return (dotted names for nested fields).
+        @type  scroll: bool
+        @keyword scroll: Use scan and scroll to fetch all the hits, in pages of the
+        search size, the column arrays of each page are concatenated (default: False).
+        @type  time_to_keep_scoll: integer
+        @keyword time_to_keep_scoll: Scroll time (in minutes) when scrolling.
+        @return: L{Columns}
+        '''
+        query = self._columns_query(fields)
+        if scroll:
+            columns = Columns(fields, idx=self.idx, query=query)
+            ScanAndScroll.scan_and_scroll(self.idx, call_fun=columns.add_response, idx_type=self.idx_type,
+                                          url=self.elastic_url, time_to_keep_scoll=time_to_keep_scoll,
+                                          query=self._columns_scroll_query(query, fields))
+            columns.hits_total = len(columns)
+            return columns
+        return self._columns_result(fields, query, self.get_json_response(query=query))
+
+    def _columns_query(self, fields):
+        ''' Return the search query body requesting just the fields. '''
+        query = dict(self.query) if hasattr(self, 'query') else {}
+        if 'query' not in query:
+            query['query'] = Query.match_all().query
+        query['_source'] = fields
+        return query
+
+    def _columns_scroll_query(self, query, fields):
+        ''' Return the scan and scroll L{ElasticQuery} for the columns query, the
+        search size (default: 1000) is the size of each page. '''
+        scroll_query = ElasticQuery(Query(query['query']), sources=fields)
+        scroll_query.query['size'] = self.size or 1000
+        return scroll_query
+
+    def _columns_result(self, fields, query, json_response):
+        ''' Build the L{Columns} from a search JSON response. '''
+        if not isinstance(json_response, dict):
+            raise QueryError(json_response)
+        columns = Columns(fields, took=json_response['took'],
+                          hits_total=Result.parse_total(json_response)[0],
+                          idx=self.idx, query=query)
+        columns.add_response(json_response)
+        return columns
 
 
 class Sort():
@@ -230,6 +670,151 @@ class Sort():
         else:
             raise QueryError("sort by option not recognised: " + str(sort_by))
 
+    def fields(self):
+        ''' Return the names of the fields sorted on. '''
+        sort_list = self.qsort["sort"]
+        if not isinstance(sort_list, list):
+            sort_list = [sort_list]
+        return [s if isinstance(s, str) else list(s.keys())[0] for s in sort_list]
+
+    def reverse(self):
+        ''' Return a new Sort with the order of each sort field reversed. '''
+        sort_list = self.qsort["sort"]
+        if not isinstance(sort_list, list):
+            sort_list = [sort_list]
+        reverse_order = {'asc': 'desc', 'desc': 'asc'}
+        reversed_list = []
+        for s in sort_list:
+            if isinstance(s, str):
+                reversed_list.append({s: 'asc' if s == '_score' else 'desc'})
+                continue
+            (name, opts) = list(s.items())[0]
+            if isinstance(opts, dict):
+                opts = dict(opts)
+                opts['order'] = reverse_order[opts.get('order', 'desc' if name == '_score' else 'asc')]
+            else:
+                opts = reverse_order[opts]
+            reversed_list.append({name: opts})
+        qsort = dict(self.qsort)
+        qsort["sort"] = reversed_list
+        return Sort(qsort)
+
+    def with_tiebreaker(self, tiebreaker='_uid'):
+        ''' Return a new Sort with a unique tiebreaker field appended (if not
+        already sorted on) so that hits have a total order, as needed by search_after. '''
+        sort_list = self.qsort["sort"]
+        if not isinstance(sort_list, list):
+            sort_list = [sort_list]
+        qsort = dict(self.qsort)
+        qsort["sort"] = list(sort_list)
+        if tiebreaker not in self.fields():
+            qsort["sort"].append(tiebreaker)
+        return Sort(qsort)
+
+
+class SearchAfter(object):
+    ''' Deep pagination using the Elastic search_after parameter (Elastic 5+).
+    Each page is fetched with the sort values of the last hit of the previous
+    page so, unlike from/size, the cost of a page does not grow with its depth.
+    The sort has a unique tiebreaker field appended so that the order is total.
+
+    The position in the results can be serialised as a cursor token for
+    stateless (I{e.g.} web) pagination::
+
+        paginator = SearchAfter(query, qsort=Sort('seqid,start'), size=500, idx=idx)
+        result = paginator.search(cursor=None)
+        next_page = paginator.search(cursor=result.cursor)
+
+    or all the pages iterated over::
+
+        for result in paginator.pages():
+            ...
+    '''
+
+    def __init__(self, search_query=None, qsort=None, size=20, idx=ElasticSettings.idx('DEFAULT'),
+                 idx_type='', elastic_url=None, sources=None, tiebreaker=None):
+        ''' Set up the paginated search.
+        @type  search_query: L{ElasticQuery}
+        @keyword search_query: The elastic query to search (default: match all).
+        @type  qsort: L{Sort}
+        @keyword qsort: Sort order of the results (default: just the tiebreaker).
+        @type  size: integer
+        @keyword size: Page size (default: 20).
+        @type  tiebreaker: string
+        @keyword tiebreaker: Unique field to add to the sort (default: _uid, or _id for Elastic 6+).
+        '''
+        if search_query is None:
+            search_query = ElasticQuery(Query.match_all())
+        if tiebreaker is None:
+            tiebreaker = SearchAfter.default_tiebreaker()
+        if qsort is None:
+            qsort = Sort(tiebreaker)
+        elif not isinstance(qsort, Sort):
+            raise QueryError("not a Sort")
+        self.search_query = search_query
+        self.qsort = qsort.with_tiebreaker(tiebreaker)
+        self.size = size
+        self.idx = idx
+        self.idx_type = idx_type
+        self.elastic_url = elastic_url
+        self.sources = sources
+
+    def search(self, cursor=None, obj_document=ElasticSettings.get_document_factory()):
+        ''' Return the page of results (L{Result}) following the cursor position. The
+        L{Result} I{cursor} attribute is set to the cursor for the next page
+        (None if the page is empty).
+        @type  cursor: string
+        @keyword cursor: Cursor token from a previous page (default: None, first page).
+        '''
+        search_after = None if cursor is None else SearchAfter.decode_cursor(cursor)
+        search = Search(search_query=self.search_query, size=self.size, idx=self.idx,
+                        idx_type=self.idx_type, qsort=self.qsort, elastic_url=self.elastic_url,
+                        sources=self.sources, search_after=search_after)
+        result = search.search(obj_document=obj_document)
+        if len(result.docs) > 0:
+            result.cursor = SearchAfter.encode_cursor(result.docs[-1].sort_values())
+        return result
+
+    def pages(self, cursor=None, obj_document=ElasticSettings.get_document_factory()):
+        ''' Iterate over the pages (L{Result}) of an arbitrary size result set. '''
+        while True:
+            result = self.search(cursor=cursor, obj_document=obj_document)
+            if len(result.docs) > 0:
+                yield result
+            if len(result.docs) < self.size:
+                return
+            cursor = result.cursor
+
+    def docs(self, cursor=None, obj_document=ElasticSettings.get_document_factory()):
+        ''' Iterate over all the documents, fetching a page at a time. '''
+        for result in self.pages(cursor=cursor, obj_document=obj_document):
+            for doc in result.docs:
+                yield doc
+
+    @classmethod
+    def default_tiebreaker(cls, cluster='default'):
+        ''' Unique document field to use as a sort tiebreaker. '''
+        return '_id' if ElasticSettings.version(cluster=cluster)['major'] >= 6 else '_uid'
+
+    @classmethod
+    def encode_cursor(cls, sort_values):
+        ''' Serialise the sort values of a hit as an opaque URL safe cursor token. '''
+        token = base64.urlsafe_b64encode(codec.dumps(sort_values))
+        return token.decode('ascii').rstrip('=')
+
+    @classmethod
+    def decode_cursor(cls, cursor):
+        ''' Return the sort values from a cursor token. '''
+        try:
+            token = cursor.encode('ascii')
+            token += b'=' * (-len(token) % 4)
+            sort_values = codec.loads(base64.urlsafe_b64decode(token))
+        except (ValueError, TypeError, UnicodeError, AttributeError):
+            raise QueryError("invalid cursor: " + str(cursor))
+        if not isinstance(sort_values, list):
+            raise QueryError("invalid cursor: " + str(cursor))
+        return sort_values
+
 
 class ScanAndScroll(object):
     ''' Use Elastic scan and scroll api. '''
@@ -242,8 +827,70 @@ class ScanAndScroll(object):
         if url is None:
             url = ElasticSettings.url()
 
+        (url_search_scan, url_scan_scroll, query) = \
+            ScanAndScroll._scan_request(idx, idx_type, time_to_keep_scoll, query)
+        response = Search.elastic_request(url, url_search_scan, data=codec.dumps(query))
+        _scroll_id = codec.response_json(response)['_scroll_id']
+
+        count = 0
+        while True:
+            response = Search.elastic_request(url, url_scan_scroll, data=_scroll_id)
+            resp_json = codec.response_json(response)
+            _scroll_id = resp_json['_scroll_id']
+            hits = resp_json['hits']['hits']
+            nhits = len(hits)
+            if nhits == 0:
+                break
+            count += nhits
+            if call_fun is not None:
+                call_fun(resp_json)
+        logger.debug("Scanned No. Docs ( "+idx+"/"+idx_type+" ) = "+str(count))
+
+    @classmethod
+    def docs(cls, idx, idx_type='', url=None, time_to_keep_scoll=1, query=None,
+             obj_document=ElasticSettings.get_document_factory(), stream=False):
+        ''' Iterate over the documents (L{Document}) of a scan and scroll.
+        @type  stream: bool
+        @keyword stream: Parse each page as it is received so that only a few
+        hits are held in memory at a time (default: False).
+        '''
+        if url is None:
+            url = ElasticSettings.url()
+
+        (url_search_scan, url_scan_scroll, query) = \
+            ScanAndScroll._scan_request(idx, idx_type, time_to_keep_scoll, query)
+        response = Search.elastic_request(url, url_search_scan, data=codec.dumps(query))
+        _scroll_id = codec.response_json(response)['_scroll_id']
+
+        count = 0
+        while True:
+            response = Search.elastic_request(url, url_scan_scroll, data=_scroll_id, stream=stream)
+            if stream:
+                hit_stream = Search.hit_stream(response)
+                (hits, page) = (hit_stream, hit_stream.meta)
+            else:
+                page = codec.response_json(response)
+                hits = page['hits']['hits']
+            nhits = 0
+            try:
+                for hit in hits:
+                    nhits += 1
+                    yield obj_document(hit)
+            finally:
+                if stream:
+                    hit_stream.close()
+            _scroll_id = page['_scroll_id']
+            if nhits == 0:
+                break
+            count += nhits
+        logger.debug("Scanned No. Docs ( "+idx+"/"+idx_type+" ) = "+str(count))
+
+    @classmethod
+    def _scan_request(cls, idx, idx_type, time_to_keep_scoll, query):
+        ''' Return the scan URL, scroll URL and scan query body. '''
         url_search_scan = (idx + '/' + idx_type + '/_search?search_type=scan&scroll=' +
                            str(time_to_keep_scoll) + 'm')
+        url_scan_scroll = '_search/scroll?scroll=' + str(time_to_keep_scoll) + 'm'
         if query is None:
             query = {
                 "query": {"match_all": {}},
@@ -253,23 +900,59 @@ class ScanAndScroll(object):
             if not isinstance(query, ElasticQuery):
                 raise QueryError("not a Query")
             query = query.query
+        return (url_search_scan, url_scan_scroll, query)
 
-        response = Search.elastic_request(url, url_search_scan, data=json.dumps(query))
-        _scroll_id = response.json()['_scroll_id']
-        url_scan_scroll = '_search/scroll?scroll=' + str(time_to_keep_scoll) + 'm'
 
-        count = 0
-        while True:
-            response = Search.elastic_request(url, url_scan_scroll, data=_scroll_id)
-            _scroll_id = response.json()['_scroll_id']
-            hits = response.json()['hits']['hits']
-            nhits = len(hits)
-            if nhits == 0:
-                break
-            count += nhits
-            if call_fun is not None:
-                call_fun(response.json())
-        logger.debug("Scanned No. Docs ( "+idx+"/"+idx_type+" ) = "+str(count))
+class MultiSearch(object):
+    ''' Multi search API, runs a list of L{Search}es in one request. '''
+
+    def __init__(self, searches, elastic_url=None):
+        '''
+        @type  searches: list
+        @param searches: L{Search} objects.
+        @type  elastic_url: string
+        @keyword elastic_url: Elastic URL (default: default cluster URL).
+        '''
+        if any(not isinstance(s, Search) for s in searches):
+            raise QueryError("not a Search")
+        if elastic_url is None:
+            elastic_url = ElasticSettings.url()
+        self.searches = searches
+        self.elastic_url = elastic_url
+
+    def get_json_responses(self):
+        ''' Return the elastic json response of each search. '''
+        if len(self.searches) == 0:
+            return []
+        data = bytearray()
+        for search in self.searches:
+            header = {"index": search.idx}
+            if search.idx_type:
+                header["type"] = search.idx_type
+            if search.search_type is not None:
+                header["search_type"] = search.search_type
+            body = dict(search.query) if hasattr(search, 'query') else {}
+            body.setdefault('size', search.size)
+            body.setdefault('from', search.search_from)
+            data += codec.dumps(header) + b'\n' + codec.dumps(body) + b'\n'
+
+        response = Search.elastic_request(self.elastic_url, '_msearch', data=data)
+        if response.status_code != 200:
+            raise QueryError("Multi search error: " + str(response.status_code) + ' ' +
+                             response.content.decode("utf-8"))
+        return codec.response_json(response)['responses']
+
+    def search(self, obj_document=ElasticSettings.get_document_factory()):
+        ''' Run the searches and return a L{Result} for each. Searches that fail
+        are logged and have a L{Result} with no docs. '''
+        results = []
+        for (search, json_response) in zip(self.searches, self.get_json_responses()):
+            if 'error' in json_response:
+                logger.warning("Multi search error: " + search.idx + ' ' + str(json_response['error']))
+                results.append(Result(size=search.size, docs=[], idx=search.idx, query=getattr(search, 'query', None)))
+            else:
+                results.append(search._result(json_response, obj_document))
+        return results
 
 
 class Suggest(object):
@@ -282,6 +965,16 @@ class Suggest(object):
         if elastic_url is None:
             elastic_url = ElasticSettings.url()
 
+        (url, suggest) = Suggest._suggest_request(term, idx, name, field, context, size)
+        data = codec.dumps(suggest)
+        response = Search.elastic_request(elastic_url, url, data=data)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("curl -XPOST '" + elastic_url + '/' + url + "' -d '" + data.decode('utf-8') + "'")
+        return Suggest._suggest_response(url, response)
+
+    @classmethod
+    def _suggest_request(cls, term, idx, name, field, context, size):
+        ''' Return the suggest URL and request body. '''
         url = (idx + '/' + '/_suggest')
         suggest = {
             name: {
@@ -294,12 +987,14 @@ class Suggest(object):
         }
         if context is not None:
             suggest[name]['completion'].update(context)
-        response = Search.elastic_request(elastic_url, url, data=json.dumps(suggest))
-        logger.debug("curl -XPOST '" + elastic_url + '/' + url + "' -d '" + json.dumps(suggest) + "'")
+        return (url, suggest)
+
+    @classmethod
+    def _suggest_response(cls, url, response):
         if response.status_code != 200:
             logger.warning("Suggeter Error: elastic response 200:" + url)
-            logger.warning(response.json())
-        return response.json()
+            logger.warning(codec.response_json(response))
+        return codec.response_json(response)
 
 
 class Update(object):
@@ -312,13 +1007,15 @@ class Update(object):
             elastic_url = ElasticSettings.url()
         url = (doc._meta['_index'] + '/' +
                doc.type() + '/' + doc._meta['_id'] + '/_update')
-        response = Search.elastic_request(elastic_url, url, data=json.dumps(part_doc))
+        data = codec.dumps(part_doc)
+        response = Search.elastic_request(elastic_url, url, data=data)
 
-        logger.debug("curl -XPOST '" + elastic_url + url + "' -d '" + json.dumps(part_doc) + "'")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("curl -XPOST '" + elastic_url + url + "' -d '" + data.decode('utf-8') + "'")
         if response.status_code != 200:
             logger.warning("Error: elastic response 200:" + url)
-            logger.warning(response.json())
-        return response.json()
+            logger.warning(codec.response_json(response))
+        return codec.response_json(response)
 
 
 class Delete(object):
@@ -346,20 +1043,41 @@ class Bulk(object):
         ''' Bulk load documents. '''
         if elastic_url is None:
             elastic_url = ElasticSettings.url()
-        resp = requests.put(ElasticSettings.url()+'/' + idx+'/' + idx_type +
-                            '/_bulk', data=json_data)
+        resp = Search.elastic_request(elastic_url, idx + '/' + idx_type + '/_bulk', data=json_data,
+                                      method='PUT', call_type='bulk')
+        Bulk._report_errors(idx, resp)
+        return resp
+
+    @classmethod
+    def failed_ids(cls, resp):
+        ''' Return the IDs of the documents in a bulk response that failed to load
+        (or delete), or None if the bulk request failed. '''
+        if resp.status_code != 200:
+            return None
+        try:
+            resp_json = codec.response_json(resp)
+        except ValueError:
+            return None
+        if not resp_json.get('errors'):
+            return set()
+        return set(str(action.get('_id')) for item in resp_json['items'] for action in item.values()
+                   if 'error' in action)
+
+    @classmethod
+    def _report_errors(cls, idx, resp):
+        ''' Log the status and any errors found during loading. '''
         if(resp.status_code != 200):
             logger.error('ERROR: '+idx+' load status: '+str(resp.status_code)+' '+str(resp.content))
 
         # report errors found during loading
-        if 'errors' in resp.json() and resp.json()['errors']:
+        resp_json = codec.response_json(resp)
+        if 'errors' in resp_json and resp_json['errors']:
             logger.error("ERROR: bulk load error found")
-            for item in resp.json()['items']:
+            for item in resp_json['items']:
                 for key in item.keys():
                     if 'error' in item[key]:
                         logger.error("ERROR LOADING:")
                         logger.error(item)
-        return resp
 
 
 class ElasticQuery():
@@ -393,6 +1111,16 @@ class ElasticQuery():
                 raise QueryError("not a Highlight")
             self.query.update(highlight.highlight)
 
+    def freeze(self):
+        ''' Return an immutable copy of the query that is hashable (by its I{query})
+        and caches its JSON encoding, so it can be built once and reused in
+        searches (see L{elastic.frozen}).
+        @return: L{ElasticQuery}
+        '''
+        frozen = copy.copy(self)
+        frozen.query = freeze(self.query)
+        return frozen
+
     @classmethod
     def bool(cls, query_bool, sources=None, highlight=None):
         ''' Factory method for creating elastic Bool Query.
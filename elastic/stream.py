@@ -0,0 +1,160 @@
+''' Incremental parsing of Elastic search responses.
+
+A L{HitStream} parses the body of a search response as it is received and
+yields the hits (C{hits.hits}) one at a time, so that only a few hits (and
+the rest of the response) are held in memory rather than the whole body,
+the decoded JSON tree and the L{Document}s built from it::
+
+    hit_stream = HitStream(response.iter_content(HitStream.CHUNK_SIZE))
+    hit_stream.read_meta()     # e.g. hit_stream.meta['hits']['total']
+    for hit in hit_stream:
+        ...
+
+The hits are decoded with the standard library json module whatever the
+C{JSON_CODEC} setting as an incremental decoder is needed.
+'''
+import codecs
+import json
+
+
+class HitStream(object):
+    ''' Iterate over the hits of a search response as they are decoded from the
+    response body. The rest of the response is stored in L{meta}; the parts before
+    the hits (I{e.g.} took, _shards, hits.total) once L{read_meta} has been called
+    and those after the hits (I{e.g.} aggregations) once all the hits have been
+    iterated over. '''
+    CHUNK_SIZE = 65536
+    _HITS = object()    # marks the start of the hits array
+
+    def __init__(self, chunks, on_close=None):
+        '''
+        @type  chunks: iterator
+        @param chunks: Chunks of the response body (bytes).
+        @type  on_close: function
+        @keyword on_close: Called with the number of bytes read when the body has
+        been read or the stream is closed.
+        '''
+        self._chunks = iter(chunks)
+        self._on_close = on_close
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._parser = self._parse()
+        self._started = False
+        self.meta = {}
+        self.size = 0
+
+    def read_meta(self):
+        ''' Read the response up to the first hit. '''
+        if not self._started:
+            self._started = True
+            for _ in self._parser:
+                break
+        return self.meta
+
+    def __iter__(self):
+        self.read_meta()
+        for hit in self._parser:
+            yield hit
+
+    def close(self):
+        ''' Stop reading the response. '''
+        if not self._eof:
+            self._eof = True
+            self._parser.close()
+            if self._on_close is not None:
+                self._on_close(self.size)
+
+    def _parse(self):
+        ''' Generator parsing the response, yielding L{_HITS} at the start of the
+        hits array and then each hit. '''
+        self._expect('{')
+        yield from self._members(self.meta, False)
+        self._fill(len(self._buf) + 1)   # read to the end of the body
+
+    def _members(self, obj, in_hits):
+        ''' Parse the members of an object into I{obj}. '''
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key == 'hits' and not in_hits and self._peek() == '{':
+                self._pos += 1
+                obj[key] = {}
+                yield from self._members(obj[key], True)
+            elif key == 'hits' and in_hits and self._peek() == '[':
+                self._pos += 1
+                obj[key] = []
+                yield HitStream._HITS
+                yield from self._array()
+            else:
+                obj[key] = self._value()
+            if self._expect(',}') == '}':
+                return
+
+    def _array(self):
+        ''' Yield the values of an array. '''
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._expect(',]') == ']':
+                return
+
+    def _value(self):
+        ''' Decode the next value, reading more of the body until it is complete. '''
+        self._peek()
+        while True:
+            try:
+                (value, end) = self._decoder.raw_decode(self._buf, self._pos)
+                # a value ending the buffer may be truncated (e.g. a number)
+                if end < len(self._buf) or self._eof:
+                    break
+            except ValueError:
+                if self._eof:
+                    raise
+            # at least double the data to decode so large values are not decoded many times
+            self._fill(len(self._buf) + max(HitStream.CHUNK_SIZE, len(self._buf) - self._pos))
+        self._pos = end
+        if self._pos >= HitStream.CHUNK_SIZE:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        return value
+
+    def _peek(self):
+        ''' Return the next non-whitespace character without consuming it. '''
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if self._eof:
+                raise ValueError('Unexpected end of the response')
+            self._fill(len(self._buf) + 1)
+
+    def _expect(self, chars):
+        ''' Consume the next non-whitespace character, one of I{chars}. '''
+        char = self._peek()
+        if char not in chars:
+            raise ValueError('Expecting ' + ' or '.join(chars) + ' at ' + repr(self._buf[self._pos:self._pos+20]))
+        self._pos += 1
+        return char
+
+    def _fill(self, min_len):
+        ''' Read chunks of the body until the buffer is at least I{min_len} long. '''
+        while not self._eof and len(self._buf) < min_len:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._buf += self._utf8.decode(b'', final=True)
+                self._eof = True
+                if self._on_close is not None:
+                    self._on_close(self.size)
+                return
+            self.size += len(chunk)
+            self._buf += self._utf8.decode(chunk)
@@ -25,7 +25,7 @@ IDX = {'GENE': {'indexName': 'test__gene_'+SEARCH_SUFFIX,
        'BED_GENERIC': {'indexName': 'test__bed_'+SEARCH_SUFFIX, 'indexType': 'bed',
                        'indexBED': SEARCH_TEST_DATA_PATH+'test.bed', 'shards': NUMBER_OF_SHARDS},
        'GFF_GENERIC': {'indexName': 'test__gff_'+SEARCH_SUFFIX, 'indexType': 'gff',
-                       'indexGFF': SEARCH_TEST_DATA_PATH+'test.gff.gz', 'shards': NUMBER_OF_SHARDS},
+                       'indexGFF': SEARCH_TEST_DATA_PATH+'test.gff.gz', 'bins': True, 'shards': NUMBER_OF_SHARDS},
        'GTF_GENERIC': {'indexName': 'test__gtf_'+SEARCH_SUFFIX, 'indexType': 'gtf',
                        'indexGFF': SEARCH_TEST_DATA_PATH+'test.gtf.gz', 'isGTF': True, 'shards': NUMBER_OF_SHARDS},
        'GFF_ERR': {'indexName': 'test__err__gff_'+SEARCH_SUFFIX, 'indexType': 'gff',
@@ -3,10 +3,16 @@ from django.conf.urls import include, url
 from elastic.tests.settings_idx import IDX
 from rest_framework import routers
 from elastic.rest_framework.api import MarkerViewSet
+from elastic.rest_framework.resources import ElasticCursorPagination
+
+
+class MarkerCursorViewSet(MarkerViewSet):
+    pagination_class = ElasticCursorPagination
 
 
 router = routers.DefaultRouter()
 router.register(r'marker_test', MarkerViewSet, base_name='marker_test')
+router.register(r'marker_cursor_test', MarkerCursorViewSet, base_name='marker_cursor_test')
 MarkerViewSet.idx = IDX['MARKER']['indexName']
 
 
@@ -0,0 +1,186 @@
+''' Tests for the asyncio search API (L{elastic.async_search}). These run against
+a local stand-in HTTP server returning canned Elastic responses rather than a
+live cluster. '''
+import asyncio
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import json
+import threading
+import unittest
+
+from django.test import TestCase
+
+from elastic.aggs import Agg, Aggs
+from elastic.async_search import AsyncSearch, AsyncSuggest, AsyncBulk, AsyncScanAndScroll, \
+    AsyncSession, aiohttp
+from elastic.query import Query
+from elastic.result import Document
+from elastic.search import ElasticQuery, Sort
+
+
+HITS = [{"_index": "test_idx", "_type": "marker", "_id": "1", "_score": 1.0,
+         "_source": {"id": "rs2476601", "seqid": "1", "start": 113834946}},
+        {"_index": "test_idx", "_type": "marker", "_id": "2", "_score": 1.0,
+         "_source": {"id": "rs768019142", "seqid": "1", "start": 10055}}]
+
+
+class StandInElasticHandler(BaseHTTPRequestHandler):
+    ''' Return canned Elastic responses based on the request path. '''
+
+    def do_GET(self):
+        self._respond()
+
+    def do_POST(self):
+        self._respond()
+
+    def do_PUT(self):
+        self._respond()
+
+    def _respond(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode('utf-8')
+        self.server.requests.append((self.command, self.path, body))
+
+        status = 200
+        if '_count' in self.path:
+            resp = {"count": len(HITS)}
+        elif '_suggest' in self.path:
+            resp = {"data": [{"text": "rs24", "options": [{"text": "rs2476601", "score": 1.0}]}]}
+        elif '_bulk' in self.path:
+            resp = {"took": 1, "errors": False, "items": [{"index": {"_id": "3", "status": 201}}]}
+        elif 'search_type=scan' in self.path:
+            resp = {"_scroll_id": "scroll1", "hits": {"total": len(HITS), "hits": []}}
+        elif '_search/scroll' in self.path:
+            hits = HITS if body == 'scroll1' else []
+            resp = {"_scroll_id": "scroll2", "hits": {"total": len(HITS), "hits": hits}}
+        elif 'missing_idx' in self.path:
+            status = 404
+            resp = {"error": "index_not_found_exception", "status": 404}
+        elif '_search' in self.path:
+            resp = {"took": 2, "timed_out": False, "hits": {"total": len(HITS), "hits": HITS},
+                    "aggregations": {"seqids": {"buckets": [{"key": "1", "doc_count": 2}]}}}
+        else:
+            status = 400
+            resp = {"error": "unexpected request"}
+
+        content = json.dumps(resp).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipIf(aiohttp is None, 'aiohttp not installed')
+class AsyncSearchTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(('127.0.0.1', 0), StandInElasticHandler)
+        cls.server.requests = []
+        cls.url = 'http://127.0.0.1:' + str(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests.clear()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.run_until_complete(AsyncSession.close(self.loop))
+        self.loop.close()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_search(self):
+        ''' Test the search returns the same Result and Document objects as Search. '''
+        query = ElasticQuery(Query.term("seqid", "1"), sources=['id', 'start'])
+        aggs = Aggs(Agg('seqids', 'terms', {"field": "seqid"}))
+        search = AsyncSearch(query, aggs=aggs, idx='test_idx', qsort=Sort('start'),
+                             size=5, elastic_url=self.url)
+        result = self.run_async(search.search())
+        self.assertEqual(result.hits_total, 2)
+        self.assertEqual(len(result.docs), 2)
+        self.assertTrue(isinstance(result.docs[0], Document))
+        self.assertEqual(getattr(result.docs[0], 'id'), 'rs2476601')
+        self.assertEqual(result.aggs['seqids'].get_buckets()[0]['doc_count'], 2)
+
+        (method, path, body) = self.server.requests[0]
+        self.assertEqual(method, 'POST')
+        self.assertEqual(path, '/test_idx//_search?size=5&from=0')
+        self.assertEqual(json.loads(body), search.query)
+
+    def test_search_error(self):
+        ''' Test an error response is returned as JSON error string as for Search. '''
+        search = AsyncSearch(ElasticQuery(Query.match_all()), idx='missing_idx', elastic_url=self.url)
+        json_err = json.loads(self.run_async(search.get_json_response()))
+        self.assertEqual(json_err['error'], 404)
+
+    def test_count_and_exists(self):
+        ''' Test the count and exists requests. '''
+        search = AsyncSearch(ElasticQuery(Query.match_all()), idx='test_idx', elastic_url=self.url)
+        self.assertEqual(self.run_async(search.get_count())['count'], 2)
+        self.assertTrue(self.run_async(search.exists()))
+
+    def test_search_columns(self):
+        ''' Test the hits returned as columns, with and without scrolling. '''
+        search = AsyncSearch(ElasticQuery(Query.match_all()), idx='test_idx', elastic_url=self.url)
+        columns = self.run_async(search.search_columns(['id', 'start']))
+        self.assertEqual(list(columns['start']), [113834946, 10055])
+        self.assertEqual(columns.hits_total, 2)
+        self.assertEqual(json.loads(self.server.requests[0][2])['_source'], ['id', 'start'])
+
+        columns = self.run_async(search.search_columns(['id'], scroll=True))
+        self.assertEqual(list(columns['id']), ['rs2476601', 'rs768019142'])
+        scan = [json.loads(body) for (_, path, body) in self.server.requests if 'search_type=scan' in path]
+        self.assertEqual(scan[0]['size'], search.size, 'scroll page size')
+
+    def test_unsupported(self):
+        ''' Test streaming the hits raises an error rather than blocking the event loop. '''
+        search = AsyncSearch(ElasticQuery(Query.match_all()), idx='test_idx', elastic_url=self.url)
+        self.assertRaises(NotImplementedError, self.run_async, search.search(stream=True))
+        self.assertRaises(NotImplementedError, search.stream_hits)
+        self.assertRaises(NotImplementedError, AsyncSearch.hit_stream, None)
+        self.assertEqual(self.server.requests, [])
+
+    def test_concurrent_searches(self):
+        ''' Test searches run concurrently on the shared session. '''
+        searches = [AsyncSearch(ElasticQuery(Query.ids(str(i))), idx='test_idx', elastic_url=self.url)
+                    for i in range(10)]
+        results = self.run_async(asyncio.gather(*[s.search() for s in searches]))
+        self.assertEqual(len(results), 10)
+        self.assertEqual(len(self.server.requests), 10)
+
+    def test_suggest(self):
+        ''' Test auto completion suggestions. '''
+        resp = self.run_async(AsyncSuggest.suggest('rs24', 'test_idx', elastic_url=self.url))
+        self.assertEqual(resp['data'][0]['options'][0]['text'], 'rs2476601')
+
+    def test_bulk(self):
+        ''' Test bulk loading. '''
+        json_data = '{"index": {"_id": "3"}}\n' + json.dumps({"id": "rs3"}) + '\n'
+        resp = self.run_async(AsyncBulk.load('test_idx', 'marker', json_data, elastic_url=self.url))
+        self.assertEqual(resp.status_code, 200)
+        (method, path, body) = self.server.requests[0]
+        self.assertEqual((method, path, body), ('PUT', '/test_idx/marker/_bulk', json_data))
+
+    def test_scan_and_scroll(self):
+        ''' Test iterating over the scroll pages. '''
+        async def scroll():
+            pages = []
+            async for resp_json in AsyncScanAndScroll('test_idx', url=self.url):
+                pages.append(resp_json)
+            return pages
+        pages = self.run_async(scroll())
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(len(pages[0]['hits']['hits']), 2)
@@ -5,19 +5,34 @@ from django.core.management import call_command
 from elastic.management.loaders.mapping import MappingProperties
 from elastic.management.loaders.loader import Loader
 from elastic.tests.settings_idx import IDX, OVERRIDE_SETTINGS, SEARCH_SUFFIX
-from elastic.elastic_settings import ElasticSettings
+from elastic.elastic_settings import ElasticSettings, ElasticUrl
 from django.core.urlresolvers import reverse
 from elastic.search import Search, ElasticQuery, Highlight, ScanAndScroll, Sort,\
-    Suggest, Bulk
+    Suggest, Bulk, SearchAfter, MultiSearch
 from elastic.query import Query, BoolQuery, RangeQuery, Filter, TermsFilter,\
     AndFilter, NotFilter, OrFilter, ScoreFunction, FunctionScoreQuery, ExistsFilter
 from elastic.exceptions import AggregationError, QueryError
 from elastic.aggs import Agg, Aggs
+from elastic.utils import ElasticUtils
+from elastic.result import Result
+from elastic.concurrent import gather
+from elastic import codec
+from elastic.benchmarks.codec import available_codecs
+from elastic.stream import HitStream
+from elastic.coalesce import SingleFlight
+from elastic.optimizer import QueryOptimizer
+from elastic.mapping import IndexMapping, MappingCache, QueryValidator
+from elastic.binning import Binning
+from elastic.intervals import IntervalCache, IntervalIndex
+from concurrent.futures import TimeoutError
+import functools
 from rest_framework.test import APITestCase
+import copy
 import json
 import requests
 import time
 import sys
+import unittest
 
 
 @override_settings(ELASTIC=OVERRIDE_SETTINGS)
@@ -86,6 +101,25 @@ class RestFrameworkTest(APITestCase):
         self.assertTrue(resp['Content-Type'].startswith('application/json'))
         self.assertEqual(json.loads(resp.content.decode())['count'], 1, 'Retrieved rs2476601')
 
+    def test_list_cursor(self):
+        ''' Test paging through a list via rest using cursor pagination. '''
+        url = reverse('rest-router:marker_cursor_test-list')
+        resp = self.client.get(url, format='json', data={'page_size': 1})
+        self.assertEqual(resp.status_code, 200)
+        page1 = json.loads(resp.content.decode())
+        self.assertEqual(len(page1['results']), 1)
+        self.assertIsNone(page1['previous'])
+        self.assertIsNotNone(page1['next'])
+        self.assertEqual(self.client.get(url, format='json', data={'cursor': 'xyz'}).status_code, 404)
+
+        if ElasticSettings.version()['major'] < 5:
+            return  # search_after requires Elastic 5+
+        page2 = json.loads(self.client.get(page1['next'], format='json').content.decode())
+        self.assertNotEqual(page2['results'][0]['id'], page1['results'][0]['id'])
+        self.assertIsNotNone(page2['previous'])
+        previous = json.loads(self.client.get(page2['previous'], format='json').content.decode())
+        self.assertEqual(previous['results'], page1['results'])
+
     def test_detail(self):
         ''' Test retrieving a single document via rest. '''
         url = reverse('rest-router:marker_test-detail', kwargs={'pk': '1'})
@@ -165,6 +199,44 @@ class ScanAndScrollTest(TestCase):
         ScanAndScroll.scan_and_scroll(ElasticSettings.idx('DEFAULT'), call_fun=check_hits,
                                       query=ElasticQuery.query_string("rs2476601", fields=["id"]))
 
+    def test_scan_and_scroll_docs(self):
+        ''' Test iterating over the scan and scroll documents, streaming the pages. '''
+        idx = ElasticSettings.idx('DEFAULT')
+        doc_ids = [doc.doc_id() for doc in ScanAndScroll.docs(idx)]
+        self.assertEqual(len(doc_ids), ElasticUtils.get_docs_count(idx, ''))
+        self.assertEqual(sorted(doc.doc_id() for doc in ScanAndScroll.docs(idx, stream=True)), sorted(doc_ids))
+
+
+@override_settings(ELASTIC=OVERRIDE_SETTINGS)
+class SearchAfterTest(TestCase):
+
+    def test_cursor(self):
+        ''' Test encoding and decoding cursor tokens. '''
+        sort_values = ['1', 10055, 'marker#2']
+        cursor = SearchAfter.encode_cursor(sort_values)
+        self.assertEqual(SearchAfter.decode_cursor(cursor), sort_values)
+        self.assertRaises(QueryError, SearchAfter.decode_cursor, 'xyz!')
+        self.assertRaises(QueryError, Search, ElasticQuery(Query.match_all()), search_after=[1])
+
+    def test_tiebreaker(self):
+        ''' Test a unique tiebreaker is added to the sort. '''
+        qsort = Sort('seqid,start:desc').with_tiebreaker('_uid')
+        self.assertEqual(qsort.qsort['sort'], ['seqid', {'start': 'desc'}, '_uid'])
+        self.assertEqual(qsort.with_tiebreaker('_uid').fields(), ['seqid', 'start', '_uid'])
+
+    @unittest.skipIf(ElasticSettings.version()['major'] < 5, 'search_after requires Elastic 5+')
+    def test_pages(self):
+        ''' Test iterating over all the pages of a search. '''
+        idx = ElasticSettings.idx('DEFAULT')
+        paginator = SearchAfter(ElasticQuery(Query.match_all()), qsort=Sort('start'), size=1, idx=idx)
+        docs = list(paginator.docs())
+        self.assertEqual(len(docs), Search(idx=idx).get_count()['count'])
+        self.assertEqual(len(set(doc.doc_id() for doc in docs)), len(docs), 'no duplicate hits')
+
+        first = paginator.search()
+        second = paginator.search(cursor=first.cursor)
+        self.assertEqual(second.docs[0].doc_id(), docs[1].doc_id())
+
 
 @override_settings(ELASTIC=OVERRIDE_SETTINGS)
 class SuggestTest(TestCase):
@@ -175,6 +247,121 @@ class SuggestTest(TestCase):
         self.assertTrue(resp[0]['options'][0]['text'], 'XAB')
 
 
+@override_settings(ELASTIC=OVERRIDE_SETTINGS)
+class GatherTest(TestCase):
+
+    def test_gather(self):
+        ''' Test running search, suggest and count requests concurrently. '''
+        idx = ElasticSettings.idx('DEFAULT')
+        gathered = gather([Search(ElasticQuery(Query.term("id", "rs768019142")), idx=idx).search,
+                           functools.partial(Suggest.suggest, 'XA', IDX['JSON_NESTED']['indexName'],
+                                             name='suggest', size=1),
+                           Search(idx=idx).get_count], timeout=10)
+        (result, suggest, count) = gathered.results
+        self.assertEqual(result.hits_total, 1)
+        self.assertTrue('suggest' in suggest)
+        self.assertEqual(count['count'], ElasticUtils.get_docs_count(idx, ''))
+        self.assertEqual(len(gathered.timings), 3)
+        self.assertLessEqual(max(gathered.timings), gathered.elapsed)
+
+    def test_gather_timeout(self):
+        ''' Test a call that exceeds the timeout and one that raises an error. '''
+        def fail():
+            raise QueryError('fail')
+
+        gathered = gather([functools.partial(time.sleep, 2), lambda: 'ok', fail],
+                          timeout=0.5, return_exceptions=True)
+        self.assertTrue(isinstance(gathered.results[0], TimeoutError))
+        self.assertEqual(gathered.results[1], 'ok')
+        self.assertTrue(isinstance(gathered.errors[2], QueryError))
+        self.assertIsNone(gathered.timings[0])
+        self.assertLess(gathered.elapsed, 2)
+        self.assertRaises(QueryError, gather, [fail])
+
+
+class CountingCodec(codec.StdlibCodec):
+    ''' Standard library codec counting the number of decodes. '''
+    DECODES = 0
+
+    @staticmethod
+    def loads(data):
+        CountingCodec.DECODES += 1
+        return codec.StdlibCodec.loads(data)
+
+
+@override_settings(ELASTIC=OVERRIDE_SETTINGS)
+class CodecTest(TestCase):
+
+    def test_codecs(self):
+        ''' Test encoding to bytes and decoding with each available codec. '''
+        doc = {"id": "rs768019142", "seqid": "1", "start": 10054, "alleles": ["C", "T"], "name": "\u03b1"}
+        for name in available_codecs():
+            json_codec = codec.get_codec(name)
+            encoded = json_codec.dumps(doc, sort_keys=True)
+            self.assertTrue(isinstance(encoded, bytes), name)
+            self.assertEqual(json_codec.loads(encoded), doc, name)
+            self.assertEqual(json.loads(encoded.decode('utf-8')), doc, name)
+        self.assertRaises(ImportError, codec.get_codec, 'elastic.codec.NoSuchCodec')
+
+    def test_response_decoded_once(self):
+        ''' Test that a search response is only decoded once. '''
+        codec_settings = copy.deepcopy(OVERRIDE_SETTINGS)
+        codec_settings['default']['JSON_CODEC'] = 'elastic.tests.tests_elastic_model.CountingCodec'
+        with override_settings(ELASTIC=codec_settings):
+            CountingCodec.DECODES = 0
+            response = Search.elastic_request(ElasticSettings.url(), ElasticSettings.idx('DEFAULT') + '/_search',
+                                              data=codec.dumps(ElasticQuery(Query.match_all()).query))
+            for _ in range(3):
+                self.assertIn('hits', codec.response_json(response))
+            self.assertEqual(CountingCodec.DECODES, 1)
+
+
+@override_settings(ELASTIC=OVERRIDE_SETTINGS)
+class CoalesceTest(TestCase):
+
+    def test_single_flight(self):
+        ''' Test callers with the same key wait for and share the call in flight. '''
+        single_flight = SingleFlight()
+        calls = []
+
+        def slow_call():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'hits': len(calls)}
+
+        gathered = gather([functools.partial(single_flight.do, 'key', slow_call) for _ in range(5)])
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is gathered.results[0] for result in gathered.results))
+        self.assertEqual(single_flight.as_dict(), {'calls': 1, 'coalesced': 4})
+        self.assertEqual(single_flight.in_flight(), 0)
+        self.assertEqual(single_flight.do('key', slow_call), {'hits': 2}, 'not in flight so called again')
+
+        gathered = gather([functools.partial(single_flight.do, 'key', slow_call, share=dict) for _ in range(3)])
+        self.assertEqual(len(set(id(result) for result in gathered.results)), 3, 'a copy for each caller')
+        self.assertTrue(all(result == {'hits': 3} for result in gathered.results))
+
+    def test_coalesced_search(self):
+        ''' Test identical concurrent searches share a response. '''
+        query = ElasticQuery(Query.term("id", "rs768019142"))
+        coalescer = ElasticUrl.get_pool().coalescer
+        before = coalescer.as_dict()
+        gathered = gather([Search(query, idx=ElasticSettings.idx('DEFAULT')).get_json_response
+                           for _ in range(5)])
+        after = coalescer.as_dict()
+        self.assertEqual(after['calls'] + after['coalesced'] - before['calls'] - before['coalesced'], 5)
+        self.assertTrue(all(resp['hits'] == gathered.results[0]['hits'] for resp in gathered.results))
+        hits = copy.deepcopy(gathered.results[1]['hits'])
+        gathered.results[0]['hits']['hits'] = []
+        self.assertEqual(gathered.results[1]['hits'], hits, 'callers do not share the decoded JSON')
+        self.assertTrue(Search.is_coalesced('test_idx/_search', 'POST', '{}'))
+        self.assertFalse(Search.is_coalesced('_search/scroll?scroll=1m', 'POST', 'scroll_id'))
+        self.assertFalse(Search.is_coalesced('test_idx/gene/1/_update', 'POST', '{}'))
+        self.assertFalse(Search.is_coalesced('test_search_idx/gene/_bulk', 'POST', '{}'))
+        self.assertFalse(Search.is_coalesced('test_idx/_refresh', 'POST', None))
+        self.assertFalse(Search.is_coalesced('_nodes/http', 'GET', None))
+        self.assertTrue(Search.is_coalesced('test_idx/_mapping', 'GET', None))
+
+
 @override_settings(ELASTIC=OVERRIDE_SETTINGS)
 class ElasticModelTest(TestCase):
 
@@ -246,6 +433,92 @@ class ElasticModelTest(TestCase):
                                              idx=IDX['GFF_GENERIC']['indexName'], field_list=['start', 'end'])
         self.assertEquals(len(elastic.search().docs), 4)
 
+    def test_binned_range_query(self):
+        ''' Test range overlap queries filtering on the genomic bins. '''
+        self.assertEqual(Binning.bin_from_range(1, 100), 585)
+        self.assertEqual(Binning.bin_from_range(1, 2**30), Binning.OFFSET_OLD_TO_EXTENDED)
+        self.assertIn(Binning.bin_from_range(10000, 20000), Binning.overlapping_bins(20000, 30000))
+        self.assertNotIn(Binning.bin_from_range(10000, 20000), Binning.overlapping_bins(200000, 300000))
+
+        idx = IDX['GFF_GENERIC']['indexName']
+        for (start, end) in ((1, 20000), (10000, 2000000), (1, 206770620)):
+            binned = Search.range_overlap_query(seqid='chr1', start_range=start, end_range=end, idx=idx,
+                                                bin_param=True)
+            unbinned = Search.range_overlap_query(seqid='chr1', start_range=start, end_range=end, idx=idx)
+            self.assertEqual(sorted(d.doc_id() for d in binned.search().docs),
+                             sorted(d.doc_id() for d in unbinned.search().docs))
+        self.assertNotIn('"bin"', json.dumps(binned.query), 'too many bins for the region')
+        self.assertNotIn('"bin"', json.dumps(unbinned.query), 'bins not used by default')
+        search = Search.range_overlap_query('chr1', 1, 20000, idx=idx, bin_param=True)
+        self.assertIn('"bin"', json.dumps(search.query))
+
+    def test_interval_cache(self):
+        ''' Test overlap and point queries answered from the interval cache. '''
+        idx = IDX['GFF_GENERIC']['indexName']
+        for (start, end) in ((1, 20000), (10000, 2000000), (1, 206770620)):
+            docs = IntervalCache.overlap(idx, 'chr1', start, end)
+            search = Search.range_overlap_query('chr1', start, end, idx=idx, size=1000)
+            self.assertEqual(sorted(d.doc_id() for d in docs), sorted(d.doc_id() for d in search.search().docs))
+        doc = docs[0]
+        self.assertIn(doc.doc_id(), [d.doc_id() for d in IntervalCache.point(idx, 'chr1', doc.start)])
+        self.assertEqual(IntervalCache.overlap(idx, 'chrX', 1, 10), [])
+
+        index = IntervalIndex(IntervalIndex.build([('1', 10, 20, 'a'), ('1', 15, 15, 'b'), ('2', 1, 100, 'c')]))
+        self.assertEqual(index.overlap('1', 12, 15), ['a', 'b'])
+        self.assertEqual(index.point('1', 16), ['a'])
+        self.assertEqual(index.point('1', 21), [])
+
+    def test_range_overlap_batch(self):
+        ''' Test finding the documents overlapping a list of intervals in one request. '''
+        self.assertEqual(ElasticUtils.merge_intervals([('chr1', 100, 200), ('chr2', 1, 5), ('chr1', 201, 300)]),
+                         [('chr1', 100, 300, [0, 2]), ('chr2', 1, 5, [1])])
+        idx = IDX['GFF_GENERIC']['indexName']
+        intervals = [('chr1', 1, 20000), ('chr1', 10000, 206770620), ('chr2', 1, 1000), ('chr1', 1, 206770620)]
+        for named_queries in (False, True):
+            batch = ElasticUtils.range_overlap_batch(intervals, idx, named_queries=named_queries, bin_param=True)
+            self.assertEqual(len(batch), len(intervals))
+            for (docs, (seqid, start, end)) in zip(batch, intervals):
+                search = Search.range_overlap_query(seqid, start, end, idx=idx, size=1000)
+                self.assertEqual(sorted(d.doc_id() for d in docs),
+                                 sorted(d.doc_id() for d in search.search().docs))
+        self.assertEqual(len(batch[3]), 4)
+        self.assertEqual([[d.doc_id() for d in docs] for docs in
+                          ElasticUtils.range_overlap_batch(intervals, idx, size=1, named_queries=True)],
+                         [[d.doc_id() for d in docs] for docs in
+                          ElasticUtils.range_overlap_batch(intervals, idx, size=1)], 'hits over size')
+        self.assertEqual([len(docs) for docs in
+                          ElasticUtils.range_overlap_batch(intervals, idx, size=ElasticUtils.MAX_RESULT_WINDOW,
+                                                           named_queries=True)],
+                         [len(docs) for docs in batch], 'size over the result window')
+        for named_queries in (False, True):
+            self.assertRaises(QueryError, ElasticUtils.range_overlap_batch, intervals, 'missing_idx_' + SEARCH_SUFFIX,
+                              named_queries=named_queries)
+            # markers have no end field
+            batch = ElasticUtils.range_overlap_batch([('1', 10000, 10030), ('1', 10050, 10060)],
+                                                     ElasticSettings.idx('DEFAULT'), named_queries=named_queries)
+            self.assertEqual([[getattr(d, 'id') for d in docs] for docs in batch], [['rs775809821'], ['rs768019142']])
+
+        query = ElasticQuery(Query.term("id", "rs2476601"))
+        results = MultiSearch([Search(query, idx=ElasticSettings.idx('DEFAULT')), Search(idx=idx, size=1)]).search()
+        self.assertEqual(results[0].hits_total, 1)
+        self.assertEqual(len(results[1].docs), 1)
+
+    def test_search_columns(self):
+        ''' Test returning the hits as columns of field values. '''
+        elastic = Search.range_overlap_query(seqid='chr1', start_range=1, end_range=206770620,
+                                             idx=IDX['GFF_GENERIC']['indexName'], size=100)
+        columns = elastic.search_columns(['seqid', 'start', 'end'])
+        self.assertEquals(len(columns), 4)
+        self.assertEquals(columns['start'].dtype.kind, 'i', 'start is an integer column')
+        self.assertTrue(all(columns['end'] >= columns['start']))
+        self.assertTrue(all(s == 'chr1' for s in columns['seqid']))
+        (seqids, codes) = columns.categorical('seqid')
+        self.assertEquals(len(seqids), 1)
+        self.assertEquals(len(codes), 4)
+
+        columns = Search(idx=IDX['GFF_GENERIC']['indexName']).search_columns(['start'], scroll=True)
+        self.assertEquals(len(columns), ElasticUtils.get_docs_count(IDX['GFF_GENERIC']['indexName'], ''))
+
     def test_sort_query(self):
         ''' Test sorting for a query. '''
         query = ElasticQuery(Query.match_all())
@@ -489,6 +762,186 @@ class ElasticModelTest(TestCase):
         elastic = Search(idx=ElasticSettings.idx('DEFAULT'))
         self.assertTrue(elastic.get_count()['count'] > 1, "Elastic count documents in an index")
 
+    def test_filter_path_and_sources(self):
+        ''' Test response filtering and source filtering. '''
+        query = ElasticQuery(Query.term("id", "rs768019142"))
+        elastic = Search(query, idx=ElasticSettings.idx('DEFAULT'), sources=['id'],
+                         filter_path='hits.hits._id,hits.hits._source')
+        result = elastic.search()
+        self.assertEqual(len(result.docs), 1)
+        self.assertEqual(getattr(result.docs[0], 'id'), 'rs768019142')
+        self.assertIsNone(getattr(result.docs[0], 'seqid'), 'seqid filtered from source')
+        self.assertIsNone(result.hits_total, 'total filtered from response')
+        self.assertFalse('_source' in query.query, 'search query not modified')
+        self.assertEqual(Search(query, idx=ElasticSettings.idx('DEFAULT')).get_count(filter_path='count'),
+                         {'count': 1})
+
+    def test_frozen_query(self):
+        ''' Test a frozen query can be reused and is not changed by searches. '''
+        query = ElasticQuery(BoolQuery(must_arr=[Query.term("id", "rs768019142")])).freeze()
+        same = ElasticQuery(BoolQuery(must_arr=[Query.term("id", "rs768019142")])).freeze()
+        self.assertEqual(hash(query.query), hash(same.query))
+        self.assertEqual({query.query: 1}[same.query], 1, 'usable as a cache key')
+        self.assertIs(codec.dumps(query.query), codec.dumps(query.query), 'JSON encoding cached')
+        self.assertRaises(TypeError, query.query.update, {'size': 1})
+
+        aggs = Aggs(Agg("test_seqid", "terms", {"field": "seqid"})).freeze()
+        for _ in range(2):
+            result = Search(query, aggs=aggs, idx=ElasticSettings.idx('DEFAULT')).search()
+            self.assertEqual(result.hits_total, 1)
+            self.assertTrue('test_seqid' in result.aggs)
+        self.assertFalse('aggregations' in query.query)
+
+        match_all = Query.match_all()
+        ElasticQuery.filtered(match_all, TermsFilter.get_terms_filter("id", ["rs768019142"]))
+        self.assertEqual(match_all.query, {"match_all": {}}, 'filtered query does not wrap the callers query')
+
+    def test_query_optimizer(self):
+        ''' Test optimizing queries moves clauses to the filter context and flattens bools. '''
+        query = ElasticQuery.filtered_bool(Query.match_all(),
+                                           BoolQuery(must_arr=[Query.term("seqid", "1"),
+                                                               RangeQuery("start", gte=10054)]))
+        optimized = QueryOptimizer.optimize(query.query)
+        self.assertEqual(optimized['query'], {"bool": {"filter": [{"term": {"seqid": "1"}},
+                                                                  {"range": {"start": {"gte": 10054}}}]}})
+        self.assertIs(QueryOptimizer.optimize(optimized), optimized, 'already optimized')
+        must_not = [{"term": {"seqid": "1"}}]
+        for (body, expected) in (({"bool": {"must": [{"match_all": {}}], "must_not": must_not}},
+                                  {"bool": {"must_not": must_not}}),
+                                 ({"bool": {"must": [{"match_all": {}}, {"match_all": {}}]}}, {"match_all": {}}),
+                                 ({"bool": {"must": [{"match_all": {}}], "filter": [{"match_all": {}}]}},
+                                  {"match_all": {}})):
+            self.assertEqual(QueryOptimizer.optimize({"query": body})['query'], expected)
+
+        query = ElasticQuery(BoolQuery(must_arr=[BoolQuery(must_arr=[Query.term("seqid", "1")]),
+                                                 Query.term("id", {"value": "rs2476601", "boost": 2})],
+                                       must_not_arr=[Query.term("id", "rs1"), Query.term("id", "rs2")]))
+        optimized = QueryOptimizer.optimize(query.query)
+        self.assertEqual(optimized['query']['bool']['filter'], [{"term": {"seqid": "1"}}])
+        self.assertEqual(len(optimized['query']['bool']['must']), 1, 'boosted term is scored')
+        self.assertEqual(optimized['query']['bool']['must_not'], [{"terms": {"id": ["rs1", "rs2"]}}])
+
+        # should clauses stay optional when the must/filter clauses are optimized away
+        should = [{"match": {"id": "rs2476601"}}]
+        body = {"query": {"bool": {"must": [{"bool": {"must_not": [{"term": {"seqid": "1"}}]}}],
+                                   "should": should}}}
+        self.assertEqual(QueryOptimizer.optimize(body)['query'],
+                         {"bool": {"filter": [{"match_all": {}}], "should": should,
+                                   "must_not": [{"term": {"seqid": "1"}}]}})
+        body = {"query": {"bool": {"filter": [{"match_all": {}}, {"match_all": {}}], "should": should}}}
+        self.assertEqual(QueryOptimizer.optimize(body)['query'],
+                         {"bool": {"filter": [{"match_all": {}}], "should": should}})
+        idx = ElasticSettings.idx('DEFAULT')
+        for body in (body, {"query": {"bool": {"must": [{"bool": {"must_not": [{"term": {"seqid": "1"}}]}}],
+                                               "should": [{"term": {"id": "rs2476601"}}]}}}):
+            self.assertEqual(Search.elastic_request(ElasticSettings.url(), idx + '/_count',
+                                                    data=json.dumps(QueryOptimizer.optimize(body))).json()['count'],
+                             Search.elastic_request(ElasticSettings.url(), idx + '/_count',
+                                                    data=json.dumps(body)).json()['count'])
+
+        query = ElasticQuery.filtered(Query.match_all(),
+                                      OrFilter(Query.term("id", "rs2476601")).extend(Query.term("id", "rs768019142")))
+        idx = ElasticSettings.idx('DEFAULT')
+        self.assertEqual(Search(query, idx=idx, optimize=True).search().hits_total,
+                         Search(query, idx=idx).search().hits_total)
+
+    def test_query_validation(self):
+        ''' Test validating queries against the cached index mapping. '''
+        mapping = IndexMapping({"idx": {"mappings": {"gene": {"properties": {
+            "symbol": {"type": "string", "fields": {"raw": {"type": "string", "index": "not_analyzed"}}},
+            "featureloc": {"properties": {"start": {"type": "integer"}}}}}}}})
+        self.assertTrue(mapping.is_analyzed("symbol"))
+        self.assertFalse(mapping.is_analyzed("symbol.raw"))
+        self.assertEqual(mapping.field_type("featureloc.start", "gene"), "integer")
+        self.assertIsNone(mapping.field("start"))
+
+        idx = ElasticSettings.idx('DEFAULT')
+        query = ElasticQuery(Query.term("id", "rs2476601"))
+        self.assertIs(MappingCache.get(idx), MappingCache.get(idx), 'mapping cached')
+        if ElasticSettings.version()['major'] >= 5:
+            self.assertIsNotNone(MappingCache._version(idx + '/marker', 'default'), 'version of an idx/type')
+        self.assertIsNone(MappingCache.get('missing_idx_' + SEARCH_SUFFIX))
+        self.assertIn(('default', 'missing_idx_' + SEARCH_SUFFIX), MappingCache._mappings, 'missing index cached')
+        MappingCache.invalidate(idx)
+        MappingCache.get(idx + '/marker')
+        MappingCache.invalidate(idx)
+        self.assertNotIn(('default', idx + '/marker'), MappingCache._mappings)
+        self.assertEqual(QueryValidator.errors(query.query, idx), [])
+        self.assertEqual(Search(query, idx=idx, validate=True).search().hits_total, 1)
+
+        query = ElasticQuery(BoolQuery(must_arr=[Query.term("idx", "rs2476601"), RangeQuery("id", gte="rs1")]))
+        errors = QueryValidator.errors(query.query, idx)
+        self.assertIn("unknown field idx", errors)
+        self.assertIn("range query on string field id", errors)
+        self.assertRaises(QueryError, Search, query, idx=idx, validate=True)
+
+    def test_search_stream(self):
+        ''' Test streaming the search hits gives the same documents and aggregations. '''
+        aggs = Aggs(Agg("test_seqid", "terms", {"field": "seqid"}))
+        search = Search(ElasticQuery(Query.match_all()), aggs=aggs, idx=ElasticSettings.idx('DEFAULT'), size=500)
+        result = search.search()
+        streamed = search.search(stream=True)
+        self.assertEqual(streamed.hits_total, result.hits_total)
+        self.assertIsNone(streamed.aggs, 'aggregations follow the hits')
+        self.assertEqual([doc.__dict__ for doc in streamed.docs], [doc.__dict__ for doc in result.docs])
+        self.assertEqual(streamed.aggs['test_seqid'].get_buckets(), result.aggs['test_seqid'].get_buckets())
+
+    def test_hit_stream(self):
+        ''' Test parsing a response split into small chunks. '''
+        response = {"took": 1, "hits": {"total": 2, "hits": [{"_id": "1", "_source": {"name": "\u03b1 [\\\"}"}},
+                                                             {"_id": "2", "_source": {"start": 10054}}]},
+                    "aggregations": {"seqid": {"value": 1.5}}}
+        content = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        sizes = []
+        hit_stream = HitStream((content[i:i+3] for i in range(0, len(content), 3)), on_close=sizes.append)
+        self.assertEqual(hit_stream.read_meta()['hits']['total'], 2)
+        self.assertEqual(list(hit_stream), response['hits']['hits'])
+        self.assertEqual(hit_stream.meta['aggregations'], response['aggregations'])
+        self.assertEqual(sizes, [len(content)])
+        self.assertRaises(ValueError, list, HitStream([content[:-10]]))
+
+    def test_exists(self):
+        ''' Test checking for any matching documents. '''
+        idx = ElasticSettings.idx('DEFAULT')
+        self.assertTrue(Search(ElasticQuery(Query.term("id", "rs768019142")), idx=idx).exists())
+        self.assertFalse(Search(ElasticQuery(Query.term("id", "rsXYZ")), idx=idx).exists())
+        self.assertTrue(ElasticUtils.docs_exist(idx, ''))
+
+    def test_terminate_after(self):
+        ''' Test the hits total is reported as a lower bound when terminated early. '''
+        result = Search(ElasticQuery(Query.match_all()), idx=ElasticSettings.idx('DEFAULT'),
+                        terminate_after=1).search()
+        self.assertEqual(result.hits_total_relation, 'gte')
+        self.assertEqual(result.hits_total_str(), '≥' + str(result.hits_total))
+
+    def test_deadline(self):
+        ''' Test the deadline is sent as the search timeout and partial results are reported. '''
+        elastic = Search(ElasticQuery(Query.match_all()), idx=ElasticSettings.idx('DEFAULT'), deadline=0.5)
+        self.assertEqual(elastic.query['timeout'], '500ms')
+        result = elastic.search()
+        self.assertFalse(result.is_partial())
+        self.assertEqual(result.shards['failed'], 0)
+        self.assertGreater(elastic.get_count()['count'], 0)
+        self.assertTrue(Result(timed_out=True).is_partial())
+        self.assertTrue(Result(shards={'total': 2, 'successful': 1, 'failed': 1}).is_partial())
+
+    def test_http_compress(self):
+        ''' Test gzip compressing request bodies over the size threshold. '''
+        compress_settings = copy.deepcopy(OVERRIDE_SETTINGS)
+        compress_settings['default'].update({'HTTP_COMPRESS': True, 'HTTP_COMPRESS_MIN_SIZE': 1024})
+        with override_settings(ELASTIC=compress_settings):
+            (_body, headers, _size) = Search.encode_body('{"query": {"match_all": {}}}')
+            self.assertEqual(headers, {'Accept-Encoding': 'gzip'}, 'small body not compressed')
+
+            stats = ElasticUrl.get_pool().stats
+            before = stats.as_dict()
+            ids = ['rs' + str(i) for i in range(2000)] + ['rs768019142']
+            query = ElasticQuery.filtered(Query.match_all(), TermsFilter.get_terms_filter("id", ids))
+            self.assertEqual(Search(query, idx=ElasticSettings.idx('DEFAULT')).search().hits_total, 1)
+            after = stats.as_dict()
+            self.assertLess(after['request_wire_bytes'] - before['request_wire_bytes'],
+                            (after['request_bytes'] - before['request_bytes']) / 2)
+
     def test_count_with_query(self):
         ''' Test count the number of documents returned by a query. '''
         query = ElasticQuery(Query.term("id", "rs768019142"))
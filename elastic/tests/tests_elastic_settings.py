@@ -1,6 +1,7 @@
 from django.test import TestCase
 from elastic.elastic_settings import ElasticSettings, ElasticUrl
-from elastic.exceptions import SettingsError
+from elastic.exceptions import SettingsError, NodeUnavailableError
+from elastic.nodes import NodePool, Sniffer
 from django.test.utils import override_settings
 from elastic.tests.settings_idx import OVERRIDE_SETTINGS, OVERRIDE_SETTINGS2, OVERRIDE_SETTINGS3,\
     IDX
@@ -9,6 +10,8 @@ from elastic.search import Search, ElasticQuery
 import requests
 from elastic.query import Query, Filter
 import json
+import threading
+import time
 
 
 @override_settings(ELASTIC=OVERRIDE_SETTINGS)
@@ -63,4 +66,187 @@ class ElasticSettingsTest(TestCase):
         elastic = Search(query, idx=ElasticSettings.idx('DEFAULT'))
         self.assertTrue(elastic.search().hits_total == 1, "Elastic filtered query retrieved marker")
         Search.index_exists('test', 'test2')
-        ElasticUrl.URL_INDEX = 0  # reset
+        pool = ElasticUrl.get_pool()
+        self.assertGreater(pool.get('http://xxx:9200/').failures, 0, 'failed node marked dead')
+        self.assertNotEqual(ElasticUrl.get_url(), 'http://xxx:9200/')
+        ElasticUrl.reset()
+
+
+class NodePoolTest(TestCase):
+
+    def test_round_robin(self):
+        ''' Test nodes are selected in turn and dead nodes are skipped. '''
+        pool = NodePool(['http://a:9200', 'http://b:9200', 'http://c:9200'])
+        self.assertEqual(len(set(pool.get_node().url for _ in range(3))), 3)
+        pool.mark_dead(pool.get('http://b:9200'))
+        self.assertFalse('http://b:9200' in [pool.get_node().url for _ in range(4)])
+        self.assertEqual(pool.get_node(exclude=[pool.get('http://a:9200')]).url, 'http://c:9200')
+
+    def test_dead_timeout(self):
+        ''' Test the dead timeout increases exponentially and the node is resurrected. '''
+        pool = NodePool(['http://a:9200', 'http://b:9200'], dead_timeout=10, max_dead_timeout=30)
+        node = pool.get('http://a:9200')
+        for _ in range(3):
+            pool.mark_dead(node)
+        self.assertAlmostEqual(node.dead_until - time.time(), 30, delta=1)
+        self.assertFalse(node.is_alive())
+        self.assertTrue(node.is_alive(now=node.dead_until))
+
+        # all nodes dead so the node due to be resurrected first is used
+        pool.mark_dead(pool.get('http://b:9200'))
+        self.assertEqual(pool.get_node().url, 'http://b:9200')
+        pool.mark_live(node, latency=0.1)
+        self.assertEqual(node.failures, 0)
+        self.assertTrue(node.is_alive())
+
+    def test_least_latency(self):
+        ''' Test the node with the lowest latency (EWMA) is selected. '''
+        pool = NodePool(['http://a:9200', 'http://b:9200'], selector=NodePool.LEAST_LATENCY, ewma_alpha=0.5)
+        pool.mark_live(pool.get('http://a:9200'), latency=0.2)
+        self.assertEqual(pool.get_node().url, 'http://b:9200', 'untried node selected')
+        pool.mark_live(pool.get('http://b:9200'), latency=0.1)
+        self.assertEqual(pool.get_node().url, 'http://b:9200')
+        pool.mark_live(pool.get('http://b:9200'), latency=0.5)
+        self.assertAlmostEqual(pool.get('http://b:9200').latency, 0.3)
+        self.assertEqual(pool.get_node().url, 'http://a:9200')
+        self.assertRaises(ValueError, NodePool, ['http://a:9200'], selector='random')
+
+    def test_parse_nodes(self):
+        ''' Test getting the node urls from a _nodes/http response and excluding master-only nodes. '''
+        resp_json = {'nodes': {
+            'n1': {'roles': ['master', 'data'], 'http': {'publish_address': '10.0.0.1:9200'}},
+            'n2': {'roles': ['master'], 'http': {'publish_address': '10.0.0.2:9200'}},
+            'n3': {'attributes': {'data': 'false', 'master': 'true'}, 'http': {'publish_address': '10.0.0.3:9200'}},
+            'n4': {'attributes': {}, 'http': {'publish_address': 'inet[/10.0.0.4:9200]'}},
+            'n5': {'roles': ['data', 'ingest'], 'http': {'publish_address': 'es5.local/10.0.0.5:9200'}},
+            'n6': {'roles': ['data']}}}
+        self.assertEqual(Sniffer.parse_nodes(resp_json, node_filter=Sniffer.is_not_master_only),
+                         ['http://10.0.0.1:9200', 'http://10.0.0.4:9200', 'http://es5.local:9200'])
+        self.assertEqual(len(Sniffer.parse_nodes(resp_json, scheme='https')), 5)
+
+        pool = NodePool(['http://10.0.0.1:9200', 'http://10.0.0.9:9200'])
+        pool.mark_dead(pool.get('http://10.0.0.1:9200'))
+        pool.set_urls(Sniffer.parse_nodes(resp_json, node_filter=Sniffer.is_not_master_only))
+        self.assertEqual(len(pool.nodes), 3)
+        self.assertEqual(pool.get('http://10.0.0.1:9200').failures, 1, 'node health state kept')
+
+    @override_settings(ELASTIC=OVERRIDE_SETTINGS)
+    def test_sniff(self):
+        ''' Test sniffing the nodes of the cluster. '''
+        pool = NodePool([ElasticSettings.url()])
+        Sniffer(pool).sniff()
+        self.assertGreaterEqual(len(pool.nodes), 1)
+        resp = requests.get(pool.get_node().url + '/_cluster/health')
+        self.assertEqual(resp.status_code, 200)
+
+    @override_settings(ELASTIC={'default': {'ELASTIC_URL': 'http://127.0.0.1:1', 'SNIFF_ON_START': True,
+                                            'SNIFF_INTERVAL': 60}})
+    def test_sniff_on_request(self):
+        ''' Test the nodes are sniffed before the first request, not when the pool is
+        created, and then periodically in a background thread. '''
+        ElasticUrl.reset()
+        try:
+            sniffer = ElasticUrl.get_pool().sniffer
+            self.assertEqual(ElasticSettings.url(), 'http://127.0.0.1:1')
+            self.assertIsNone(sniffer.last_sniff, 'not sniffed when the pool is created')
+            self.assertTrue(sniffer.is_due())
+            sniffer.maybe_sniff()
+            self.assertIsNone(sniffer.thread, 'first sniff made by the request')
+            self.assertFalse(sniffer.is_due())
+
+            sniffer.last_sniff = time.time() - 61
+            sniffer.maybe_sniff()
+            self.assertFalse(sniffer.is_due())
+            sniffer.thread.join()
+        finally:
+            ElasticUrl.reset()
+
+    def test_circuit_breaker(self):
+        ''' Test the circuit opens after repeated failures and half-opens for a single probe. '''
+        pool = NodePool(['http://a:9200'], failure_threshold=2)
+        node = pool.get('http://a:9200')
+        pool.mark_dead(node)
+        self.assertEqual(pool.get_node(), node, 'below threshold a dead node is still tried')
+        pool.mark_dead(node)
+        self.assertFalse(pool.is_available(node))
+        self.assertRaises(NodeUnavailableError, pool.get_node)
+
+        node.dead_until = time.time() - 1   # half-open
+        self.assertEqual(pool.get_node(), node)
+        self.assertFalse(node.probing, 'selecting a node does not claim the probe')
+        self.assertEqual(pool.get_node(claim=True), node, 'probe request')
+        self.assertTrue(pool.claim(node), 'the probe can be sent by the thread that claimed it')
+        other = []
+        thread = threading.Thread(target=lambda: other.append((pool.claim(node), pool.is_available(node))))
+        thread.start()
+        thread.join()
+        self.assertEqual(other, [(False, False)], 'one probe at a time')
+        pool.mark_live(node)
+        self.assertTrue(pool.is_available(node))
+        self.assertEqual(pool.get_node(), node)
+
+    @override_settings(ELASTIC=OVERRIDE_SETTINGS)
+    def test_circuit_breaker_request(self):
+        ''' Test requests through a tripped, half-open and recovered node. '''
+        ElasticUrl.reset()
+        try:
+            pool = ElasticUrl.get_pool()
+            pool.failure_threshold = 1
+            node = pool.nodes[0]
+            pool.mark_dead(node)
+            self.assertRaises(NodeUnavailableError, ElasticSettings.url)
+
+            # half-open, the request that claims the probe is sent to the node
+            node.dead_until = time.time() - 1
+            url = ElasticSettings.url()
+            self.assertFalse(node.probing, 'getting the url does not claim the probe')
+            resp = Search.elastic_request(url, '_cluster/health', is_post=False)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(node.failures, 0, 'circuit closed')
+            self.assertFalse(node.probing)
+            self.assertEqual(ElasticSettings.url(), node.url)
+
+            # a probe that raises an exception is released for the next request
+            pool.mark_dead(node)
+            node.dead_until = time.time() - 1
+            url = ElasticSettings.url()
+            self.assertRaises(TypeError, Search.elastic_request, url, '_cluster/health', data=object())
+            self.assertFalse(node.probing, 'probe released after an exception')
+            self.assertEqual(ElasticSettings.url(), node.url)
+            Search.elastic_request(node.url, '_cluster/health', is_post=False)
+            self.assertEqual(node.failures, 0)
+        finally:
+            ElasticUrl.reset()
+
+    @override_settings(ELASTIC={'default': {'ELASTIC_URL': 'http://a:9200',
+                                            'TIMEOUTS': {'search': (2, 10), 'bulk': 60}}})
+    def test_timeouts(self):
+        ''' Test the connect and read timeouts for each type of call. '''
+        self.assertEqual(ElasticSettings.timeout(), (2, 10))
+        self.assertEqual(ElasticSettings.timeout('bulk'), (60, 60))
+        self.assertEqual(ElasticSettings.timeout('admin'), ElasticSettings.DEFAULT_TIMEOUTS['admin'])
+        self.assertRaises(SettingsError, ElasticSettings.timeout, 'xyz')
+
+    def test_idempotent(self):
+        ''' Test which requests are retried on another node. '''
+        self.assertTrue(Search.is_idempotent('idx/_search?size=1'))
+        self.assertTrue(Search.is_idempotent('idx/_mapping', method='GET'))
+        self.assertFalse(Search.is_idempotent('idx/type/_bulk', method='PUT'))
+        self.assertFalse(Search.is_idempotent('idx/type/1/_update'))
+        self.assertFalse(Search.is_idempotent('_search/scroll?scroll=1m'))
+        self.assertTrue(Search.is_idempotent('idx/type/_search?scroll=1m'))
+        self.assertTrue(Search.is_idempotent('_nodes/http'))
+        self.assertFalse(Search.is_idempotent('my_search_idx/type/1/_update'))
+        self.assertFalse(Search.is_idempotent('idx/type/_search/_update'))
+        self.assertFalse(Search.is_idempotent('idx_count/type/_bulk'))
+
+    def test_unsent(self):
+        ''' Test connection errors raised before a request is sent are identified. '''
+        try:
+            requests.post('http://127.0.0.1:1/idx/type/_bulk', data='{}', timeout=2)
+            self.fail('connection refused')
+        except requests.exceptions.ConnectionError as e:
+            self.assertTrue(Search.is_unsent(e))
+        self.assertTrue(Search.is_unsent(requests.exceptions.ConnectTimeout()))
+        self.assertFalse(Search.is_unsent(requests.exceptions.ConnectionError(
+            ConnectionResetError('Connection reset by peer'))))
@@ -4,13 +4,24 @@ from django.test import TestCase
 from django.core.management import call_command
 from elastic.tests.settings_idx import IDX, IDX_UPDATE
 import requests
-from elastic.management.loaders.utils import GFF, GFFError
+from elastic.management.loaders.utils import GFF, GFFError, VCFInfo
 from elastic.elastic_settings import ElasticSettings
 from elastic.management.snapshot import Snapshot
-from elastic.search import Search
+from elastic.search import Search, ScanAndScroll, ElasticQuery
+from elastic.query import Query, RangeQuery, Filter
+import gzip
+import io
+import json
+import os
+import tempfile
 import time
 import logging
 from elastic.management.loaders.loader import Loader
+from elastic.management.loaders.bed import BEDManager
+from elastic.management.loaders.gene_target import GeneTargetManager
+from elastic.management.loaders.gff import GFFManager
+from elastic.management.loaders.incremental import IncrementalLoad
+from elastic.management.loaders.marker import MarkerManager
 from elastic.management.loaders.exceptions import LoaderError, MappingError
 from elastic.management.loaders.mapping import MappingProperties
 
@@ -104,6 +115,17 @@ class SnapshotTest(TestCase):
 
 class ElasticLoadersTest(TestCase):
 
+    def load_copy(self, idx_key, suffix, loads=1, **options):
+        ''' Load a copy of a test index with the options, the given number of times,
+        and return its name. The index is deleted after the test. '''
+        idx_kwargs = dict(IDX[idx_key], indexName=IDX[idx_key]['indexName'] + suffix, **options)
+        idx = idx_kwargs['indexName']
+        self.addCleanup(requests.delete, ElasticSettings.url() + '/' + idx)
+        for _ in range(loads):
+            call_command('index_search', **idx_kwargs)
+            Search.index_refresh(idx)
+        return idx
+
     def test_idx_loader(self):
         ''' Test loader has created and populated indices.  '''
         for key in IDX:
@@ -137,7 +159,171 @@ class ElasticLoadersTest(TestCase):
         gff = GFF(line, key_value_delim=' ')
         attrs = gff.getAttributes()
         self.assertTrue('gene_id' in attrs, "GFF attributes parse")
+        self.assertEqual(attrs['gene_id'], 'ENSG00000269981', "GTF quotes removed")
+        attrs = GFF.parse_attributes('gene_id "ENSG1"; level 2; note "a;b"; tag "basic"; tag "CCDS";',
+                                     key_value_delim=' ')
+        self.assertEqual(attrs, {'gene_id': 'ENSG1', 'level': '2', 'note': 'a;b', 'tag': ['basic', 'CCDS']})
+        attrs = GFF.parse_attributes('ID=x;Name=rs1;Note="a;b";flag', keys={'Name', 'Note'})
+        self.assertEqual(attrs, {'Name': 'rs1', 'Note': 'a;b'})
 
         # check for gff errors
         line = "chr22\tt1dbase\tvariant\t37191071\t37191071\t.\t+\t."
         self.assertRaises(GFFError, GFF, line=line)
+
+    def test_doc_ids(self):
+        ''' Test natural key and hash document IDs make reloading idempotent. '''
+        loader = GFFManager()
+        doc = {"seqid": "chr1", "start": 10, "end": 20, "type": "gene", "attr": {"ID": "a"}}
+        self.assertEqual(loader.doc_id(doc, loader.get_id_strategy(docId='key'), 1), 'chr1:10:20:gene')
+        self.assertEqual(loader.doc_id(doc, loader.get_id_strategy(docId='seqid,attr.ID'), 1), 'chr1:a')
+        self.assertIsNone(loader.doc_id(doc, loader.get_id_strategy(docId='name'), 1))
+        self.assertEqual(loader.doc_id(doc, 'hash', 1), loader.doc_id(dict(reversed(list(doc.items()))), 'hash', 2))
+        self.assertRaises(LoaderError, Loader().get_id_strategy, docId='key')
+
+        idx = self.load_copy('BED_GENERIC', '_ids', loads=2, docId='key')
+        self.assertEqual(Search(idx=idx).get_count()['count'],
+                         Search(idx=IDX['BED_GENERIC']['indexName']).get_count()['count'])
+
+    def test_incremental_load(self):
+        ''' Test an incremental reload only sends changed documents and deletes missing ones. '''
+        self.assertRaises(LoaderError, GFFManager().get_incremental, 'idx', 'gff', incremental=True)
+
+        idx = self.load_copy('BED_GENERIC', '_inc', loads=2, docId='key', incremental=True)
+        count = Search(idx=idx).get_count()['count']
+        self.assertEqual(count, Search(idx=IDX['BED_GENERIC']['indexName']).get_count()['count'])
+        doc = Search(idx=idx, size=1).search().docs[0]
+        self.assertEqual(len(getattr(doc, IncrementalLoad.HASH_FIELD)), 40)
+
+        incremental = IncrementalLoad(idx, 'bed')
+        self.assertEqual(len(incremental.previous), count)
+        hits = list(ScanAndScroll.docs(idx, idx_type='bed', obj_document=lambda hit: hit))
+        for hit in hits[1:]:
+            del hit['_source'][IncrementalLoad.HASH_FIELD]
+            self.assertFalse(incremental.is_changed(hit['_id'], hit['_source']))
+        counts = incremental.finish(BEDManager().bulk_load)
+        self.assertEqual(counts['unchanged'], count - 1)
+        self.assertEqual(counts['deleted'], 1)
+        Search.index_refresh(idx)
+        self.assertEqual(Search(idx=idx).get_count()['count'], count - 1)
+
+    def test_incremental_hash_file(self):
+        ''' Test an incremental reload with a hash file and bulk requests that fail. '''
+        with tempfile.TemporaryDirectory() as hash_dir:
+            idx = self.load_copy('BED_GENERIC', '_hashes', loads=2, docId='key', incremental=True,
+                                 hashDir=hash_dir)
+            hash_file = os.path.join(hash_dir, idx + '.bed.hashes.gz')
+            count = Search(idx=idx).get_count()['count']
+            self.assertEqual(count, Search(idx=IDX['BED_GENERIC']['indexName']).get_count()['count'])
+            previous = IncrementalLoad(idx, 'bed', hash_file=hash_file).previous
+            self.assertEqual(len(previous), count)
+            ids = sorted(previous)
+
+            # a failed bulk request, the hash file is not updated
+            incremental = IncrementalLoad(idx, 'bed', hash_file=hash_file)
+            for idx_id in ids[1:]:
+                incremental.is_changed(idx_id, {"name": idx_id})
+            counts = incremental.finish(lambda idx_name, idx_type, json_data: None)
+            self.assertEqual(counts['deleted'], 1)
+            self.assertEqual(IncrementalLoad(idx, 'bed', hash_file=hash_file).previous, previous)
+
+            # failed documents keep the hash of the document in the index
+            incremental = IncrementalLoad(idx, 'bed', hash_file=hash_file)
+            bulk_load = incremental.track(lambda idx_name, idx_type, json_data: set([ids[1]]))
+            for idx_id in ids[1:] + ['new']:
+                incremental.is_changed(idx_id, {"name": idx_id})
+            bulk_load(idx, 'bed', b'')
+            incremental.failed(['new'])
+            counts = incremental.finish(lambda idx_name, idx_type, json_data: set([ids[0]]))
+            self.assertEqual(counts['failed'], 3)
+            hashes = IncrementalLoad(idx, 'bed', hash_file=hash_file).previous
+            self.assertEqual(hashes[ids[0]], previous[ids[0]], 'failed delete retried on the next load')
+            self.assertEqual(hashes[ids[1]], previous[ids[1]], 'failed update resent on the next load')
+            self.assertNotEqual(hashes[ids[2]], previous[ids[2]])
+            self.assertFalse('new' in hashes)
+
+            # a hash file for another index, or an index without documents, is ignored
+            with gzip.open(hash_file, 'rt') as f:
+                lines = f.readlines()
+            self.assertTrue(lines[0].startswith(IncrementalLoad.HEADER))
+            with gzip.open(hash_file, 'wt') as f:
+                f.writelines([IncrementalLoad.HEADER + 'another_index\n'] + lines[1:])
+            self.assertEqual(IncrementalLoad(idx, 'bed', hash_file=hash_file).previous, {})
+            with gzip.open(hash_file, 'wt') as f:
+                f.writelines(lines)
+            self.assertEqual(len(IncrementalLoad(idx, 'bed', hash_file=hash_file).previous), len(lines) - 1)
+            self.assertEqual(IncrementalLoad(idx, 'other_type', hash_file=hash_file).previous, {})
+
+    def test_vcf_info(self):
+        ''' Test VCF INFO sub-fields are loaded as typed fields and can be filtered on. '''
+        vcf_info = VCFInfo({'AF': ('A', 'Float'), 'DP': ('1', 'Integer'), 'DB': ('0', 'Flag')}, ['AF', 'DP', 'DB'])
+        self.assertEqual(vcf_info.parse('AF=0.1,.;DP=12;DB;XX=1'), {'AF': [0.1, None], 'DP': 12, 'DB': True})
+        with self.assertLogs('elastic.management.loaders.utils', level='WARNING') as logs:
+            self.assertEqual(vcf_info.parse('DP=x'), {}, 'value not of the header type left out')
+            vcf_info.parse('DP=y;AF=z')
+            vcf_info.parse('DP=z')
+            vcf_info.log_failures()
+        self.assertEqual(vcf_info.failures, {'DP': 3, 'AF': 1})
+        self.assertEqual(len(logs.output), 4, 'first failure and a summary for each sub-field')
+
+        meta = b'##fileformat=VCFv4.1\n##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">\n'
+        record = b'1\t10\trs1\tA\tC\t.\tPASS\tDP=3\n'
+        for chrom_line in (b'#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n', b''):
+            f = gzip.GzipFile(fileobj=io.BytesIO(gzip.compress(meta + chrom_line + record)))
+            self.assertEqual(VCFInfo.read_header(f), {'DP': ('1', 'Integer')})
+            self.assertEqual(f.readline(), record, 'first data record not consumed')
+
+        marker = MarkerManager()
+        marker.vcf_info = vcf_info
+        doc = marker.parse_line('1\t10\trs1\tA\tC,G\t.\tPASS\tAF=0.2,0.3'.split('\t'), None, None, None, False, False)
+        self.assertEqual(doc['alt'], ['C', 'G'])
+        self.assertEqual(doc['info'], {'AF': [0.2, 0.3]})
+
+        idx = self.load_copy('MARKER', '_vcf', vcfInfo='VC,CAF:Float:R,COMMON,RSPOS:Integer,ASP:Flag')
+        props = Search(idx=idx).get_mapping()[idx]['mappings']['marker']['properties']['info']['properties']
+        self.assertEqual(props['CAF']['type'], 'float')
+        self.assertEqual(props['ASP']['type'], 'boolean')
+
+        query = ElasticQuery.filtered(Query.match_all(), Filter(RangeQuery("info.CAF", gte=0.9)))
+        docs = Search(query, idx=idx).search().docs
+        self.assertGreater(len(docs), 0)
+        for doc in docs:
+            self.assertTrue(max(c for c in getattr(doc, 'info')['CAF'] if c is not None) >= 0.9)
+        query = ElasticQuery.filtered(Query.match_all(), Filter(Query.term("info.VC", "SNV")))
+        self.assertTrue(all(getattr(doc, 'info')['VC'] == 'SNV' for doc in Search(query, idx=idx).search().docs))
+
+    def test_gene_target_scores(self):
+        ''' Test gene target tissue scores are converted and zero scores dropped. '''
+        idx = IDX['GENE_TARGET']['indexName']
+        docs = Search(idx=idx, size=5).search().docs
+        self.assertGreater(len(docs), 0)
+        for doc in docs:
+            self.assertIsInstance(getattr(doc, 'baitStart'), int)
+            self.assertIsInstance(getattr(doc, 'Monocytes'), float)
+
+        gene_target = GeneTargetManager()
+        gene_target.mapping_json = {"gene_target": {"properties": {"ensg": {"type": "string"},
+                                                                   "dist": {"type": "integer"}}}}
+        gene_target.converters = gene_target._plan_converters(['ensg', 'dist'])
+        tissues = GeneTargetManager.tissue_types
+        scores = ['inf', '-inf', 'nan', '1.5'] + ['0'] * (len(tissues) - 4)
+        for score in ('1', 'NA'):
+            doc = gene_target.parse_line(['ENSG1', '10'] + scores[:-1] + [score], ['ensg', 'dist'] + tissues,
+                                         idx, 'gene_target', False, False)
+            self.assertEqual(doc['dist'], 10)
+            self.assertEqual([doc[tissue] for tissue in tissues[:4]], [None, None, None, 1.5], 'finite scores')
+
+        for doc in Search(idx=self.load_copy('GENE_TARGET', '_drop', dropZeroScores=True), size=5).search().docs:
+            for tissue in GeneTargetManager.tissue_types:
+                self.assertNotEqual(getattr(doc, tissue, None), 0)
+
+    def test_binned_markers(self):
+        ''' Test binned range overlap queries find markers, which have no end field. '''
+        idx = self.load_copy('MARKER', '_bins', bins=True)
+        for (start, end) in ((10000, 10030), (10019, 10019), (10030, 10055), (1, 20000)):
+            binned = Search.range_overlap_query('1', start, end, idx=idx, bin_param='bin')
+            unbinned = Search.range_overlap_query('1', start, end, idx=idx)
+            self.assertIn('"bin"', json.dumps(binned.query))
+            self.assertEqual(sorted(d.doc_id() for d in binned.search().docs),
+                             sorted(d.doc_id() for d in unbinned.search().docs))
+        docs = Search.range_overlap_query('1', 10000, 10030, idx=idx, bin_param=True).search().docs
+        self.assertEqual([getattr(doc, 'id') for doc in docs], ['rs775809821'])
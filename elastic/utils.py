@@ -1,17 +1,33 @@
 ''' Utility functions. '''
+from elastic.binning import Binning
 from elastic.query import Query, ScoreFunction, FunctionScoreQuery, BoolQuery,\
-    RangeQuery, OrFilter
-from elastic.search import ElasticQuery, Search
+    RangeQuery, OrFilter, Filter
+from elastic.elastic_settings import ElasticSettings
+from elastic.exceptions import QueryError
+from elastic.result import Result
+from elastic.search import ElasticQuery, Search, MultiSearch
+import logging
 import random
 
 
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
 class ElasticUtils(object):
     ''' Utility functions. '''
+    MAX_RESULT_WINDOW = 10000    # Elastic default index.max_result_window
 
     @classmethod
     def get_docs_count(cls, idx, idx_type, search_query=None):
         '''Get index or search doc counts'''
-        return Search(idx=idx, idx_type=idx_type, search_query=search_query, size=0).get_count()['count']
+        return Search(idx=idx, idx_type=idx_type, search_query=search_query,
+                      size=0).get_count(filter_path='count')['count']
+
+    @classmethod
+    def docs_exist(cls, idx, idx_type, search_query=None):
+        ''' Test if the index has any docs or any that match the search query. '''
+        return Search(idx=idx, idx_type=idx_type, search_query=search_query).exists()
 
     @classmethod
     def get_rdm_feature_id(cls, idx, idx_type, qbool=Query.match_all(), sources=[], field=None):
@@ -48,11 +64,134 @@ class ElasticUtils(object):
 
     @classmethod
     def range_overlap_query(cls, seqid, start_range, end_range,
-                            field_list=None, seqid_param="seqid", start_param="start", end_param="end"):
-        ''' Constructs a range overlap query '''
+                            field_list=None, seqid_param="seqid", start_param="start", end_param="end",
+                            bin_param=None):
+        ''' Constructs a range overlap query. If the documents have been binned (see
+        L{Binning}) the name of the bin field, I{bin_param}, can be given to filter
+        on the bins that can overlap the range before the range checks. Documents
+        without an end field (I{e.g.} markers) end at their start. '''
+        if bin_param is not None:
+            bins = Binning.overlapping_bins(start_range, end_range)
+            no_end = BoolQuery(must_arr=[RangeQuery(start_param, gte=start_range)],
+                               must_not_arr=[Query({"exists": {"field": end_param}})])
+            ranges = [RangeQuery(start_param, lte=end_range),
+                      BoolQuery(should_arr=[RangeQuery(end_param, gte=start_range), no_end])]
+            if len(bins) <= Binning.MAX_QUERY_BINS:
+                ranges.insert(0, Query.terms(bin_param, bins))
+            return ElasticQuery.filtered(Query.term(seqid_param, seqid), Filter(BoolQuery(must_arr=ranges)),
+                                         field_list)
+
         query_bool = BoolQuery(must_arr=[RangeQuery(start_param, lte=start_range),
                                          RangeQuery(end_param, gte=end_range)])
         or_filter = OrFilter(RangeQuery(start_param, gte=start_range, lte=end_range))
         or_filter.extend(RangeQuery(end_param, gte=start_range, lte=end_range)) \
                  .extend(query_bool)
         return ElasticQuery.filtered(Query.term(seqid_param, seqid), or_filter, field_list)
+
+    @classmethod
+    def range_overlap_batch(cls, intervals, idx, size=1000, field_list=None, seqid_param="seqid",
+                            start_param="start", end_param="end", bin_param=None, named_queries=False,
+                            obj_document=None):
+        ''' Find the documents overlapping each of a list of intervals in a single request.
+        Overlapping and adjacent intervals are merged so each document is fetched once;
+        the same L{Document} is returned for each interval it overlaps.
+        @type  intervals: list
+        @param intervals: (seqid, start, end) intervals.
+        @type  idx: string
+        @param idx: Index to search.
+        @type  size: integer
+        @keyword size: Maximum number of hits for each merged interval (default: 1000).
+        @type  field_list: list
+        @keyword field_list: The _source fields to return (the start and end fields are added).
+        @type  bin_param: string
+        @keyword bin_param: Genomic bin field, or True for the bin field if it is in the
+        index mapping (default: None, the bins are not used, see L{Search.range_overlap_query}).
+        @type  named_queries: bool
+        @keyword named_queries: Use one search with a named query for each merged
+        interval rather than a multi search (default: False). A multi search is used
+        if I{size} times the number of merged intervals is over the result window
+        (L{MAX_RESULT_WINDOW}) or if there are more hits than that.
+        @return: list of L{Document} lists, one for each interval
+        '''
+        if obj_document is None:
+            obj_document = ElasticSettings.get_document_factory()
+        bin_param = Search._bin_param(idx, start_param, bin_param)
+        if field_list is not None:
+            field_list = list(field_list) + [f for f in (start_param, end_param) if f not in field_list]
+        regions = cls.merge_intervals(intervals)
+
+        queries = [cls.range_overlap_query(seqid, start, end, field_list=field_list, seqid_param=seqid_param,
+                                           start_param=start_param, end_param=end_param,
+                                           bin_param=bin_param)
+                   for (seqid, start, end, _) in regions]
+        region_hits = None
+        if named_queries and size * len(regions) > cls.MAX_RESULT_WINDOW:
+            logger.debug("Range overlap size over the result window, using a multi search")
+        elif named_queries and len(regions) > 0:
+            should = [Query({"bool": {"filter": q.query['query'], "_name": str(i)}})
+                      for (i, q) in enumerate(queries)]
+            search = Search(ElasticQuery(BoolQuery(should_arr=should), sources=field_list),
+                            idx=idx, size=size * len(regions))
+            json_response = search.get_json_response()
+            if isinstance(json_response, str) or 'error' in json_response:
+                raise QueryError("Range overlap error: " + str(json_response))
+            hits_total = Result.parse_total(json_response)[0]
+            if hits_total is not None and hits_total <= search.size:
+                region_hits = [[] for _ in regions]
+                for hit in json_response['hits']['hits']:
+                    for name in hit.get('matched_queries', []):
+                        region_hits[int(name)].append(hit)
+                for (i, hits) in enumerate(region_hits):
+                    if len(hits) > size:
+                        logger.warning("Range overlap hits truncated to " + str(size) + ": " + str(regions[i][:3]))
+                        region_hits[i] = hits[:size]
+            else:
+                # hits of some regions could be missing so search each region
+                logger.debug("Range overlap hits over " + str(search.size) + " (or unknown), using a multi search")
+        if region_hits is None:
+            region_hits = [[] for _ in regions]
+            searches = [Search(q, idx=idx, size=size) for q in queries]
+            for (i, json_response) in enumerate(MultiSearch(searches).get_json_responses()):
+                if 'error' in json_response:
+                    raise QueryError("Range overlap error: " + str(regions[i][:3]) + ' ' +
+                                     str(json_response['error']))
+                if (Result.parse_total(json_response)[0] or 0) > size:
+                    logger.warning("Range overlap hits truncated to " + str(size) + ": " + str(regions[i][:3]))
+                region_hits[i] = json_response['hits']['hits']
+
+        results = [[] for _ in intervals]
+        for ((seqid, start, end, members), hits) in zip(regions, region_hits):
+            for hit in hits:
+                hit_start = cls._source_value(hit, start_param)
+                if hit_start is None:
+                    continue
+                hit_end = cls._source_value(hit, end_param)
+                if hit_end is None:
+                    hit_end = hit_start    # e.g. markers have no end
+                doc = obj_document(hit)
+                for i in members:
+                    if hit_start <= intervals[i][2] and hit_end >= intervals[i][1]:
+                        results[i].append(doc)
+        return results
+
+    @classmethod
+    def merge_intervals(cls, intervals):
+        ''' Merge overlapping and adjacent intervals. Returns (seqid, start, end, members)
+        for each merged interval, where members are the indices of the intervals merged. '''
+        regions = []
+        for i in sorted(range(len(intervals)), key=lambda i: (str(intervals[i][0]), intervals[i][1])):
+            (seqid, start, end) = intervals[i]
+            if len(regions) > 0 and regions[-1][0] == seqid and start <= regions[-1][2] + 1:
+                regions[-1][2] = max(regions[-1][2], end)
+                regions[-1][3].append(i)
+            else:
+                regions.append([seqid, start, end, [i]])
+        return [tuple(r) for r in regions]
+
+    @classmethod
+    def _source_value(cls, hit, name):
+        ''' Return the _source value of a (dotted) field name or None if it is missing. '''
+        value = hit.get('_source', {})
+        for part in name.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
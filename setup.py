@@ -26,13 +26,15 @@ setup(
     long_description=open(os.path.join(ROOT, 'README.rst')).read(),
     install_requires=["requests>=2.7.0", "Django>=1.8.4,<1.9", "djangorestframework>=3.2.4",
                       "markdown>=2.6.2", "django-filter>=0.11.0", "django-rest-swagger==0.3.4"],
+    extras_require={'columns': ["numpy>=1.9"], 'async': ["aiohttp>=2.0"],
+                    'fastjson': ["orjson>=3.0"]},
     classifiers=[
         'Environment :: Web Environment',
         'Framework :: Django',
         'Intended Audience :: Developers',
         'Operating System :: OS Independent',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3.5',
         'Topic :: Internet :: WWW/HTTP',
         'Topic :: Internet :: WWW/HTTP :: Dynamic Content',
     ],